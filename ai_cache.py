@@ -0,0 +1,155 @@
+import hashlib
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+from cache import MISSING, TTLCache
+from metrics import MetricsRegistry
+
+load_dotenv()
+
+# -----------------------------
+# Второй уровень кэша: таблица в PostgreSQL (общая для всех ботов и перезапусков)
+# -----------------------------
+AI_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ai_responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_ai_responses_created_at ON ai_responses (created_at);
+"""
+
+AI_CACHE_SELECT = """
+SELECT answer FROM ai_responses
+WHERE key = %s AND created_at > now() - make_interval(secs => %s)
+"""
+
+AI_CACHE_UPSERT = """
+INSERT INTO ai_responses (key, model, answer) VALUES (%s, %s, %s)
+ON CONFLICT (key) DO UPDATE SET answer = EXCLUDED.answer, created_at = now()
+"""
+
+AI_CACHE_PURGE = "DELETE FROM ai_responses WHERE created_at <= now() - make_interval(secs => %s)"
+
+
+def normalize_prompt(prompt):
+    """
+    Приводит вопрос к каноническому виду, чтобы почти одинаковые вопросы
+    («Какие документы нужны в Германию?» и «какие  документы нужны в германию»)
+    попадали в одну запись кэша
+    """
+    text = prompt.lower().replace("ё", "е")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" .,!?…")
+
+
+def cache_key(prompt, role_context, model):
+    """Ключ записи: хэш нормализованного вопроса, контекста роли и модели"""
+    raw = "\x00".join((model, role_context.strip(), normalize_prompt(prompt)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AIResponseCache:
+    """
+    Кэш ответов ИИ: в памяти (TTL + LRU) и, если включено, в PostgreSQL.
+    В кэш кладутся только успешные ответы — вызывающий код сохраняет ответ
+    через set() лишь после удачного обращения к модели.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, use_database=None):
+        self.ttl = int(ttl or os.getenv('AI_CACHE_TTL', '86400'))
+        self.memory = TTLCache(int(max_entries or os.getenv('AI_CACHE_MAX_ENTRIES', '1000')), self.ttl)
+        if use_database is None:
+            use_database = os.getenv('AI_CACHE_DB', '0') == '1'
+        self.use_database = use_database
+        self.metrics = MetricsRegistry()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def get(self, prompt, role_context, model):
+        """Сохранённый ответ или None"""
+        key = cache_key(prompt, role_context, model)
+        with self.metrics.timer('lookup'):
+            answer = self.memory.get(key)
+            if answer is not MISSING:
+                self.metrics.incr('hits_memory')
+                return answer
+
+            answer = self._db_get(key) if self.use_database else None
+            if answer is not None:
+                self.metrics.incr('hits_db')
+                self.memory.set(key, answer)
+                return answer
+
+        self.metrics.incr('misses')
+        return None
+
+    def set(self, prompt, role_context, model, answer):
+        """Сохранить успешный ответ модели"""
+        if not answer or not answer.strip():
+            return
+        key = cache_key(prompt, role_context, model)
+        self.memory.set(key, answer)
+        self.metrics.incr('stores')
+        if self.use_database:
+            self._db_set(key, model, answer)
+
+    def clear(self):
+        """Очистить кэш в памяти (таблица в PostgreSQL не трогается)"""
+        self.memory.clear()
+
+    def stats(self):
+        """Попадания (в памяти и в базе), промахи и доля попаданий"""
+        stats = self.metrics.snapshot()
+        counters = stats['counters']
+        hits = counters.get('hits_memory', 0) + counters.get('hits_db', 0)
+        lookups = hits + counters.get('misses', 0)
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        stats['memory'] = self.memory.stats()
+        stats['database'] = self.use_database
+        return stats
+
+    # -----------------------------
+    # PostgreSQL
+    # -----------------------------
+    def _ensure_schema(self, connection):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                with connection.cursor() as cursor:
+                    cursor.execute(AI_CACHE_SCHEMA)
+                    cursor.execute(AI_CACHE_PURGE, (self.ttl,))
+                connection.commit()
+                self._schema_ready = True
+
+    def _db_get(self, key):
+        from database import db
+        try:
+            with db.get_connection() as connection:
+                self._ensure_schema(connection)
+                with connection.cursor() as cursor:
+                    cursor.execute(AI_CACHE_SELECT, (key, self.ttl))
+                    row = cursor.fetchone()
+                connection.commit()
+            return row[0] if row else None
+        except Exception as e:
+            self.metrics.incr('db_errors')
+            print(f"Ошибка при чтении кэша ответов ИИ: {e}")
+            return None
+
+    def _db_set(self, key, model, answer):
+        from database import db
+        try:
+            with db.get_connection() as connection:
+                self._ensure_schema(connection)
+                with connection.cursor() as cursor:
+                    cursor.execute(AI_CACHE_UPSERT, (key, model, answer))
+                connection.commit()
+        except Exception as e:
+            self.metrics.incr('db_errors')
+            print(f"Ошибка при сохранении ответа ИИ в кэш: {e}")
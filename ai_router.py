@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from metrics import MetricsRegistry
+
+load_dotenv()
+
+
+class RoutedAnswer:
+    """Ответ ИИ вместе с моделью, которая его дала"""
+
+    __slots__ = ('text', 'model', 'elapsed', 'hedged')
+
+    def __init__(self, text, model, elapsed=0.0, hedged=False):
+        self.text = text
+        self.model = model          # None — ответ не от модели (ошибка)
+        self.elapsed = elapsed
+        self.hedged = hedged        # был ли отправлен дублирующий запрос
+
+    def __str__(self):
+        return self.text
+
+
+class ModelStats:
+    """Скользящие задержки и доля ошибок одной модели по последним window запросам"""
+
+    def __init__(self, window=50):
+        self.outcomes = deque(maxlen=window)   # (секунды, успех)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.outcomes.append((seconds, ok))
+
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def latency(self, percent=50):
+        """Перцентиль задержки успешных запросов, None — замеров ещё нет"""
+        with self._lock:
+            ordered = sorted(seconds for seconds, ok in self.outcomes if ok)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+    def snapshot(self):
+        p50, p95 = self.latency(50), self.latency(95)
+        return {
+            'samples': len(self.outcomes),
+            'error_rate': self.error_rate(),
+            'p50_ms': p50 * 1000 if p50 is not None else None,
+            'p95_ms': p95 * 1000 if p95 is not None else None,
+        }
+
+
+class HedgedRouter:
+    """
+    Маршрутизатор запросов между несколькими моделями.
+
+    Сначала запрос уходит в выбранную (или самую здоровую) модель. Если за
+    hedge_delay секунд ответа нет, отправляется дублирующий запрос в следующую
+    модель; при ошибке следующая модель вызывается сразу. Побеждает первый
+    успешный ответ. Уже отправленный HTTP-запрос проигравшей модели прервать
+    нельзя, поэтому его результат просто отбрасывается (но учитывается в статистике).
+
+    call(model, prompt, role_context) -> str — вызов одной модели, ошибки — исключениями.
+    """
+
+    def __init__(self, call, models, hedge_delay=None, timeout=None, window=50, unhealthy_error_rate=0.5):
+        self.call = call
+        self.models = list(models)
+        self.hedge_delay = float(hedge_delay or os.getenv('AI_HEDGE_DELAY', '6'))
+        self.timeout = float(timeout or os.getenv('AI_TIMEOUT', '30'))
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self.model_stats = {model: ModelStats(window) for model in self.models}
+        self.metrics = MetricsRegistry()
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.models), thread_name_prefix="ai-router")
+
+    def rank(self, preferred=None):
+        """
+        Порядок моделей: выбранная пользователем — первой, если она здорова;
+        остальные — по доле ошибок, затем по медианной задержке
+        """
+        def score(model):
+            stats = self.model_stats[model]
+            latency = stats.latency(50)
+            return (stats.error_rate() >= self.unhealthy_error_rate, latency is None, latency or 0.0)
+
+        ordered = sorted(self.models, key=score)
+        if preferred in self.model_stats and not score(preferred)[0]:
+            ordered.remove(preferred)
+            ordered.insert(0, preferred)
+        return ordered
+
+    def _timed_call(self, model, prompt, role_context):
+        started = time.monotonic()
+        try:
+            text = self.call(model, prompt, role_context)
+            if not text or not text.strip():
+                raise ValueError("пустой ответ модели")
+        except Exception:
+            elapsed = time.monotonic() - started
+            self.model_stats[model].record(elapsed, ok=False)
+            self.metrics.observe(model, elapsed, error=True)
+            raise
+        elapsed = time.monotonic() - started
+        self.model_stats[model].record(elapsed, ok=True)
+        self.metrics.observe(model, elapsed)
+        return text
+
+    def ask(self, prompt, role_context="", preferred=None):
+        """Первый успешный ответ (RoutedAnswer); если все модели не справились — исключение последней"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waiting = self.rank(preferred)
+        running = {}
+        launched = []
+        last_error = None
+
+        def launch():
+            model = waiting.pop(0)
+            launched.append(model)
+            running[self._executor.submit(self._timed_call, model, prompt, role_context)] = model
+
+        launch()
+        next_hedge_at = started + self.hedge_delay
+        while running:
+            now = time.monotonic()
+            wake_at = min(deadline, next_hedge_at) if waiting else deadline
+            done, _ = wait(running, timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                model = running.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+
+                for loser in running:
+                    loser.cancel()
+                    self.metrics.incr('abandoned')
+                self.metrics.incr(f'served.{model}')
+                return RoutedAnswer(text, model, time.monotonic() - started, hedged=len(launched) > 1)
+
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if waiting and (not running or now >= next_hedge_at):
+                self.metrics.incr('hedged' if running else 'failover')
+                launch()
+                next_hedge_at = now + self.hedge_delay
+
+        for future in running:
+            future.cancel()
+        self.metrics.incr('failed')
+        raise last_error or TimeoutError(f"нет ответа от моделей за {self.timeout:.0f} с")
+
+    def stats(self):
+        """Задержки и доля ошибок по моделям, счётчики дублирующих запросов"""
+        stats = self.metrics.snapshot()
+        stats['models'] = {model: model_stats.snapshot() for model, model_stats in self.model_stats.items()}
+        return stats
@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import Future
+from functools import partial
+
+from send_scheduler import sent_message
+
+# Telegram не принимает сообщения длиннее 4096 символов
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class StreamingMessage:
+    """
+    Постепенно дописывает ответ ИИ в уже отправленное сообщение.
+    Правки объединяются: сообщение обновляется не чаще раза в min_interval секунд
+    и только если текст вырос хотя бы на min_delta символов, чтобы не упираться
+    в ограничения Telegram на частоту edit_message_text.
+
+    message — результат bot.send_message (Message или Future из очереди
+    send_scheduler); первая правка дожидается его отправки.
+    """
+
+    def __init__(self, bot, chat_id, message, prefix="💡 ", min_interval=1.5, min_delta=40):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message = message
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.edits = 0
+        self._sent_text = ""
+        self._last_edit = 0.0
+
+    def update(self, text):
+        """Новый (накопленный) текст ответа; правка уходит, только если пора"""
+        now = time.monotonic()
+        if now - self._last_edit < self.min_interval or len(text) - len(self._sent_text) < self.min_delta:
+            return
+        self._edit(text[:TELEGRAM_MESSAGE_LIMIT - len(self.prefix) - 2] + " ▌")
+        self._last_edit = now
+
+    def finish(self, text):
+        """Окончательный текст: последняя правка, а всё, что не влезло в одно сообщение, — новыми сообщениями"""
+        limit = TELEGRAM_MESSAGE_LIMIT - len(self.prefix)
+        if not self._edit(text[:limit], wait=True):
+            # Правка не прошла — иначе пользователь так и останется с заглушкой
+            self.bot.send_message(self.chat_id, self.prefix + text[:limit])
+        for start in range(limit, len(text), TELEGRAM_MESSAGE_LIMIT):
+            self.bot.send_message(self.chat_id, text[start:start + TELEGRAM_MESSAGE_LIMIT])
+
+    def _edit(self, text, wait=False):
+        """
+        Правка сообщения; False — правка не удалась.
+        Если bot.edit_message_text вернул Future (очередь send_scheduler), текст
+        считается отправленным только после успешной отправки; wait — дождаться её.
+        """
+        if text == self._sent_text:
+            return True
+        try:
+            message_id = sent_message(self.message).message_id
+            result = self.bot.edit_message_text(chat_id=self.chat_id, message_id=message_id, text=self.prefix + text)
+            if isinstance(result, Future):
+                if not wait:
+                    result.add_done_callback(partial(self._edited, text))
+                    return True
+                result.result()
+        except Exception as e:
+            print(f"Ошибка при обновлении ответа ИИ: {e}")
+            return False
+        self._sent_text = text
+        self.edits += 1
+        return True
+
+    def _edited(self, text, future):
+        if future.exception() is None:
+            self._sent_text = text
+            self.edits += 1
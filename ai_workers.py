@@ -0,0 +1,59 @@
+import queue
+import threading
+import time
+
+from metrics import MetricsRegistry
+
+
+class AIWorkerPool:
+    """
+    Очередь запросов к ИИ и пул потоков, которые её разбирают.
+    Обработчик бота кладёт задачу в очередь и сразу освобождается;
+    если очередь заполнена, submit возвращает False.
+    """
+
+    def __init__(self, workers=4, max_queue=100, name="ai"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.metrics = MetricsRegistry()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        for number in range(workers):
+            threading.Thread(target=self._work, name=f"{name}-worker-{number}", daemon=True).start()
+
+    def submit(self, job, *args):
+        """Поставить job(*args) в очередь. False — очередь переполнена"""
+        try:
+            self._queue.put_nowait((time.monotonic(), job, args))
+        except queue.Full:
+            self.metrics.incr('rejected')
+            return False
+        self.metrics.incr('submitted')
+        return True
+
+    def _work(self):
+        while True:
+            enqueued_at, job, args = self._queue.get()
+            self.metrics.observe('queue_wait', time.monotonic() - enqueued_at)
+            with self._lock:
+                self._in_flight += 1
+            try:
+                with self.metrics.timer('job'):
+                    job(*args)
+            except Exception as e:
+                print(f"❌ Ошибка в задаче ИИ: {e}")
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                self._queue.task_done()
+
+    def stats(self):
+        """Глубина очереди, занятые потоки, время ожидания в очереди и выполнения"""
+        stats = self.metrics.snapshot()
+        stats['queue_depth'] = self._queue.qsize()
+        stats['max_queue'] = self.max_queue
+        stats['workers'] = self.workers
+        stats['in_flight'] = self._in_flight
+        return stats
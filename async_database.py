@@ -0,0 +1,352 @@
+"""
+Асинхронный доступ к PostgreSQL для ботов на asyncio (asyncpg + пул соединений).
+
+AsyncDatabase повторяет методы database.Database (те же SQL-запросы из
+PREPARED_STATEMENTS, тот же формат результата), только все методы — корутины.
+Статистика методов и запросов, журнал медленных запросов (query_stats,
+dump_stats, slow_queries) — общие с Database (database.QueryStats):
+
+    from async_database import async_db
+    countries = await async_db.get_countries()
+
+Совпадение результатов с синхронной версией проверяет test_async_database.py:
+    python -m pytest test_async_database.py   # без базы; с базой — ещё и на настоящих данных
+"""
+import asyncio
+import copy
+import functools
+import json
+import os
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+from cache import MISSING, TTLCache
+from database import (
+    CACHE_TTLS,
+    DIRECTION_KEYWORD_INSERT,
+    DIRECTION_TAGS_EXIST_QUERY,
+    DIRECTION_TAGS_FILLED_QUERY,
+    DIRECTION_TAGS_SCHEMA,
+    PREPARED_STATEMENTS,
+    UNIVERSITY_SECTION_QUERIES,
+    QueryStats,
+    _cache_key,
+    _row_count,
+    build_university,
+    direction_keyword_rows,
+    direction_patterns,
+    format_programs,
+    numbered_placeholders as to_asyncpg,
+)
+from directions import DIRECTION_KEYWORDS
+
+load_dotenv()
+
+# Те же запросы с плейсхолдерами $1, $2, ... — asyncpg сам готовит их на сервере
+# и держит подготовленными в кэше соединения (statement_cache_size)
+ASYNC_STATEMENTS = {name: to_asyncpg(query) for name, query in PREPARED_STATEMENTS.items()}
+
+
+def _borrows_connection(error_message, default, cached=False):
+    """Асинхронный аналог database._borrows_connection"""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            key = None
+            if cached and self.cache is not None and not kwargs:
+                key = _cache_key(method.__name__, args)
+                value = self.cache.get(key)
+                if value is not MISSING:
+                    return value
+
+            started = time.perf_counter()
+            for attempt in (1, 2):
+                try:
+                    async with self.get_connection() as connection:
+                        value = await method(self, connection, *args, **kwargs)
+                    self.stats.observe(method.__name__, time.perf_counter() - started, rows=_row_count(value))
+                    if key is not None:
+                        self.cache.set(key, value, ttl=CACHE_TTLS[method.__name__])
+                    return value
+                except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError) as e:
+                    if attempt == 1:
+                        self.stats.incr('retries')
+                        continue
+                    print(f"{error_message}: {e}")
+                except Exception as e:
+                    print(f"{error_message}: {e}")
+                    break
+            self.stats.observe(method.__name__, time.perf_counter() - started, error=True)
+            return copy.copy(default)
+        return wrapper
+    return decorator
+
+
+class _PooledConnection:
+    """async with: взять соединение из пула и учесть время ожидания"""
+
+    def __init__(self, database):
+        self.database = database
+        self.connection = None
+
+    async def __aenter__(self):
+        await self.database._ensure_pool()
+        started = time.monotonic()
+        self.connection = await self.database.pool.acquire(timeout=self.database.timeout)
+        waited = time.monotonic() - started
+
+        stats = self.database._stats
+        stats['checkouts'] += 1
+        stats['wait_total'] += waited
+        stats['wait_max'] = max(stats['wait_max'], waited)
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.database.pool.release(self.connection)
+
+
+class AsyncDatabase(QueryStats):
+    def __init__(self, minconn=None, maxconn=None, timeout=None, cache=None):
+        self.minconn = int(minconn or os.getenv('DB_POOL_MIN', '1'))
+        self.maxconn = int(maxconn or os.getenv('DB_POOL_MAX', '10'))
+        self.timeout = float(timeout or os.getenv('DB_POOL_TIMEOUT', '10'))
+
+        if cache is None:
+            cache = os.getenv('DB_CACHE', '1') != '0'
+        self.cache = TTLCache(int(os.getenv('DB_CACHE_MAX_ENTRIES', '2048'))) if cache else None
+
+        # Растёт при каждом сбросе кэша (как Database.catalog_version)
+        self.catalog_version = 0
+        # Разметка по направлениям — как Database._direction_tags
+        self._direction_tags = None
+        self._direction_tags_lock = None
+        self._init_query_stats()
+
+        # Пул создаётся при первом обращении, в том event loop, где он используется
+        self.pool = None
+        self._pool_lock = None
+        self._stats = {
+            'checkouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    async def connect(self):
+        """Подключение к PostgreSQL (создание пула соединений)"""
+        started = time.monotonic()
+        try:
+            self.pool = await asyncpg.create_pool(
+                min_size=self.minconn,
+                max_size=self.maxconn,
+                host=os.getenv('DB_HOST', 'localhost'),
+                port=int(os.getenv('DB_PORT', '5433')),
+                database=os.getenv('DB_NAME', 'bot_db'),
+                user=os.getenv('DB_USER', 'postgres'),
+                password=os.getenv('DB_PASSWORD', '1234'),
+                init=self._init_connection
+            )
+            elapsed = (time.monotonic() - started) * 1000
+            print(f"✅ Асинхронное подключение к базе данных установлено за {elapsed:.0f} мс (пул {self.minconn}–{self.maxconn})")
+        except Exception as e:
+            print(f"❌ Ошибка подключения к базе данных: {e}")
+            raise
+
+    @staticmethod
+    async def _init_connection(connection):
+        # json/json_agg возвращаются как list/dict — так же, как в psycopg2
+        await connection.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+    async def _ensure_pool(self):
+        if self.pool is not None:
+            return
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self.pool is None:
+                await self.connect()
+
+    async def warmup(self):
+        """Подключиться заранее и проверить, что база отвечает"""
+        started = time.monotonic()
+        async with self.get_connection() as connection:
+            await connection.fetchval("SELECT 1")
+        elapsed = (time.monotonic() - started) * 1000
+        print(f"✅ База данных готова к работе ({elapsed:.0f} мс)")
+
+    def get_connection(self):
+        """async with db.get_connection() as connection: ..."""
+        return _PooledConnection(self)
+
+    def pool_stats(self):
+        """Статистика пула: число выдач и ожидание свободного соединения"""
+        stats = dict(self._stats)
+        stats['wait_avg'] = stats['wait_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        if self.pool is not None:
+            stats['size'] = self.pool.get_size()
+            stats['idle'] = self.pool.get_idle_size()
+        return stats
+
+    def invalidate_cache(self, method=None):
+        """Сбросить кэш каталога (весь или одного метода)"""
+        self.catalog_version += 1
+        if self.cache is None:
+            return
+        if method is None:
+            self.cache.clear()
+        else:
+            self.cache.remove_where(lambda key: key[0] == method)
+
+    async def _fetch(self, connection, statement, *params):
+        """Выполнить запрос из PREPARED_STATEMENTS, учесть время и медленные запросы"""
+        started = time.perf_counter()
+        rows = await connection.fetch(ASYNC_STATEMENTS[statement], *params)
+        self._observe_query(statement, params, time.perf_counter() - started, len(rows))
+        return rows
+
+    async def _fetchrow(self, connection, statement, *params):
+        rows = await self._fetch(connection, statement, *params)
+        return rows[0] if rows else None
+
+    # -----------------------------
+    # Произвольные запросы (аналог db_select / db_execute из tgbot_final.py)
+    # -----------------------------
+    async def fetch(self, query, params=None):
+        """SELECT с плейсхолдерами %s, возвращает список записей"""
+        async with self.get_connection() as connection:
+            return await connection.fetch(to_asyncpg(query), *(params or ()))
+
+    async def execute(self, query, params=None):
+        """INSERT/UPDATE/DELETE с плейсхолдерами %s"""
+        async with self.get_connection() as connection:
+            return await connection.execute(to_asyncpg(query), *(params or ()))
+
+    # -----------------------------
+    # Каталог
+    # -----------------------------
+    @_borrows_connection("Ошибка при получении стран", [], cached=True)
+    async def get_countries(self, connection):
+        """Получить все страны"""
+        return await self._fetch(connection, 'countries')
+
+    @_borrows_connection("Ошибка при получении университетов", [], cached=True)
+    async def get_universities_by_country(self, connection, country_name):
+        """Получить университеты по названию страны"""
+        return await self._fetch(connection, 'universities_by_country', country_name)
+
+    @_borrows_connection("Ошибка при получении университетов", [], cached=True)
+    async def get_universities_by_country_id(self, connection, country_id):
+        """Получить университеты страны по её id"""
+        return await self._fetch(connection, 'universities_by_country_id', country_id)
+
+    @_borrows_connection("Ошибка при получении информации об университете", None, cached=True)
+    async def get_university_by_name(self, connection, country_name, university_name):
+        """Получить полную информацию об университете по названию и стране"""
+        row = await self._fetchrow(connection, 'university_by_name', country_name, university_name)
+        return build_university(row) if row else None
+
+    @_borrows_connection("Ошибка при получении информации об университете", None, cached=True)
+    async def get_university_by_id(self, connection, university_id):
+        """Получить полную информацию об университете по id"""
+        row = await self._fetchrow(connection, 'university_by_id', university_id)
+        return build_university(row) if row else None
+
+    async def get_universities_full(self, university_ids):
+        """
+        Полная информация о нескольких университетах за один запрос (порядок — как в university_ids).
+        Как и Database.get_universities_full, берёт карточки из кэша get_university_by_id
+        и кладёт туда загруженные.
+        """
+        university_ids = list(dict.fromkeys(university_ids))
+        found = {}
+
+        if self.cache is not None:
+            for university_id in university_ids:
+                value = self.cache.get(_cache_key('get_university_by_id', (university_id,)))
+                if value is not MISSING and value is not None:
+                    found[university_id] = value
+
+        missing = [university_id for university_id in university_ids if university_id not in found]
+        if missing:
+            for university in await self._fetch_universities(missing):
+                found[university['id']] = university
+                if self.cache is not None:
+                    self.cache.set(_cache_key('get_university_by_id', (university['id'],)), university,
+                                   ttl=CACHE_TTLS['get_university_by_id'])
+
+        return [found[university_id] for university_id in university_ids if university_id in found]
+
+    @_borrows_connection("Ошибка при получении информации об университетах", [])
+    async def _fetch_universities(self, connection, university_ids):
+        return [build_university(row) for row in await self._fetch(connection, 'universities_by_ids', university_ids)]
+
+    @_borrows_connection("Ошибка при получении раздела университета", None, cached=True)
+    async def get_university_section(self, connection, university_id, section):
+        """Получить один раздел карточки университета одним запросом"""
+        if section not in UNIVERSITY_SECTION_QUERIES:
+            return None
+
+        if section == 'programs':
+            return format_programs(await self._fetch(connection, 'section_programs', university_id))
+        row = await self._fetchrow(connection, f'section_{section}', university_id)
+        return row[0] if row else None
+
+    @_borrows_connection("Ошибка при поиске университетов по направлению", [], cached=True)
+    async def search_universities_by_direction(self, connection, direction_key):
+        """Университеты направления (по разметке; без неё — по ключевым словам, как Database)"""
+        if await self._ensure_direction_tags(connection):
+            return await self._fetch(connection, 'direction_search', direction_key)
+        patterns = direction_patterns(direction_key)
+        return await self._fetch(connection, 'direction_keyword_search', patterns, patterns)
+
+    async def _ensure_direction_tags(self, connection):
+        """Асинхронный аналог Database._ensure_direction_tags"""
+        if self._direction_tags is not None:
+            return self._direction_tags
+        if self._direction_tags_lock is None:
+            self._direction_tags_lock = asyncio.Lock()
+        async with self._direction_tags_lock:
+            if self._direction_tags is not None:
+                return self._direction_tags
+            try:
+                ready = await connection.fetchval(DIRECTION_TAGS_EXIST_QUERY)
+                if ready:
+                    ready = await connection.fetchval(DIRECTION_TAGS_FILLED_QUERY)
+                if not ready:
+                    await self._sync_direction_tags(connection, DIRECTION_KEYWORDS)
+                self._direction_tags = True
+            except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError):
+                raise
+            except asyncpg.PostgresError as e:
+                self._direction_tags = False
+                print(f"⚠️ Нет разметки по направлениям, создать её не удалось ({e}) — поиск по ключевым словам")
+            return self._direction_tags
+
+    async def sync_direction_tags(self, keywords_map=DIRECTION_KEYWORDS):
+        """Асинхронный аналог Database.sync_direction_tags: таблицы, триггеры и разметка по направлениям"""
+        async with self.get_connection() as connection:
+            await self._sync_direction_tags(connection, keywords_map)
+        self._direction_tags = True
+        self.invalidate_cache('search_universities_by_direction')
+
+    async def _sync_direction_tags(self, connection, keywords_map):
+        with self.stats.timer('sync_direction_tags'):
+            async with connection.transaction():
+                await connection.execute(DIRECTION_TAGS_SCHEMA)
+                await connection.execute("DELETE FROM direction_keywords")
+                await connection.executemany(to_asyncpg(DIRECTION_KEYWORD_INSERT), direction_keyword_rows(keywords_map))
+                await connection.execute("SELECT refresh_university_directions(id) FROM universities")
+        print("✅ Разметка университетов по направлениям обновлена")
+
+    async def close(self):
+        """Закрыть все соединения с базой данных"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            print("Соединение с базой данных закрыто")
+
+# Глобальный экземпляр (подключение — при первом запросе)
+async_db = AsyncDatabase()
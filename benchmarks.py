@@ -0,0 +1,506 @@
+"""
+Замеры производительности бота.
+
+Запуск:
+    python benchmarks.py university_details [--repeat 200]
+    python benchmarks.py catalog_cache
+    python benchmarks.py prepared_statements [--threads 8]
+    python benchmarks.py sessions [--repeat 200]   # repeat × 50 пользователей
+    python benchmarks.py callback_routing
+    python benchmarks.py keyboards
+    python benchmarks.py catalog [--size 10000]
+    python benchmarks.py snapshot [--size 10000] [--processes 4]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from database import PREPARED_STATEMENTS, db
+
+
+def _measure(func, repeat):
+    """Прогнать func repeat раз, вернуть список времён в миллисекундах"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def _report(title, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+    print(f"{title:<40} median {statistics.median(timings):8.3f} ms   p95 {p95:8.3f} ms")
+
+
+def _first_university():
+    """Любой университет из базы — для замеров"""
+    for country in db.get_countries():
+        universities = db.get_universities_by_country(country['name'])
+        if universities:
+            return universities[0]
+    return None
+
+
+# -----------------------------
+# Карточка университета: 7 запросов против одного
+# -----------------------------
+def _university_details_sequential(cursor, country_name, university_name):
+    """Прежняя реализация get_university_by_name: семь последовательных запросов"""
+    cursor.execute("""
+        SELECT u.id, u.name, u.card, u.website, c.name as country_name
+        FROM universities u
+        JOIN countries c ON u.country_id = c.id
+        WHERE c.name = %s AND u.name = %s
+    """, (country_name, university_name))
+    university_id = cursor.fetchone()[0]
+    cursor.execute("SELECT name, degree, language, price FROM programs WHERE university_id = %s ORDER BY name", (university_id,))
+    cursor.fetchall()
+    for query in (
+        "SELECT document_list FROM documents WHERE university_id = %s",
+        "SELECT description FROM scholarships WHERE university_id = %s",
+        "SELECT description FROM deadlines WHERE university_id = %s",
+        "SELECT steps FROM admission_process WHERE university_id = %s",
+        "SELECT website, admissions, scholarships FROM links WHERE university_id = %s",
+    ):
+        cursor.execute(query, (university_id,))
+        cursor.fetchone()
+
+
+def bench_university_details(repeat):
+    university = _first_university()
+    if not university:
+        print("❌ В базе нет университетов для замера")
+        return
+
+    country_name, university_name = university['country_name'], university['name']
+    print(f"Университет: {university_name} ({country_name}), повторов: {repeat}")
+
+    # Замеряем именно запросы, а не кэш каталога
+    cache, db.cache = db.cache, None
+    try:
+        with db.get_connection() as connection, connection.cursor() as cursor:
+            sequential = _measure(lambda: _university_details_sequential(cursor, country_name, university_name), repeat)
+        single = _measure(lambda: db.get_university_by_name(country_name, university_name), repeat)
+    finally:
+        db.cache = cache
+
+    _report("7 последовательных запросов", sequential)
+    _report("get_university_by_name (1 запрос)", single)
+    print(f"Ускорение по медиане: x{statistics.median(sequential) / statistics.median(single):.2f}")
+
+
+# -----------------------------
+# Кэш каталога: типичные нажатия с кэшем и без
+# -----------------------------
+def bench_catalog_cache(repeat):
+    if db.cache is None:
+        print("❌ Кэш каталога выключен (DB_CACHE=0)")
+        return
+
+    university = _first_university()
+    if not university:
+        print("❌ В базе нет университетов для замера")
+        return
+
+    def taps():
+        db.get_countries()
+        db.get_universities_by_country(university['country_name'])
+        db.get_university_by_name(university['country_name'], university['name'])
+
+    cache, db.cache = db.cache, None
+    try:
+        uncached = _measure(taps, repeat)
+    finally:
+        db.cache = cache
+
+    db.invalidate_cache()
+    cached = _measure(taps, repeat)
+
+    _report("страна → список → карточка, без кэша", uncached)
+    _report("страна → список → карточка, с кэшем", cached)
+    print(f"Кэш: {db.cache_stats()}")
+
+
+# -----------------------------
+# Prepared statements: сколько стоит разбор и планирование
+# -----------------------------
+def bench_prepared_statements(repeat, threads=8):
+    university = _first_university()
+    if not university:
+        print("❌ В базе нет университетов для замера")
+        return
+
+    samples = {
+        'countries': (),
+        'universities_by_country': (university['country_name'],),
+        'university_by_id': (university['id'],),
+        'section_documents': (university['id'],),
+        'direction_search': ('it',),
+    }
+
+    use_prepared = db.use_prepared
+    try:
+        with db.get_connection() as connection, connection.cursor() as cursor:
+            for statement, params in samples.items():
+                # Время планирования одного обычного выполнения по данным сервера
+                cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + PREPARED_STATEMENTS[statement], params or None)
+                planning = cursor.fetchone()[0][0]['Planning Time']
+
+                def run():
+                    db._execute(cursor, statement, params)
+                    cursor.fetchall()
+
+                db.use_prepared = False
+                plain = _measure(run, repeat)
+                db.use_prepared = True
+                prepared = _measure(run, repeat)
+
+                print(f"{statement}: планирование {planning:.3f} ms")
+                _report("  обычный запрос", plain)
+                _report("  EXECUTE подготовленного", prepared)
+                print(f"  экономия на вызове: {statistics.median(plain) - statistics.median(prepared):.3f} ms")
+
+        # Параллельные вызовы через пул: каждый поток берёт соединение на запрос,
+        # как обработчики бота; подготовленные запросы должны переживать возврат в пул
+        print(f"\n{threads} потоков × {repeat} запросов через пул:")
+        for use in (False, True):
+            db.use_prepared = use
+            _prepared_concurrent(samples, repeat, threads, "EXECUTE подготовленного" if use else "обычный запрос")
+    finally:
+        db.use_prepared = use_prepared
+
+
+def _prepared_concurrent(samples, repeat, threads, title):
+    statements = list(samples.items())
+    timings = [[] for _ in range(threads)]
+    prepares_before = db.stats.snapshot().get('counters', {}).get('prepares', 0)
+    reconnects_before = db.pool_stats()['reconnects']
+
+    def worker(number):
+        for i in range(repeat):
+            statement, params = statements[(number + i) % len(statements)]
+            started = time.perf_counter()
+            with db.get_connection() as connection, connection.cursor() as cursor:
+                db._execute(cursor, statement, params)
+                cursor.fetchall()
+            timings[number].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    pool = db.pool_stats()
+    prepares = db.stats.snapshot().get('counters', {}).get('prepares', 0) - prepares_before
+    _report(f"  {title}", [t for thread_timings in timings for t in thread_timings])
+    print(f"    {threads * repeat / elapsed:.0f} запросов/с, PREPARE: {prepares}, "
+          f"соединений в пуле: {pool.get('idle', 0) + pool.get('in_use', 0)}, "
+          f"переподключений: {pool['reconnects'] - reconnects_before}")
+
+
+# -----------------------------
+# Память на пользователя: словари по chat_id против SessionStore
+# -----------------------------
+NAVIGATION_STEPS = 60   # сколько раз пользователь переходил по меню
+NAVIGATION_STATES = ("main_menu", "role_selection", "direction_selection", "university_view")
+
+
+def _fill_dicts(users):
+    """Прежняя схема: шесть словарей, история навигации растёт без ограничений"""
+    state = {name: {} for name in ('roles', 'countries', 'directions', 'states', 'expanded', 'navigation')}
+    for chat_id in range(users):
+        state['roles'][chat_id] = "Школьник"
+        state['countries'][chat_id] = "Германия"
+        state['directions'][chat_id] = "IT / Инженерия / Наука"
+        state['states'][chat_id] = "ai_assistant"
+        state['expanded'][chat_id] = {"uni_id": chat_id % 25, "expanded": {"documents"}}
+        state['navigation'][chat_id] = [NAVIGATION_STATES[step % 4] for step in range(NAVIGATION_STEPS)]
+    return state
+
+
+def _fill_sessions(users):
+    from sessions import MemoryBackend, SessionStore
+
+    store = SessionStore(backend=MemoryBackend(), max_sessions=users)
+    for chat_id in range(users):
+        session = store.get(chat_id)
+        session.role = "Школьник"
+        session.country = "Германия"
+        session.direction = "IT / Инженерия / Наука"
+        session.state = "ai_assistant"
+        session.open_card(chat_id % 25)
+        session.expanded.add("documents")
+        for step in range(NAVIGATION_STEPS):
+            session.push_navigation(NAVIGATION_STATES[step % 4])
+    return store
+
+
+def bench_sessions(repeat):
+    users = repeat * 50
+    for title, fill in (("словари по chat_id", _fill_dicts), ("SessionStore", _fill_sessions)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        state = fill(users)
+        elapsed = (time.perf_counter() - started) * 1000
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{title:<24} {users} пользователей: {size / 1024 / 1024:7.2f} МБ, "
+              f"{size / users:7.0f} байт на пользователя, заполнение {elapsed:.0f} ms")
+        del state
+
+
+# -----------------------------
+# Выбор обработчика кнопки: лямбды по очереди против префиксного дерева
+# -----------------------------
+def bench_callback_routing(repeat):
+    from types import SimpleNamespace
+
+    from callback_router import CallbackRouter
+
+    for handlers in (10, 100, 1000):
+        prefixes = [f"action{number}_" for number in range(handlers)]
+        # Самый неудобный для перебора случай — обработчик зарегистрирован последним
+        call = SimpleNamespace(data=f"{prefixes[-1]}42")
+
+        filters = [(lambda call, prefix=prefix: call.data.startswith(prefix), None) for prefix in prefixes]
+        router = CallbackRouter()
+        for prefix in prefixes:
+            router.route(prefix)(lambda call: None)
+
+        def linear():
+            for _ in range(1000):
+                next(handler for check, handler in filters if check(call))
+
+        def trie():
+            for _ in range(1000):
+                router.resolve(call.data)
+
+        _report(f"{handlers} обработчиков, лямбды (×1000)", _measure(linear, repeat))
+        _report(f"{handlers} обработчиков, дерево (×1000)", _measure(trie, repeat))
+
+
+# -----------------------------
+# Клавиатуры: сборка на каждое нажатие против готового JSON
+# -----------------------------
+def bench_keyboards(repeat):
+    os.environ.setdefault('SESSION_BACKEND', 'memory')
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    import callbacks
+    from keyboards import KeyboardCache
+    from pgbot import university_card_markup
+
+    # Реальные тексты и ссылки из universities.json, id — условные
+    with open("universities.json", "r", encoding="utf-8") as f:
+        university_data = json.load(f)
+    country, universities = next(iter(university_data.items()))
+    uni_name, uni_info = next(iter(universities.items()))
+    uni_info = dict(uni_info, id=1, country_id=1, country=country, name=uni_name)
+
+    def build_card():
+        return uni_info["card"], university_card_markup(uni_info).to_json()
+
+    def build_list():
+        markup = InlineKeyboardMarkup()
+        for number, name in enumerate(universities, 1):
+            markup.add(InlineKeyboardButton(name, callback_data=callbacks.pack(callbacks.UNIVERSITY, number)))
+        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
+        return markup.to_json()
+
+    keyboards = KeyboardCache()
+    for title, key, build in (("карточка университета", 'card', build_card),
+                              (f"список университетов ({len(universities)})", 'country', build_list)):
+        def rebuild():
+            for _ in range(1000):
+                build()
+
+        def cached():
+            for _ in range(1000):
+                keyboards.get((key, 1), build)
+
+        _report(f"{title}: сборка (×1000)", _measure(rebuild, repeat))
+        _report(f"{title}: из кэша (×1000)", _measure(cached, repeat))
+
+
+# -----------------------------
+# Каталог из JSON: перебор вложенных словарей против индексов
+# -----------------------------
+def _scaled_university_data(size, unique=False):
+    """
+    universities.json, размноженный до size университетов (страны — тоже копии).
+    unique — тексты каждой копии отличаются (иначе копии ссылаются на одни и те же строки).
+    """
+    with open("universities.json", "r", encoding="utf-8") as f:
+        source = [(country, name, info) for country, universities in json.load(f).items()
+                  for name, info in universities.items()]
+    data = {}
+    for number in range(size):
+        country, name, info = source[number % len(source)]
+        copy = number // len(source)
+        if unique:
+            info = {field: f"{value} #{copy}" if isinstance(value, str) else value for field, value in info.items()}
+        data.setdefault(f"{country} {copy % 100}", {})[f"{name} #{copy}"] = info
+    return data
+
+
+def _direction_scan(university_data, keywords):
+    """Прежний поиск по направлению: все университеты, подстроки в programs и card"""
+    found = []
+    for country, universities in university_data.items():
+        for uni_name, uni_info in universities.items():
+            programs = uni_info.get("programs", "").lower()
+            card = uni_info.get("card", "").lower()
+            if any(keyword in programs or keyword in card for keyword in keywords):
+                found.append((country, uni_name, uni_info))
+    return found
+
+
+def _country_scan(university_data, uni_name):
+    """Прежний поиск страны по названию университета"""
+    for country, universities in university_data.items():
+        if uni_name in universities:
+            return country
+    return None
+
+
+def bench_catalog(repeat, size):
+    from catalog import Catalog
+    from directions import DIRECTION_KEYWORDS
+
+    university_data = _scaled_university_data(size)
+    tracemalloc.start()
+    catalog = Catalog(university_data)
+    index_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Каталог: {catalog.stats()}, индексы {index_size / 1024 / 1024:.2f} МБ")
+
+    # Последний университет — самый неудобный для перебора случай
+    last = catalog.by_id(len(catalog) - 1)
+    for direction, keywords in DIRECTION_KEYWORDS.items():
+        assert len(_direction_scan(university_data, keywords)) == len(catalog.by_direction(direction))
+        _report(f"направление {direction}: перебор", _measure(lambda: _direction_scan(university_data, keywords), repeat))
+        _report(f"направление {direction}: индекс (×1000)",
+                _measure(lambda: [catalog.by_direction(direction) for _ in range(1000)], repeat))
+
+    _report("страна по названию: перебор (×1000)",
+            _measure(lambda: [_country_scan(university_data, last.name) for _ in range(1000)], repeat))
+    _report("страна по названию: индекс (×1000)",
+            _measure(lambda: [catalog.country_of(last.name) for _ in range(1000)], repeat))
+
+
+# -----------------------------
+# Снимок каталога: запуск и память процессов против json.load
+# -----------------------------
+_SNAPSHOT_PROBE = """
+import os, sys, time
+from catalog import Catalog
+started = time.perf_counter()
+catalog = Catalog.from_snapshot(sys.argv[2]) if sys.argv[1] == "snapshot" else Catalog.from_json(sys.argv[2])
+# Типичная работа: несколько раскрытых карточек и поиск по направлению
+for university in catalog.by_direction("it")[:20]:
+    university.info.get("card"), university.info.get("documents")
+print(f"{(time.perf_counter() - started) * 1000:.1f}", flush=True)
+sys.stdin.read()
+"""
+
+
+def _memory_of(pid):
+    """(Rss, Pss) процесса в КБ по /proc/<pid>/smaps_rollup (Linux)"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1])
+    return values["Rss:"], values["Pss:"]
+
+
+def _start_probes(kind, path, processes):
+    """Запустить processes процессов с каталогом; (время загрузки ms, Rss КБ, Pss КБ) каждого"""
+    probes = [subprocess.Popen([sys.executable, "-c", _SNAPSHOT_PROBE, kind, path],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+              for _ in range(processes)]
+    results = []
+    try:
+        loads = [float(probe.stdout.readline()) for probe in probes]
+        # Все процессы живы одновременно — общие страницы снимка делятся между ними в Pss
+        for probe, load in zip(probes, loads):
+            results.append((load, *_memory_of(probe.pid)))
+    finally:
+        for probe in probes:
+            probe.stdin.close()
+            probe.wait()
+    return results
+
+
+def bench_snapshot(repeat, size, processes):
+    from catalog import Catalog
+    from catalog_snapshot import compile_snapshot
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "universities.json")
+        snapshot_path = os.path.join(directory, "universities.bin")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(_scaled_university_data(size, unique=True), f, ensure_ascii=False)
+        catalog = Catalog.from_json(json_path)
+        compile_snapshot(catalog.data, snapshot_path, catalog.keyword_index())
+        del catalog
+        print(f"{size} университетов: JSON {os.path.getsize(json_path) / 1024 / 1024:.1f} МБ, "
+              f"снимок {os.path.getsize(snapshot_path) / 1024 / 1024:.1f} МБ")
+
+        # Запуск: отдельные процессы, файлы уже в page cache
+        for kind, path in (("json", json_path), ("snapshot", snapshot_path)):
+            loads = [_start_probes(kind, path, 1)[0][0] for _ in range(min(repeat, 10))]
+            _report(f"загрузка каталога: {kind}", loads)
+
+        # Память: processes процессов одновременно
+        for kind, path in (("json", json_path), ("snapshot", snapshot_path)):
+            results = _start_probes(kind, path, processes)
+            rss = sum(result[1] for result in results) / 1024
+            pss = sum(result[2] for result in results) / 1024
+            print(f"{kind:<10} {processes} процессов: RSS {rss:7.1f} МБ, PSS {pss:7.1f} МБ "
+                  f"({pss / processes:.1f} МБ на процесс)")
+
+
+BENCHMARKS = {
+    "university_details": bench_university_details,
+    "catalog_cache": bench_catalog_cache,
+    "prepared_statements": bench_prepared_statements,
+    "sessions": bench_sessions,
+    "callback_routing": bench_callback_routing,
+    "keyboards": bench_keyboards,
+    "catalog": bench_catalog,
+    "snapshot": bench_snapshot,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности бота")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--size", type=int, default=10000, help="число университетов для catalog и snapshot")
+    parser.add_argument("--processes", type=int, default=4, help="число процессов ботов для snapshot")
+    parser.add_argument("--threads", type=int, default=8, help="число параллельных потоков для prepared_statements")
+    args = parser.parse_args()
+
+    if args.benchmark == "catalog":
+        bench_catalog(args.repeat, args.size)
+    elif args.benchmark == "snapshot":
+        bench_snapshot(args.repeat, args.size, args.processes)
+    elif args.benchmark == "prepared_statements":
+        bench_prepared_statements(args.repeat, args.threads)
+    else:
+        BENCHMARKS[args.benchmark](args.repeat)
+    db.close()
@@ -0,0 +1,71 @@
+from metrics import MetricsRegistry
+
+_END = object()   # ключ узла префиксного дерева, на котором заканчивается маршрут
+
+
+class CallbackRouter:
+    """
+    Маршрутизация нажатий inline-кнопок по префиксу callback_data.
+
+    Вместо отдельного callback_query_handler с лямбдой на каждый префикс
+    (telebot проверяет их по очереди, и при пересечении префиксов вроде
+    "uni_" и "uni_section_" всё решает порядок регистрации) в боте
+    регистрируется один обработчик. Префиксы собраны в префиксное дерево,
+    выбирается самый длинный совпавший префикс; время поиска зависит только
+    от длины callback_data, а не от числа маршрутов.
+
+        router = CallbackRouter(bot)
+
+        @router.route("uni_")
+        def uni_selected(call): ...
+
+        @router.route("choose_country", exact=True)
+        def choose_country(call): ...
+    """
+
+    def __init__(self, bot=None):
+        self._trie = {}
+        self._exact = {}
+        self.metrics = MetricsRegistry()
+        if bot is not None:
+            bot.callback_query_handler(func=lambda call: True)(self.dispatch)
+
+    def route(self, prefix, exact=False):
+        """Декоратор: handler(call) для callback_data, начинающихся с prefix (или равных ему при exact)"""
+        def decorator(handler):
+            if exact:
+                self._exact[prefix] = handler
+            else:
+                node = self._trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node[_END] = handler
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """Обработчик для callback_data или None"""
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler
+
+        node = self._trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            handler = node.get(_END, handler)
+        return handler
+
+    def dispatch(self, call):
+        handler = self.resolve(call.data or "")
+        if handler is None:
+            self.metrics.incr('unmatched')
+            print(f"⚠️ Нет обработчика для кнопки: {call.data!r}")
+            return
+        with self.metrics.timer(handler.__name__):
+            handler(call)
+
+    def stats(self):
+        """Число вызовов и время работы каждого обработчика"""
+        return self.metrics.snapshot()
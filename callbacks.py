@@ -0,0 +1,83 @@
+"""
+Компактный callback_data для inline-кнопок: код действия + числовые id.
+
+    callback_data = callbacks.pack(callbacks.UNIVERSITY, university['id'])   # "#uAQ"
+    @router.route(callbacks.prefix(callbacks.UNIVERSITY))
+    def handler(call):
+        university_id, = callbacks.unpack(call.data)
+
+Формат: "#" + символ действия + id в виде varint, закодированные urlsafe base64
+без "=". Даже для нескольких больших id строка укладывается в 64 байта,
+которые Telegram разрешает для callback_data, и не зависит от названий
+(в которых бывают "_" и которые бывают длинными).
+"""
+import base64
+
+PREFIX = "#"
+
+# Действия (один символ)
+UNIVERSITY = "u"          # карточка университета (с записью в навигацию): university_id
+CARD = "k"                # возврат к карточке университета: university_id
+SECTION = "s"             # раздел карточки: university_id, номер раздела в SECTIONS
+COUNTRY = "c"             # университеты страны (с записью в навигацию): country_id
+BACK_TO_COUNTRY = "b"     # возврат к университетам страны: country_id
+
+SECTIONS = ("documents", "scholarships", "deadlines", "process", "programs")
+
+
+def _write_varint(value, out):
+    if value < 0:
+        raise ValueError("id должен быть неотрицательным")
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def pack(action, *ids):
+    """callback_data для действия action с числовыми параметрами ids"""
+    out = bytearray()
+    for value in ids:
+        _write_varint(value, out)
+    return PREFIX + action + base64.urlsafe_b64encode(bytes(out)).decode('ascii').rstrip('=')
+
+
+def unpack(data):
+    """Числовые параметры из callback_data (список int)"""
+    if not is_packed(data):
+        raise ValueError(f"не упакованный callback_data: {data!r}")
+    payload = data[2:]
+    raw = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+
+    ids, value, shift = [], 0, 0
+    for byte in raw:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            ids.append(value)
+            value, shift = 0, 0
+    return ids
+
+
+def is_packed(data):
+    return len(data) >= 2 and data[0] == PREFIX
+
+
+def action_of(data):
+    """Символ действия или None, если callback_data в старом формате"""
+    return data[1] if is_packed(data) else None
+
+
+def prefix(action):
+    """Префикс callback_data действия (для CallbackRouter.route)"""
+    return PREFIX + action
+
+
+def pack_section(university_id, section):
+    return pack(SECTION, university_id, SECTIONS.index(section))
+
+
+def unpack_section(data):
+    """(university_id, название раздела)"""
+    university_id, section_index = unpack(data)
+    return university_id, SECTIONS[section_index]
@@ -0,0 +1,366 @@
+"""
+Каталог университетов из universities.json для ботов без базы данных.
+
+    catalog = Catalog.from_file("universities.json")   # или снимок universities.bin, если он свежее
+    catalog.countries()                        # ["Германия", ...]
+    catalog.universities("Германия")           # {название: данные}
+    catalog.get("Германия", "TUM")             # данные университета или None
+    catalog.country_of("TUM")                  # "Германия"
+    catalog.by_direction("it")                 # [University, ...]
+    catalog.by_id(5), catalog.country_id("Германия")   # числовые id для callback_data (callbacks.py)
+
+Все индексы строятся один раз при загрузке: по стране, по id, по названию
+и обратный индекс «ключевое слово направления → университеты» по тексту
+карточки и программ (в нижнем регистре). Поиск по направлению — это выборка
+готового списка, а не перебор всех университетов с поиском подстрок.
+
+id стран и университетов при первой загрузке — порядковые номера в JSON.
+При перезагрузке LiveCatalog переносит id из прежней версии (keep_ids):
+записи сохраняют свои id, новые получают следующие свободные, id удалённых
+не переиспользуются. Поэтому кнопки, отправленные до перезагрузки, ведут
+туда же, а не на соседний университет.
+
+Если рядом с JSON лежит бинарный снимок (см. catalog_snapshot.py) не старше
+JSON, каталог читается из него: разделы декодируются только при обращении,
+а обратный индекс не пересчитывается. CATALOG_SNAPSHOT — путь к снимку
+(по умолчанию universities.bin рядом с JSON), CATALOG_SNAPSHOT=0 — не использовать.
+
+LiveCatalog следит за файлом и подменяет каталог без перезапуска бота:
+
+    catalog = LiveCatalog("universities.json")
+    current = catalog.current        # один и тот же каталог до конца обработчика
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from directions import DIRECTION_KEYWORDS
+
+load_dotenv()
+
+
+class University:
+    """Университет каталога; info — исходный словарь из JSON"""
+
+    __slots__ = ('id', 'country', 'name', 'info', '_text')
+
+    def __init__(self, university_id, country, name, info):
+        self.id = university_id
+        self.country = country
+        self.name = name
+        self.info = info
+        self._text = None
+
+    @property
+    def text(self):
+        """Текст для поиска по ключевым словам (считается один раз)"""
+        if self._text is None:
+            self._text = (self.info.get("programs", "") + "\n" + self.info.get("card", "")).lower()
+        return self._text
+
+
+class Catalog:
+    """Индексированный каталог: строится один раз, дальше только чтение"""
+
+    def __init__(self, data, keywords=None, keyword_index=None):
+        """keyword_index — готовый обратный индекс (из снимка), недостающие слова досчитываются"""
+        started = time.perf_counter()
+        self.data = data
+        self.source = None
+        self._snapshot = None         # открытый CatalogSnapshot (файл и mmap), если каталог из снимка
+        self.version = 1              # номер загрузки (LiveCatalog увеличивает при перезагрузке)
+        self.keywords = keywords if keywords is not None else DIRECTION_KEYWORDS
+
+        self._universities = []       # University в порядке JSON (индексы хранят номера в этом списке)
+        self._by_id = {}              # id -> University
+        self._by_country = {}         # страна -> [University, ...] в порядке JSON
+        self._by_name = {}            # название -> University (первое с таким названием)
+        self._countries = {}          # id страны -> название
+        self._country_ids = {}        # название страны -> id
+        for country, universities in data.items():
+            entries = self._by_country[country] = []
+            for name, info in universities.items():
+                university = University(len(self._universities), country, name, info)
+                self._universities.append(university)
+                entries.append(university)
+                self._by_name.setdefault(name, university)
+        self._assign_ids({}, {})
+
+        # Обратный индекс: ключевое слово -> номера университетов, в тексте которых оно есть
+        self._keyword_index = {}
+        for keyword in {keyword for keywords in self.keywords.values() for keyword in keywords}:
+            if keyword_index and keyword in keyword_index:
+                self._keyword_index[keyword] = keyword_index[keyword]
+            else:
+                self._keyword_index[keyword] = [i for i, u in enumerate(self._universities) if keyword in u.text]
+
+        # Направление -> университеты в порядке JSON (объединение списков его ключевых слов)
+        self._by_direction = {}
+        for direction, keywords in self.keywords.items():
+            numbers = set()
+            for keyword in keywords:
+                numbers.update(self._keyword_index[keyword])
+            self._by_direction[direction] = [self._universities[i] for i in sorted(numbers)]
+
+        self.build_time = time.perf_counter() - started
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            catalog = cls(json.load(f))
+        catalog.source = path
+        return catalog
+
+    @classmethod
+    def from_snapshot(cls, path):
+        from catalog_snapshot import CatalogSnapshot
+
+        snapshot = CatalogSnapshot(path)
+        try:
+            catalog = cls(snapshot.data, keyword_index=snapshot.keyword_index)
+        except Exception:
+            snapshot.close()
+            raise
+        catalog._snapshot = snapshot
+        catalog.source = path
+        return catalog
+
+    @classmethod
+    def from_file(cls, path):
+        """Каталог из JSON path или из его снимка, если снимок не старше JSON"""
+        snapshot = os.getenv('CATALOG_SNAPSHOT', os.path.splitext(path)[0] + ".bin")
+        if snapshot != "0" and os.path.exists(snapshot) and os.path.getmtime(snapshot) >= os.path.getmtime(path):
+            try:
+                return cls.from_snapshot(snapshot)
+            except Exception as e:
+                print(f"⚠️ Не удалось открыть снимок каталога {snapshot}: {e}")
+        return cls.from_json(path)
+
+    def _assign_ids(self, known_countries, known_universities):
+        """
+        Раздать id: известные страны и университеты (страна, название) получают
+        прежние id, новые — следующие после наибольшего известного.
+        """
+        known_countries = dict(known_countries)
+        next_id = max(known_countries.values(), default=-1) + 1
+        for country in self._by_country:
+            if country not in known_countries:
+                known_countries[country] = next_id
+                next_id += 1
+        self._country_ids = {country: known_countries[country] for country in self._by_country}
+        self._countries = {number: country for country, number in self._country_ids.items()}
+
+        known_universities = dict(known_universities)
+        next_id = max(known_universities.values(), default=-1) + 1
+        self._by_id = {}
+        for university in self._universities:
+            key = (university.country, university.name)
+            if key not in known_universities:
+                known_universities[key] = next_id
+                next_id += 1
+            university.id = known_universities[key]
+            self._by_id[university.id] = university
+
+        # Вместе с удалёнными из JSON — чтобы их id не достались новым записям
+        self._known_country_ids = known_countries
+        self._known_university_ids = known_universities
+
+    def keep_ids(self, previous):
+        """Взять id стран и университетов из прежней версии каталога (до подмены current)"""
+        self._assign_ids(previous._known_country_ids, previous._known_university_ids)
+
+    def countries(self):
+        return list(self._by_country)
+
+    def universities(self, country):
+        """{название: данные} университетов страны (пустой словарь, если страны нет)"""
+        return self.data.get(country, {})
+
+    def get(self, country, name):
+        """Данные университета или None"""
+        return self.data.get(country, {}).get(name)
+
+    def by_id(self, university_id):
+        return self._by_id.get(university_id)
+
+    def by_country(self, country):
+        """Университеты страны (University) в порядке JSON"""
+        return self._by_country.get(country, [])
+
+    def country_id(self, country):
+        """Числовой id страны или None"""
+        return self._country_ids.get(country)
+
+    def country_by_id(self, country_id):
+        """Название страны по id или None"""
+        return self._countries.get(country_id)
+
+    def country_of(self, name):
+        """Страна университета по названию или None"""
+        university = self._by_name.get(name)
+        return university.country if university else None
+
+    def by_direction(self, direction_key):
+        """Университеты, подходящие направлению, в порядке JSON"""
+        return self._by_direction.get(direction_key, [])
+
+    def search(self, keyword):
+        """Университеты, в карточке или программах которых есть keyword"""
+        keyword = keyword.lower()
+        numbers = self._keyword_index.get(keyword)
+        if numbers is None:
+            return [u for u in self._universities if keyword in u.text]
+        return [self._universities[i] for i in numbers]
+
+    def keyword_index(self):
+        """{ключевое слово: [номера университетов в порядке JSON]} — для сохранения в снимок"""
+        return dict(self._keyword_index)
+
+    def __len__(self):
+        return len(self._universities)
+
+    def close(self):
+        """Закрыть снимок (файл и mmap); после этого разделы из снимка не читаются"""
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    def stats(self):
+        return {
+            'source': self.source,
+            'version': self.version,
+            'countries': len(self._by_country),
+            'universities': len(self._universities),
+            'keywords': len(self._keyword_index),
+            'build_ms': round(self.build_time * 1000, 2),
+        }
+
+
+# -----------------------------
+# Перезагрузка без перезапуска бота
+# -----------------------------
+class LiveCatalog:
+    """
+    Каталог, который перечитывается при изменении файла.
+
+    Фоновый поток раз в interval секунд (CATALOG_RELOAD_INTERVAL, 0 — не следить)
+    сравнивает mtime и размер JSON и его снимка. Изменившийся файл читается,
+    когда он не менялся целый интервал (чтобы не поймать недописанный),
+    новый каталог строится целиком в фоне и подменяется одним присваиванием
+    current. Обработчик, взявший catalog.current, работает с ним до конца,
+    даже если в это время загрузилась новая версия. Если файл не разобрался,
+    остаётся прежний каталог. Прежняя версия, открытая из снимка, закрывается
+    (файл и mmap) не сразу, а через CATALOG_RETIRE_DELAY секунд (60) — чтобы
+    обработчики, которые ещё держат её, успели закончить.
+
+    Обращения к атрибутам (catalog.get(...), catalog.countries()) идут
+    в текущую версию.
+    """
+
+    def __init__(self, path, interval=None, loader=None):
+        self.path = path
+        self.interval = float(interval if interval is not None else os.getenv('CATALOG_RELOAD_INTERVAL', '5'))
+        self.loader = loader or Catalog.from_file
+        self.retire_delay = float(os.getenv('CATALOG_RETIRE_DELAY', '60'))
+        self.reloads = 0
+        self.errors = 0
+        self._retired = deque()       # (время замены, прежний каталог) — ещё не закрытые
+
+        self._signature = self._file_signature()
+        self._pending = None
+        self._lock = threading.Lock()
+        self.current = self.loader(path)
+        self._watcher = None
+        if self.interval > 0:
+            self._watcher = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+            self._watcher.start()
+
+    def __getattr__(self, name):
+        if name == 'current':
+            raise AttributeError(name)
+        return getattr(self.current, name)
+
+    def __len__(self):
+        return len(self.current)
+
+    def _file_signature(self):
+        """(mtime, размер) JSON и снимка — меняется при любой правке файлов"""
+        signature = []
+        snapshot = os.getenv('CATALOG_SNAPSHOT', os.path.splitext(self.path)[0] + ".bin")
+        for path in (self.path, snapshot):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def check(self):
+        """Перезагрузить каталог, если файл изменился и больше не меняется; True — если перезагружен"""
+        signature = self._file_signature()
+        if signature == self._signature:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            # Файл только что изменился — ждём, пока запись закончится
+            self._pending = signature
+            return False
+        self._pending = None
+        return self.reload(signature)
+
+    def reload(self, signature=None):
+        """Прочитать файл заново и подменить каталог"""
+        with self._lock:
+            started = time.perf_counter()
+            self._signature = signature or self._file_signature()
+            try:
+                catalog = self.loader(self.path)
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Не удалось перезагрузить каталог {self.path}: {e} — остаётся версия {self.current.version}")
+                return False
+
+            previous = self.current
+            catalog.version = previous.version + 1
+            # Кнопки с id из прежней версии должны вести к тем же странам и университетам
+            catalog.keep_ids(previous)
+            self.current = catalog
+            self.reloads += 1
+            self._retired.append((time.monotonic(), previous))
+            print(f"🔄 Каталог перезагружен: версия {catalog.version}, {len(catalog)} университетов "
+                  f"из {catalog.source}, {(time.perf_counter() - started) * 1000:.0f} ms")
+        self.close_retired()
+        return True
+
+    def close_retired(self, force=False):
+        """Закрыть прежние версии, заменённые больше retire_delay секунд назад (force — все)"""
+        with self._lock:
+            deadline = time.monotonic() - self.retire_delay
+            while self._retired and (force or self._retired[0][0] <= deadline):
+                _, catalog = self._retired.popleft()
+                catalog.close()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+                self.close_retired()
+            except Exception as e:
+                print(f"❌ Ошибка при проверке каталога: {e}")
+
+    def stats(self):
+        stats = self.current.stats()
+        stats['reloads'] = self.reloads
+        stats['reload_errors'] = self.errors
+        stats['retired_open'] = len(self._retired)
+        return stats
+
+    def close(self):
+        """Закрыть текущую и все прежние версии"""
+        self.close_retired(force=True)
+        self.current.close()
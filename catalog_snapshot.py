@@ -0,0 +1,215 @@
+"""
+Бинарный снимок каталога университетов (universities.json → universities.bin).
+
+Снимок отображается в память (mmap) и читается без разбора JSON: при запуске
+декодируются только названия стран и университетов, а тексты разделов
+(card, documents, ...) — при обращении к ним. Страницы файла общие для всех
+процессов ботов через page cache. Обратный индекс ключевых слов направлений
+тоже лежит в снимке, так что Catalog не пересчитывает его при запуске.
+
+Собрать снимок (после каждого изменения universities.json):
+    python catalog_snapshot.py universities.json universities.bin
+
+Формат (все числа — little-endian uint32):
+    заголовок    magic, число полей, стран, университетов, ключевых слов
+                 и смещения их таблиц
+    поля         название, тип (0 — строка, 1 — JSON)
+    страны       название, первый университет, число университетов
+    университеты название + ссылка на значение каждого поля
+    ключ. слова  слово, ссылка на массив id университетов
+    строки       UTF-8 без разделителей; ссылка — (смещение, длина),
+                 одинаковые строки хранятся один раз
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from collections.abc import Mapping
+
+MAGIC = b"SWFCAT\x00\x01"
+HEADER = struct.Struct("<8s8I")
+FIELD = struct.Struct("<3I")
+COUNTRY = struct.Struct("<4I")
+KEYWORD = struct.Struct("<4I")
+REF = struct.Struct("<2I")
+ABSENT = 0xFFFFFFFF   # смещение отсутствующего поля
+
+KIND_TEXT = 0
+KIND_JSON = 1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# -----------------------------
+# Сборка снимка
+# -----------------------------
+def compile_snapshot(data, path, keyword_index=None):
+    """
+    Записать каталог data ({страна: {университет: {поле: значение}}}) в path.
+    keyword_index — {ключевое слово: [id университетов]} (id в порядке обхода data).
+    """
+    keyword_index = keyword_index or {}
+    fields = []
+    kinds = {}
+    for universities in data.values():
+        for info in universities.values():
+            for field, value in info.items():
+                if field not in kinds:
+                    fields.append(field)
+                    kinds[field] = KIND_TEXT
+                if not isinstance(value, str):
+                    kinds[field] = KIND_JSON
+
+    university_row = struct.Struct("<" + "2I" * (1 + len(fields)))
+    universities_count = sum(len(universities) for universities in data.values())
+
+    fields_offset = HEADER.size
+    countries_offset = fields_offset + FIELD.size * len(fields)
+    universities_offset = countries_offset + COUNTRY.size * len(data)
+    keywords_offset = universities_offset + university_row.size * universities_count
+    blob_offset = keywords_offset + KEYWORD.size * len(keyword_index)
+
+    blob = bytearray()
+    refs = {}
+
+    def ref(raw):
+        """(смещение, длина) байтов raw в области строк; повторы не дублируются"""
+        if raw not in refs:
+            refs[raw] = (blob_offset + len(blob), len(raw))
+            blob.extend(raw)
+        return refs[raw]
+
+    def text_ref(text):
+        return ref(text.encode("utf-8"))
+
+    out = bytearray(HEADER.pack(MAGIC, len(fields), len(data), universities_count, len(keyword_index),
+                                fields_offset, countries_offset, universities_offset, keywords_offset))
+    for field in fields:
+        out += FIELD.pack(*text_ref(field), kinds[field])
+
+    first = 0
+    for country, universities in data.items():
+        out += COUNTRY.pack(*text_ref(country), first, len(universities))
+        first += len(universities)
+
+    for universities in data.values():
+        for name, info in universities.items():
+            row = list(text_ref(name))
+            for field in fields:
+                if field not in info:
+                    row += (ABSENT, 0)
+                elif kinds[field] == KIND_JSON:
+                    row += text_ref(json.dumps(info[field], ensure_ascii=False))
+                else:
+                    row += text_ref(info[field])
+            out += university_row.pack(*row)
+
+    for keyword, ids in keyword_index.items():
+        offset, length = ref(struct.pack(f"<{len(ids)}I", *ids))
+        out += KEYWORD.pack(*text_ref(keyword), offset, length // 4)
+
+    out += blob
+    # Новый файл подменяет старый целиком: процессы, у которых отображён
+    # прежний снимок, дочитывают его, а не обрезанный файл
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "wb") as f:
+        f.write(out)
+    os.replace(temporary, path)
+    return len(out)
+
+
+# -----------------------------
+# Чтение снимка
+# -----------------------------
+class SnapshotUniversity(Mapping):
+    """Данные университета из снимка; каждое поле декодируется при обращении"""
+
+    __slots__ = ('_snapshot', '_offset')
+
+    def __init__(self, snapshot, offset):
+        self._snapshot = snapshot
+        self._offset = offset
+
+    def __getitem__(self, field):
+        index = self._snapshot.field_index.get(field)
+        if index is None:
+            raise KeyError(field)
+        offset, length = REF.unpack_from(self._snapshot.mm, self._offset + REF.size * (index + 1))
+        if offset == ABSENT:
+            raise KeyError(field)
+        value = self._snapshot.mm[offset:offset + length].decode("utf-8")
+        return json.loads(value) if self._snapshot.kinds[index] == KIND_JSON else value
+
+    def __iter__(self):
+        for index, field in enumerate(self._snapshot.fields):
+            offset, _ = REF.unpack_from(self._snapshot.mm, self._offset + REF.size * (index + 1))
+            if offset != ABSENT:
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class CatalogSnapshot:
+    """
+    Открытый снимок. data — {страна: {университет: SnapshotUniversity}} в том же
+    порядке, что в исходном JSON; keyword_index — сохранённый обратный индекс.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, fields_count, countries_count, universities_count, keywords_count,
+         fields_offset, countries_offset, universities_offset, keywords_offset) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotError(f"{path}: не снимок каталога или устаревший формат")
+
+        self.fields, self.kinds = [], []
+        for index in range(fields_count):
+            offset, length, kind = FIELD.unpack_from(self.mm, fields_offset + FIELD.size * index)
+            self.fields.append(self._text(offset, length))
+            self.kinds.append(kind)
+        self.field_index = {field: index for index, field in enumerate(self.fields)}
+
+        row_size = REF.size * (1 + fields_count)
+        self.data = {}
+        for index in range(countries_count):
+            offset, length, first, count = COUNTRY.unpack_from(self.mm, countries_offset + COUNTRY.size * index)
+            universities = self.data[self._text(offset, length)] = {}
+            for row in range(universities_offset + row_size * first, universities_offset + row_size * (first + count), row_size):
+                universities[self._text(*REF.unpack_from(self.mm, row))] = SnapshotUniversity(self, row)
+
+        self.keyword_index = {}
+        for index in range(keywords_count):
+            offset, length, ids_offset, count = KEYWORD.unpack_from(self.mm, keywords_offset + KEYWORD.size * index)
+            self.keyword_index[self._text(offset, length)] = list(struct.unpack_from(f"<{count}I", self.mm, ids_offset))
+
+    def _text(self, offset, length):
+        return self.mm[offset:offset + length].decode("utf-8")
+
+    def close(self):
+        if not self.mm.closed:
+            self.mm.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Собрать бинарный снимок каталога из JSON")
+    parser.add_argument("source", nargs="?", default="universities.json")
+    parser.add_argument("target", nargs="?", default="universities.bin")
+    args = parser.parse_args()
+
+    from catalog import Catalog
+
+    started = time.perf_counter()
+    catalog = Catalog.from_json(args.source)
+    size = compile_snapshot(catalog.data, args.target, catalog.keyword_index())
+    print(f"✅ {args.target}: {len(catalog)} университетов, {size / 1024:.1f} КБ, "
+          f"{(time.perf_counter() - started) * 1000:.0f} ms")
@@ -1,192 +1,825 @@
 import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR, TRANSACTION_STATUS_UNKNOWN
 from psycopg2.extras import DictCursor
 import os
+import re
+import copy
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+from cache import MISSING, TTLCache
+from directions import DIRECTION_KEYWORDS
+from metrics import MetricsRegistry
+
 load_dotenv()
 
-class Database:
-    def __init__(self):
-        self.connection = None
-        self.connect()
-    
+
+# Время жизни записей кэша каталога (секунды) по методам
+CACHE_TTLS = {
+    'get_countries': int(os.getenv('DB_CACHE_TTL_COUNTRIES', '3600')),
+    'get_universities_by_country': int(os.getenv('DB_CACHE_TTL_UNIVERSITIES', '900')),
+    'get_universities_by_country_id': int(os.getenv('DB_CACHE_TTL_UNIVERSITIES', '900')),
+    'get_university_by_name': int(os.getenv('DB_CACHE_TTL_UNIVERSITY', '900')),
+    'search_universities_by_direction': int(os.getenv('DB_CACHE_TTL_DIRECTION', '900')),
+    'get_university_by_id': int(os.getenv('DB_CACHE_TTL_UNIVERSITY', '900')),
+    'get_university_section': int(os.getenv('DB_CACHE_TTL_UNIVERSITY', '900')),
+}
+
+
+def _cache_key(name, args):
+    """Ключ кэша: имя метода + аргументы (списки приводятся к кортежам)"""
+    return (name,) + tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+
+
+def _row_count(value):
+    """Сколько строк вернул метод (для статистики)"""
+    if value is None:
+        return 0
+    return len(value) if isinstance(value, list) else 1
+
+
+def _borrows_connection(error_message, default, cached=False):
+    """
+    Выдаёт методу соединение из пула на время вызова.
+    Если соединение оборвалось — берём новое и повторяем запрос один раз.
+    cached=True — результат читается через кэш каталога (если он включён);
+    ошибки не кэшируются.
+    Время, число строк и ошибки каждого вызова пишутся в Database.stats.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = None
+            if cached and self.cache is not None and not kwargs:
+                key = _cache_key(method.__name__, args)
+                value = self.cache.get(key)
+                if value is not MISSING:
+                    return value
+
+            started = time.perf_counter()
+            for attempt in (1, 2):
+                try:
+                    with self.get_connection() as connection:
+                        value = method(self, connection, *args, **kwargs)
+                    self.stats.observe(method.__name__, time.perf_counter() - started, rows=_row_count(value))
+                    if key is not None:
+                        self.cache.set(key, value, ttl=CACHE_TTLS[method.__name__])
+                    return value
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    if attempt == 1:
+                        self.stats.incr('retries')
+                        continue
+                    print(f"{error_message}: {e}")
+                except Exception as e:
+                    print(f"{error_message}: {e}")
+                    break
+            self.stats.observe(method.__name__, time.perf_counter() - started, error=True)
+            return copy.copy(default)
+        return wrapper
+    return decorator
+
+
+COUNTRIES_QUERY = "SELECT id, name FROM countries ORDER BY name"
+
+UNIVERSITIES_BY_COUNTRY_QUERY = """
+    SELECT u.id, u.name, u.card, u.website, c.name as country_name, c.id as country_id
+    FROM universities u
+    JOIN countries c ON u.country_id = c.id
+    WHERE c.name = %s
+    ORDER BY u.name
+"""
+
+# То же по первичному ключу страны (для кнопок с id, см. callbacks.py)
+UNIVERSITIES_BY_COUNTRY_ID_QUERY = UNIVERSITIES_BY_COUNTRY_QUERY.replace("WHERE c.name = %s", "WHERE c.id = %s")
+
+# Поиск по направлению: выборка по первичному ключу university_directions
+DIRECTION_SEARCH_QUERY = """
+    SELECT u.id, u.name, u.card, c.name as country_name, c.id as country_id
+    FROM university_directions ud
+    JOIN universities u ON u.id = ud.university_id
+    JOIN countries c ON u.country_id = c.id
+    WHERE ud.direction = %s
+    ORDER BY c.name, u.name
+"""
+
+# Поиск по ключевым словам без разметки — пока university_directions нет и создать её нельзя
+DIRECTION_KEYWORD_SEARCH_QUERY = """
+    SELECT DISTINCT u.id, u.name, u.card, c.name as country_name, c.id as country_id
+    FROM universities u
+    JOIN countries c ON u.country_id = c.id
+    LEFT JOIN programs p ON u.id = p.university_id
+    WHERE u.card ILIKE ANY(%s) OR p.name ILIKE ANY(%s)
+    ORDER BY c.name, u.name
+"""
+
+# Полная карточка университета за один запрос.
+# Разделы, хранящиеся в отдельных таблицах, подтягиваются вложенными SELECT,
+# программы собираются в JSON-массив (psycopg2 сам превращает его в list[dict]).
+UNIVERSITY_DETAILS_QUERY = """
+    SELECT u.id, u.name, u.card, u.website, c.name AS country_name, c.id AS country_id,
+        (SELECT json_agg(json_build_object(
+                    'name', p.name, 'degree', p.degree,
+                    'language', p.language, 'price', p.price
+                ) ORDER BY p.name)
+         FROM programs p WHERE p.university_id = u.id) AS programs,
+        (SELECT d.document_list FROM documents d
+         WHERE d.university_id = u.id LIMIT 1) AS documents,
+        (SELECT s.description FROM scholarships s
+         WHERE s.university_id = u.id LIMIT 1) AS scholarships,
+        (SELECT dl.description FROM deadlines dl
+         WHERE dl.university_id = u.id LIMIT 1) AS deadlines,
+        (SELECT ap.steps FROM admission_process ap
+         WHERE ap.university_id = u.id LIMIT 1) AS process,
+        (SELECT json_build_object(
+                    'website', l.website, 'admissions', l.admissions,
+                    'scholarships', l.scholarships
+                )
+         FROM links l WHERE l.university_id = u.id LIMIT 1) AS links
+    FROM universities u
+    JOIN countries c ON u.country_id = c.id
+    WHERE {where}
+"""
+
+
+# Один раздел карточки университета: запрос по university_id (индексы — в db_task.py)
+UNIVERSITY_SECTION_QUERIES = {
+    'documents': "SELECT document_list FROM documents WHERE university_id = %s LIMIT 1",
+    'scholarships': "SELECT description FROM scholarships WHERE university_id = %s LIMIT 1",
+    'deadlines': "SELECT description FROM deadlines WHERE university_id = %s LIMIT 1",
+    'process': "SELECT steps FROM admission_process WHERE university_id = %s LIMIT 1",
+    'programs': "SELECT name, degree, language, price FROM programs WHERE university_id = %s ORDER BY name",
+}
+
+
+# Частые запросы, которые готовятся на сервере (PREPARE) один раз на соединение
+# и дальше выполняются по имени (EXECUTE) без повторного разбора и планирования
+PREPARED_STATEMENTS = {
+    'countries': COUNTRIES_QUERY,
+    'universities_by_country': UNIVERSITIES_BY_COUNTRY_QUERY,
+    'universities_by_country_id': UNIVERSITIES_BY_COUNTRY_ID_QUERY,
+    'direction_search': DIRECTION_SEARCH_QUERY,
+    'direction_keyword_search': DIRECTION_KEYWORD_SEARCH_QUERY,
+    'university_by_name': UNIVERSITY_DETAILS_QUERY.format(where="c.name = %s AND u.name = %s"),
+    'university_by_id': UNIVERSITY_DETAILS_QUERY.format(where="u.id = %s"),
+    'universities_by_ids': UNIVERSITY_DETAILS_QUERY.format(where="u.id = ANY(%s)"),
+}
+PREPARED_STATEMENTS.update({
+    f'section_{section}': query for section, query in UNIVERSITY_SECTION_QUERIES.items()
+})
+
+
+def numbered_placeholders(query):
+    """Заменить плейсхолдеры %s на $1, $2, ... (для PREPARE и asyncpg)"""
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f'${next(counter)}', query)
+
+
+class KeepIdlePool:
+    """
+    Пул соединений, который не закрывает возвращённые соединения.
+    psycopg2.pool.ThreadedConnectionPool держит открытыми только minconn
+    свободных соединений, а остальные закрывает при putconn — при параллельных
+    запросах почти каждый вызов открывал бы новое соединение. Здесь свободными
+    остаются все соединения (их не больше maxconn); minconn — сколько открыть сразу.
+    Методы — как у пулов psycopg2 (getconn, putconn, closeall, closed),
+    но построен только на psycopg2.connect, без их внутренних методов.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.closed = False
+        self._args = args
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._idle = []
+        self._used = {}     # id(соединения) -> соединение
+        for _ in range(minconn):
+            self._idle.append(psycopg2.connect(*args, **kwargs))
+
+    def getconn(self):
+        with self._lock:
+            if self.closed:
+                raise pool.PoolError("connection pool is closed")
+            if self._idle:
+                connection = self._idle.pop()
+            elif len(self._used) >= self.maxconn:
+                raise pool.PoolError("connection pool exhausted")
+            else:
+                connection = psycopg2.connect(*self._args, **self._kwargs)
+            self._used[id(connection)] = connection
+            return connection
+
+    def putconn(self, connection, close=False):
+        """Вернуть соединение; закрываются только close=True и оборванные"""
+        with self._lock:
+            if self.closed:
+                raise pool.PoolError("connection pool is closed")
+            if self._used.pop(id(connection), None) is None:
+                raise pool.PoolError("trying to put unkeyed connection")
+
+            if close or connection.closed or connection.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+                connection.close()
+                return
+            try:
+                if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+                return
+            self._idle.append(connection)
+
+    def closeall(self):
+        with self._lock:
+            if self.closed:
+                raise pool.PoolError("connection pool is closed")
+            for connection in self._idle + list(self._used.values()):
+                try:
+                    connection.close()
+                except psycopg2.Error:
+                    pass
+            self._idle.clear()
+            self._used.clear()
+            self.closed = True
+
+    def stats(self):
+        """Свободные и выданные соединения"""
+        with self._lock:
+            return {'idle': len(self._idle), 'in_use': len(self._used)}
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Соединение, которое помнит, какие запросы на нём уже подготовлены"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def build_university(row):
+    """Собрать словарь университета из строки UNIVERSITY_DETAILS_QUERY"""
+    links_row = row['links']
+    links = {
+        'website': links_row['website'] or '',
+        'admissions': links_row['admissions'] or '',
+        'scholarships': links_row['scholarships'] or ''
+    } if links_row else {}
+
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'country': row['country_name'],
+        'country_id': row['country_id'],
+        'card': row['card'],
+        'website': row['website'],
+        'programs': format_programs(row['programs']),
+        'documents': row['documents'],
+        'scholarships': row['scholarships'],
+        'deadlines': row['deadlines'],
+        'process': row['process'],
+        'links': links
+    }
+
+
+def format_programs(programs):
+    """Форматировать список программ в строку"""
+    if not programs:
+        return "Информация о программах отсутствует"
+
+    formatted = "📚 **Программы университета:**\n\n"
+    for program in programs:
+        formatted += f"• {program['name']} ({program['degree']})\n"
+        formatted += f"  Язык: {program['language']}\n"
+        formatted += f"  Стоимость: {program['price']}\n\n"
+    return formatted
+
+
+# Разметка университетов по направлениям.
+# Классификация выполняется при записи: триггеры на universities и programs
+# пересчитывают направления изменённого университета по ключевым словам
+# из direction_keywords, поэтому поиск по направлению — это выборка по индексу.
+DIRECTION_TAGS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS direction_keywords (
+        direction varchar(20) NOT NULL,
+        keyword varchar(100) NOT NULL,
+        PRIMARY KEY (direction, keyword)
+    );
+
+    CREATE TABLE IF NOT EXISTS university_directions (
+        direction varchar(20) NOT NULL,
+        university_id integer NOT NULL REFERENCES universities(id) ON DELETE CASCADE,
+        PRIMARY KEY (direction, university_id)
+    );
+
+    CREATE OR REPLACE FUNCTION refresh_university_directions(uni_id integer) RETURNS void AS $$
+    BEGIN
+        DELETE FROM university_directions WHERE university_id = uni_id;
+        INSERT INTO university_directions (direction, university_id)
+        SELECT DISTINCT k.direction, uni_id
+        FROM direction_keywords k
+        WHERE EXISTS (SELECT 1 FROM universities u
+                      WHERE u.id = uni_id AND u.card ILIKE '%' || k.keyword || '%')
+           OR EXISTS (SELECT 1 FROM programs p
+                      WHERE p.university_id = uni_id AND p.name ILIKE '%' || k.keyword || '%');
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION universities_directions_trigger() RETURNS trigger AS $$
+    BEGIN
+        PERFORM refresh_university_directions(NEW.id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION programs_directions_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM refresh_university_directions(OLD.university_id);
+        END IF;
+        IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.university_id IS DISTINCT FROM OLD.university_id) THEN
+            PERFORM refresh_university_directions(NEW.university_id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_universities_directions ON universities;
+    CREATE TRIGGER trg_universities_directions
+        AFTER INSERT OR UPDATE OF card ON universities
+        FOR EACH ROW EXECUTE FUNCTION universities_directions_trigger();
+
+    DROP TRIGGER IF EXISTS trg_programs_directions ON programs;
+    CREATE TRIGGER trg_programs_directions
+        AFTER INSERT OR UPDATE OF name, university_id OR DELETE ON programs
+        FOR EACH ROW EXECUTE FUNCTION programs_directions_trigger();
+"""
+
+
+DIRECTION_KEYWORD_INSERT = "INSERT INTO direction_keywords (direction, keyword) VALUES (%s, %s)"
+
+# Разметка есть, если таблицы созданы и ключевые слова записаны (второй запрос — только когда таблицы есть)
+DIRECTION_TAGS_EXIST_QUERY = (
+    "SELECT to_regclass('direction_keywords') IS NOT NULL AND to_regclass('university_directions') IS NOT NULL"
+)
+DIRECTION_TAGS_FILLED_QUERY = "SELECT EXISTS (SELECT 1 FROM direction_keywords)"
+
+
+def direction_keyword_rows(keywords_map):
+    """Строки direction_keywords: (направление, ключевое слово в нижнем регистре)"""
+    return sorted({(direction, keyword.lower())
+                   for direction, keywords in keywords_map.items()
+                   for keyword in keywords})
+
+
+def direction_patterns(direction_key, keywords_map=DIRECTION_KEYWORDS):
+    """ILIKE-шаблоны ключевых слов направления для поиска без разметки"""
+    return [f"%{keyword.lower()}%" for keyword in keywords_map.get(direction_key, ())]
+
+
+class QueryStats:
+    """
+    Статистика запросов, общая для Database и async_database.AsyncDatabase:
+    время методов и запросов (MetricsRegistry) и журнал медленных запросов.
+    Класс-наследник вызывает _init_query_stats() и реализует pool_stats().
+    """
+
+    def _init_query_stats(self):
+        # Время выполнения методов и запросов; запросы дольше DB_SLOW_QUERY_MS попадают в журнал
+        self.stats = MetricsRegistry()
+        self.slow_query_ms = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+        self._slow_queries = deque(maxlen=int(os.getenv('DB_SLOW_QUERY_LOG_SIZE', '100')))
+
+    def _observe_query(self, statement, params, elapsed, rows):
+        """Учесть выполненный запрос из PREPARED_STATEMENTS"""
+        self.stats.observe(f"sql.{statement}", elapsed, rows=rows)
+        if elapsed * 1000 >= self.slow_query_ms:
+            self._log_slow_query(statement, params, elapsed)
+
+    def _log_slow_query(self, statement, params, elapsed):
+        """Записать медленный запрос в журнал"""
+        entry = {
+            'statement': statement,
+            'sql': " ".join(PREPARED_STATEMENTS[statement].split()),
+            'params': params,
+            'ms': elapsed * 1000,
+            'at': time.time(),
+        }
+        self._slow_queries.append(entry)
+        self.stats.incr('slow_queries')
+        print(f"🐢 Медленный запрос {statement} ({entry['ms']:.0f} мс), параметры: {params}")
+
+    def slow_queries(self):
+        """Последние медленные запросы: SQL, параметры, длительность"""
+        return list(self._slow_queries)
+
+    def query_stats(self):
+        """
+        Статистика работы с базой: задержки методов и запросов (p50/p95/p99),
+        число строк и ошибок, состояние пула и кэша.
+        """
+        snapshot = self.stats.snapshot()
+        snapshot['pool'] = self.pool_stats()
+        snapshot['cache'] = self.cache_stats()
+        return snapshot
+
+    def dump_stats(self):
+        """Статистика работы с базой в виде текста"""
+        lines = [self.stats.dump() or "Запросов пока не было"]
+        lines.append(f"pool: {self.pool_stats()}")
+        if self.cache is not None:
+            lines.append(f"cache: {self.cache_stats()}")
+        lines.append(f"slow queries (>= {self.slow_query_ms:.0f} ms): {len(self._slow_queries)}")
+        return "\n".join(lines)
+
+    def cache_stats(self):
+        """Попадания и промахи кэша каталога (None, если кэш выключен)"""
+        return self.cache.stats() if self.cache is not None else None
+
+
+class Database(QueryStats):
+    def __init__(self, minconn=None, maxconn=None, timeout=None, cache=None, prepared=None):
+        # minconn соединений открывается сразу, дальше пул растёт до maxconn
+        # и свободные соединения не закрывает (см. KeepIdlePool)
+        self.minconn = int(minconn or os.getenv('DB_POOL_MIN', '1'))
+        self.maxconn = int(maxconn or os.getenv('DB_POOL_MAX', '10'))
+        # Сколько секунд ждать свободное соединение, прежде чем сдаться
+        self.timeout = float(timeout or os.getenv('DB_POOL_TIMEOUT', '10'))
+        # Соединения, простаивавшие дольше этого, проверяются через SELECT 1
+        self.ping_interval = float(os.getenv('DB_POOL_PING_INTERVAL', '30'))
+
+        # Кэш каталога (страны, университеты): DB_CACHE=0 отключает
+        if cache is None:
+            cache = os.getenv('DB_CACHE', '1') != '0'
+        self.cache = TTLCache(int(os.getenv('DB_CACHE_MAX_ENTRIES', '2048'))) if cache else None
+
+        # Серверные prepared statements для частых запросов: DB_PREPARED_STATEMENTS=0 отключает
+        if prepared is None:
+            prepared = os.getenv('DB_PREPARED_STATEMENTS', '1') != '0'
+        self.use_prepared = prepared
+
+        # Растёт при каждом сбросе кэша: производные данные (готовые клавиатуры,
+        # см. keyboards.py) по ней понимают, что каталог изменился
+        self.catalog_version = 0
+
+        # Разметка по направлениям: None — ещё не проверяли, True — есть,
+        # False — нет и создать не удалось (поиск по ключевым словам)
+        self._direction_tags = None
+        self._direction_tags_lock = threading.Lock()
+
+        self._init_query_stats()
+
+        # Пул создаётся при первом обращении к базе (или в warmup()),
+        # поэтому импорт модуля не ждёт PostgreSQL и не падает без него
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._last_used = {}    # id(соединения) -> время возврата в пул
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'checkouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'timeouts': 0,
+            'reconnects': 0,
+        }
+
     def connect(self):
-        """Подключение к PostgreSQL"""
+        """Подключение к PostgreSQL (создание пула соединений)"""
+        started = time.monotonic()
         try:
-            self.connection = psycopg2.connect(
+            self.pool = KeepIdlePool(
+                self.minconn,
+                self.maxconn,
                 host=os.getenv('DB_HOST', 'localhost'),
                 port=os.getenv('DB_PORT', '5433'),
                 database=os.getenv('DB_NAME', 'bot_db'),
                 user=os.getenv('DB_USER', 'postgres'),
-                password=os.getenv('DB_PASSWORD', '1234')
+                password=os.getenv('DB_PASSWORD', '1234'),
+                connection_factory=PreparingConnection
             )
-            print("✅ Подключение к базе данных установлено")
+            elapsed = (time.monotonic() - started) * 1000
+            print(f"✅ Подключение к базе данных установлено за {elapsed:.0f} мс (пул {self.minconn}–{self.maxconn})")
         except Exception as e:
             print(f"❌ Ошибка подключения к базе данных: {e}")
             raise
-    
-    def get_countries(self):
-        """Получить все страны"""
+
+    def _ensure_pool(self):
+        """Создать пул при первом использовании"""
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self.connect()
+
+    def warmup(self):
+        """
+        Подключиться заранее, не дожидаясь первого запроса (например, при старте бота).
+        Открывает minconn соединений и проверяет, что база отвечает.
+        """
+        started = time.monotonic()
+        self._ensure_pool()
+        with self.get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            connection.rollback()
+        elapsed = (time.monotonic() - started) * 1000
+        print(f"✅ База данных готова к работе ({elapsed:.0f} мс)")
+
+    @contextmanager
+    def get_connection(self):
+        """
+        Взять соединение из пула на время блока with.
+        При ошибке транзакция откатывается, оборванное соединение закрывается.
+        """
+        self._ensure_pool()
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._stats['timeouts'] += 1
+            raise pool.PoolError("Нет свободных соединений с базой данных")
+
+        connection = None
+        broken = False
         try:
-            with self.connection.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute("SELECT id, name FROM countries ORDER BY name")
-                return cursor.fetchall()
-        except Exception as e:
-            print(f"Ошибка при получении стран: {e}")
-            return []
-    
-    def get_universities_by_country(self, country_name):
-        """Получить университеты по названию страны"""
+            connection = self._checkout()
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self._stats['checkouts'] += 1
+                self._stats['wait_total'] += waited
+                self._stats['wait_max'] = max(self._stats['wait_max'], waited)
+
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            if connection is not None and not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            if connection is not None:
+                broken = broken or bool(connection.closed)
+                if not broken:
+                    self._last_used[id(connection)] = time.monotonic()
+                self.pool.putconn(connection, close=broken)
+                if connection.closed:
+                    # id закрытого соединения может достаться новому — запись убираем
+                    self._last_used.pop(id(connection), None)
+            self._slots.release()
+
+    def _checkout(self):
+        """Достать соединение из пула и убедиться, что оно живое"""
+        connection = self.pool.getconn()
         try:
-            with self.connection.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute("""
-                    SELECT u.id, u.name, u.card, u.website, c.name as country_name
-                    FROM universities u
-                    JOIN countries c ON u.country_id = c.id
-                    WHERE c.name = %s
-                    ORDER BY u.name
-                """, (country_name,))
-                return cursor.fetchall()
-        except Exception as e:
-            print(f"Ошибка при получении университетов: {e}")
-            return []
-    
-    def get_university_by_name(self, country_name, university_name):
-        """Получить полную информацию об университете по названию и стране"""
+            healthy = self._is_healthy(connection)
+        except psycopg2.Error:
+            healthy = False
+        except Exception:
+            # Соединение не выдаём и не теряем: закрываем и возвращаем пулу
+            self._discard(connection)
+            raise
+        if healthy:
+            return connection
+
+        self._discard(connection)
+        with self._stats_lock:
+            self._stats['reconnects'] += 1
+        return self.pool.getconn()
+
+    def _discard(self, connection):
+        """Закрыть соединение и вернуть его место в пул"""
+        self._last_used.pop(id(connection), None)
+        self.pool.putconn(connection, close=True)
+
+    def _is_healthy(self, connection):
+        """Проверка соединения перед выдачей"""
+        if connection.closed:
+            return False
+
+        status = connection.info.transaction_status
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status == TRANSACTION_STATUS_INERROR:
+            connection.rollback()
+
+        last_used = self._last_used.get(id(connection))
+        if last_used is None or time.monotonic() - last_used < self.ping_interval:
+            return True
+
         try:
-            with self.connection.cursor(cursor_factory=DictCursor) as cursor:
-                # Получаем основную информацию об университете
-                cursor.execute("""
-                    SELECT u.id, u.name, u.card, u.website, c.name as country_name
-                    FROM universities u
-                    JOIN countries c ON u.country_id = c.id
-                    WHERE c.name = %s AND u.name = %s
-                """, (country_name, university_name))
-                
-                university = cursor.fetchone()
-                if not university:
-                    return None
-                
-                university_id = university['id']
-                
-                # Получаем программы
-                cursor.execute("""
-                    SELECT name, degree, language, price 
-                    FROM programs 
-                    WHERE university_id = %s
-                    ORDER BY name
-                """, (university_id,))
-                programs = cursor.fetchall()
-                
-                # Получаем документы
-                cursor.execute("""
-                    SELECT document_list 
-                    FROM documents 
-                    WHERE university_id = %s
-                """, (university_id,))
-                documents_row = cursor.fetchone()
-                documents = documents_row['document_list'] if documents_row else None
-                
-                # Получаем стипендии
-                cursor.execute("""
-                    SELECT description 
-                    FROM scholarships 
-                    WHERE university_id = %s
-                """, (university_id,))
-                scholarships_row = cursor.fetchone()
-                scholarships = scholarships_row['description'] if scholarships_row else None
-                
-                # Получаем дедлайны
-                cursor.execute("""
-                    SELECT description 
-                    FROM deadlines 
-                    WHERE university_id = %s
-                """, (university_id,))
-                deadlines_row = cursor.fetchone()
-                deadlines = deadlines_row['description'] if deadlines_row else None
-                
-                # Получаем процесс поступления
-                cursor.execute("""
-                    SELECT steps 
-                    FROM admission_process 
-                    WHERE university_id = %s
-                """, (university_id,))
-                process_row = cursor.fetchone()
-                process = process_row['steps'] if process_row else None
-                
-                # Получаем ссылки
-                cursor.execute("""
-                    SELECT website, admissions, scholarships 
-                    FROM links 
-                    WHERE university_id = %s
-                """, (university_id,))
-                links_row = cursor.fetchone()
-                links = {
-                    'website': links_row['website'] if links_row and links_row['website'] else '',
-                    'admissions': links_row['admissions'] if links_row and links_row['admissions'] else '',
-                    'scholarships': links_row['scholarships'] if links_row and links_row['scholarships'] else ''
-                } if links_row else {}
-                
-                return {
-                    'id': university['id'],
-                    'name': university['name'],
-                    'country': university['country_name'],
-                    'card': university['card'],
-                    'website': university['website'],
-                    'programs': self._format_programs(programs),
-                    'documents': documents,
-                    'scholarships': scholarships,
-                    'deadlines': deadlines,
-                    'process': process,
-                    'links': links
-                }
-                
-        except Exception as e:
-            print(f"Ошибка при получении информации об университете: {e}")
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _execute(self, cursor, statement, params=()):
+        """
+        Выполнить частый запрос из PREPARED_STATEMENTS.
+        При включённых prepared statements запрос готовится на соединении
+        при первом использовании, дальше выполняется через EXECUTE.
+        """
+        started = time.perf_counter()
+        if not self.use_prepared:
+            cursor.execute(PREPARED_STATEMENTS[statement], params or None)
+        else:
+            connection = cursor.connection
+            if statement not in connection.prepared:
+                # Подготовленный запрос живёт, пока открыто соединение; пул их не закрывает
+                # (KeepIdlePool), так что PREPARE бывает один раз на соединение
+                cursor.execute(f"PREPARE {statement} AS {numbered_placeholders(PREPARED_STATEMENTS[statement])}")
+                connection.prepared.add(statement)
+                self.stats.incr('prepares')
+
+            if params:
+                cursor.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cursor.execute(f"EXECUTE {statement}")
+
+        self._observe_query(statement, params, time.perf_counter() - started, max(cursor.rowcount, 0))
+
+    def pool_stats(self):
+        """Статистика пула: число выдач, ожидание свободного соединения, переподключения"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['wait_avg'] = stats['wait_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        if self.pool is not None and not self.pool.closed:
+            stats.update(self.pool.stats())
+        return stats
+
+    def invalidate_cache(self, method=None):
+        """
+        Сбросить кэш каталога после изменения данных.
+        method — имя метода (например, 'get_universities_by_country'), None — весь кэш.
+        """
+        self.catalog_version += 1
+        if self.cache is None:
+            return
+        if method is None:
+            self.cache.clear()
+        else:
+            self.cache.remove_where(lambda key: key[0] == method)
+
+    @_borrows_connection("Ошибка при получении стран", [], cached=True)
+    def get_countries(self, connection):
+        """Получить все страны"""
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(cursor, 'countries')
+            return cursor.fetchall()
+
+    @_borrows_connection("Ошибка при получении университетов", [], cached=True)
+    def get_universities_by_country(self, connection, country_name):
+        """Получить университеты по названию страны"""
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(cursor, 'universities_by_country', (country_name,))
+            return cursor.fetchall()
+
+    @_borrows_connection("Ошибка при получении университетов", [], cached=True)
+    def get_universities_by_country_id(self, connection, country_id):
+        """Получить университеты страны по её id"""
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(cursor, 'universities_by_country_id', (country_id,))
+            return cursor.fetchall()
+
+    @_borrows_connection("Ошибка при получении информации об университете", None, cached=True)
+    def get_university_by_name(self, connection, country_name, university_name):
+        """Получить полную информацию об университете по названию и стране"""
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            # Все разделы карточки собираются одним запросом (вложенные SELECT и json_agg)
+            self._execute(cursor, 'university_by_name', (country_name, university_name))
+            row = cursor.fetchone()
+            return build_university(row) if row else None
+
+    @_borrows_connection("Ошибка при получении информации об университете", None, cached=True)
+    def get_university_by_id(self, connection, university_id):
+        """Получить полную информацию об университете по id"""
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(cursor, 'university_by_id', (university_id,))
+            row = cursor.fetchone()
+            return build_university(row) if row else None
+
+    def get_universities_full(self, university_ids):
+        """
+        Полная информация о нескольких университетах за один запрос
+        (независимо от их числа). Словари — как у get_university_by_name,
+        в порядке university_ids; несуществующие id пропускаются.
+        """
+        university_ids = list(dict.fromkeys(university_ids))
+        found = {}
+
+        # То, что уже есть в кэше карточек, в базу не запрашиваем
+        if self.cache is not None:
+            for university_id in university_ids:
+                value = self.cache.get(_cache_key('get_university_by_id', (university_id,)))
+                if value is not MISSING and value is not None:
+                    found[university_id] = value
+
+        missing = [university_id for university_id in university_ids if university_id not in found]
+        if missing:
+            for university in self._fetch_universities(missing):
+                found[university['id']] = university
+                if self.cache is not None:
+                    self.cache.set(_cache_key('get_university_by_id', (university['id'],)), university,
+                                   ttl=CACHE_TTLS['get_university_by_id'])
+
+        return [found[university_id] for university_id in university_ids if university_id in found]
+
+    @_borrows_connection("Ошибка при получении информации об университетах", [])
+    def _fetch_universities(self, connection, university_ids):
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(cursor, 'universities_by_ids', (list(university_ids),))
+            return [build_university(row) for row in cursor.fetchall()]
+
+    @_borrows_connection("Ошибка при получении раздела университета", None, cached=True)
+    def get_university_section(self, connection, university_id, section):
+        """
+        Получить один раздел карточки университета одним запросом.
+        section: documents, scholarships, deadlines, process или programs.
+        Возвращает текст раздела или None, если раздела нет.
+        """
+        if section not in UNIVERSITY_SECTION_QUERIES:
             return None
-    
-    def _format_programs(self, programs):
-        """Форматировать список программ в строку"""
-        if not programs:
-            return "Информация о программах отсутствует"
-        
-        formatted = "📚 **Программы университета:**\n\n"
-        for program in programs:
-            formatted += f"• {program['name']} ({program['degree']})\n"
-            formatted += f"  Язык: {program['language']}\n"
-            formatted += f"  Стоимость: {program['price']}\n\n"
-        return formatted
-    
-    def search_universities_by_direction(self, direction_keywords):
-        """Поиск университетов по ключевым словам в направлениях"""
-        try:
-            with self.connection.cursor(cursor_factory=DictCursor) as cursor:
-                # Используем ILIKE для поиска без учета регистра
-                query = """
-                    SELECT DISTINCT u.id, u.name, u.card, c.name as country_name
-                    FROM universities u
-                    JOIN countries c ON u.country_id = c.id
-                    LEFT JOIN programs p ON u.id = p.university_id
-                    WHERE u.card ILIKE ANY(%s) 
-                       OR p.name ILIKE ANY(%s)
-                    ORDER BY c.name, u.name
-                """
-                
-                # Создаем список поисковых шаблонов
-                like_patterns = [f'%{keyword}%' for keyword in direction_keywords]
-                
-                cursor.execute(query, (like_patterns, like_patterns))
-                return cursor.fetchall()
-                
-        except Exception as e:
-            print(f"Ошибка при поиске университетов по направлению: {e}")
-            return []
-    
+
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(cursor, f'section_{section}', (university_id,))
+            if section == 'programs':
+                return format_programs(cursor.fetchall())
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    @_borrows_connection("Ошибка при поиске университетов по направлению", [], cached=True)
+    def search_universities_by_direction(self, connection, direction_key):
+        """
+        Университеты направления по разметке university_directions. Если разметки
+        ещё нет (sync_direction_tags не вызывали), она создаётся при первом поиске;
+        если создать не удалось — поиск по ключевым словам, как до разметки.
+        """
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            if self._ensure_direction_tags(connection):
+                self._execute(cursor, 'direction_search', (direction_key,))
+            else:
+                patterns = direction_patterns(direction_key)
+                self._execute(cursor, 'direction_keyword_search', (patterns, patterns))
+            return cursor.fetchall()
+
+    def _ensure_direction_tags(self, connection):
+        """Есть ли разметка по направлениям; при первом вызове создаёт её, если её нет"""
+        if self._direction_tags is not None:
+            return self._direction_tags
+        with self._direction_tags_lock:
+            if self._direction_tags is not None:
+                return self._direction_tags
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(DIRECTION_TAGS_EXIST_QUERY)
+                    ready = cursor.fetchone()[0]
+                    if ready:
+                        cursor.execute(DIRECTION_TAGS_FILLED_QUERY)
+                        ready = cursor.fetchone()[0]
+                if not ready:
+                    self._sync_direction_tags(connection, DIRECTION_KEYWORDS)
+                self._direction_tags = True
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # Соединение оборвалось — решим при повторе запроса
+                raise
+            except psycopg2.Error as e:
+                connection.rollback()
+                self._direction_tags = False
+                print(f"⚠️ Нет разметки по направлениям, создать её не удалось ({e}) — поиск по ключевым словам")
+            return self._direction_tags
+
+    def sync_direction_tags(self, keywords_map=DIRECTION_KEYWORDS):
+        """
+        Создать таблицы и триггеры разметки по направлениям, записать ключевые
+        слова и заново разметить все университеты. Вызывать после изменения
+        списков ключевых слов; если разметки нет, её создаёт первый поиск.
+        """
+        with self.get_connection() as connection:
+            self._sync_direction_tags(connection, keywords_map)
+        self._direction_tags = True
+        self.invalidate_cache('search_universities_by_direction')
+
+    def _sync_direction_tags(self, connection, keywords_map):
+        with self.stats.timer('sync_direction_tags'), connection.cursor() as cursor:
+            cursor.execute(DIRECTION_TAGS_SCHEMA)
+            cursor.execute("DELETE FROM direction_keywords")
+            cursor.executemany(DIRECTION_KEYWORD_INSERT, direction_keyword_rows(keywords_map))
+            cursor.execute("SELECT refresh_university_directions(id) FROM universities")
+            connection.commit()
+        print("✅ Разметка университетов по направлениям обновлена")
+
     def close(self):
-        """Закрыть соединение с базой данных"""
-        if self.connection:
-            self.connection.close()
+        """Закрыть все соединения с базой данных"""
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+            self._last_used.clear()
             print("Соединение с базой данных закрыто")
 
-# Создаем глобальный экземпляр базы данных
-db = Database()
\ No newline at end of file
+# Создаем глобальный экземпляр базы данных (подключение — при первом запросе)
+db = Database()
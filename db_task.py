@@ -5,7 +5,7 @@ import datetime
 
 def run_queries():
     try:
-        with db.connection.cursor() as cursor:
+        with db.get_connection() as connection, connection.cursor() as cursor:
 
             # -----------------------------
             # 1 Страны
@@ -169,13 +169,16 @@ def run_queries():
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_answers_question_date ON answers(question_id, created_at DESC);")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_universities_country ON universities(country_id);")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_surveys_user ON user_surveys(user_id);")
+            # Разделы карточки университета читаются по university_id
+            for table in ("programs", "documents", "scholarships", "deadlines", "admission_process", "links"):
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_university ON {table}(university_id);")
             print("✅ Индексы созданы/проверены.")
 
-            db.connection.commit()
+            connection.commit()
 
     except Exception as e:
+        # Откат транзакции выполняет db.get_connection()
         print("❌ Ошибка при выполнении SQL-запросов:", e)
-        db.connection.rollback()
 
 
 # -----------------------------
@@ -14,7 +14,7 @@ def run_queries():
     - Автообновление данных
     """
     try:
-        with db.connection.cursor() as cursor:
+        with db.get_connection() as connection, connection.cursor() as cursor:
             # -----------------------------
             # 1️⃣ Простые запросы
             # -----------------------------
@@ -114,11 +114,14 @@ def run_queries():
             """)
             print("✅ Цены программ обновлены автоматически.")
 
-            db.connection.commit()
+            connection.commit()
+
+        # Каталог изменился — сбрасываем кэш
+        db.invalidate_cache()
     
     except Exception as e:
+        # Откат транзакции выполняет db.get_connection()
         print("❌ Ошибка при выполнении SQL-запросов:", e)
-        db.connection.rollback()
 
 
 # -----------------------------
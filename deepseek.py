@@ -4,6 +4,15 @@ from telebot.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeybo
 from telebot import types
 import openai
 from functools import partial
+from ai_workers import AIWorkerPool
+from sessions import SessionStore
+from ai_cache import AIResponseCache
+from webhook import run_bot
+from callback_router import CallbackRouter
+import callbacks
+from keyboards import KeyboardCache
+from catalog import LiveCatalog
+from send_scheduler import install_send_scheduler, edit_or_send, when_sent
 
 
 # -----------------------------
@@ -19,21 +28,35 @@ openai.api_key = openrouter_key
 
 bot = telebot.TeleBot(TOKEN)
 
+# Все нажатия inline-кнопок проходят через один обработчик с поиском по префиксу
+router = CallbackRouter(bot)
+
+# Исходящие сообщения — через очередь с ограничениями Telegram (30/с на бота, ~1/с на чат);
+# SEND_SCHEDULER=0 — отправлять напрямую
+send_scheduler = install_send_scheduler(bot)
+
 # -----------------------------
-# Глобальные словари
+# Сессии пользователей: роль, страна, направление, режим ИИ,
+# открытая карточка и история для кнопки «Назад»
 # -----------------------------
-user_roles = {}         # chat_id → роль
-user_countries = {}     # chat_id → страна
-user_directions = {}    # chat_id → направление
-user_states = {}        # chat_id → текущее состояние (для ИИ и т.д.)
-expanded_sections_uni = {}  # chat_id -> {"uni_name": str, "expanded": set()}
-user_navigation = {}    # chat_id -> список предыдущих состояний для кнопки "Назад"
+sessions = SessionStore("deepseek")
+
+# Вопросы к ИИ обрабатываются в фоне, чтобы не занимать потоки telebot
+ai_workers = AIWorkerPool(workers=4, max_queue=100)
+
+# Одинаковые вопросы не отправляются в OpenRouter повторно
+AI_MODEL = "deepseek/deepseek-chat-v3-0324:free"
+ai_cache = AIResponseCache()
 
 # -----------------------------
-# Чтение данных из JSON
+# Чтение данных из JSON: каталог с индексами по стране, названию и направлению.
+# Правки universities.json подхватываются без перезапуска бота
 # -----------------------------
-with open("universities.json", "r", encoding="utf-8") as f:
-    university_data = json.load(f)
+catalog = LiveCatalog("universities.json")
+
+# Готовые тексты и клавиатуры каталога (JSON), строятся один раз
+keyboards = KeyboardCache(version=lambda: catalog.version)
+UNI_SECTIONS = ["documents", "scholarships", "deadlines", "process", "programs"]
 
 # Направления для выбора
 DIRECTIONS = {
@@ -47,6 +70,10 @@ DIRECTIONS = {
 # Функция для общения с ИИ
 # -----------------------------
 def ask_ai(prompt, role_context=""):
+    cached = ai_cache.get(prompt, role_context, AI_MODEL)
+    if cached is not None:
+        return cached
+
     try:
         system_prompt = """Ты консультант по поступлению и профориентации. Помогай пользователям с вопросами о поступлении в университеты, выборе направлений, подготовке документов, поиске грантов и стипендий. Отвечай подробно и поддерживающе."""
         
@@ -54,13 +81,15 @@ def ask_ai(prompt, role_context=""):
             system_prompt += f"\n\nПользователь: {role_context}"
         
         response = openai.ChatCompletion.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
+            model=AI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ]
         )
-        return response.choices[0].message['content']
+        answer = response.choices[0].message['content']
+        ai_cache.set(prompt, role_context, AI_MODEL, answer)
+        return answer
     except Exception as e:
         return f"❗ Ошибка при обращении к ИИ: {str(e)}"
 
@@ -69,15 +98,12 @@ def ask_ai(prompt, role_context=""):
 # -----------------------------
 def add_navigation(chat_id, state):
     """Добавляет состояние в историю навигации"""
-    if chat_id not in user_navigation:
-        user_navigation[chat_id] = []
-    user_navigation[chat_id].append(state)
+    sessions.get(chat_id).push_navigation(state)
 
 def get_previous_state(chat_id):
     """Возвращает предыдущее состояние и удаляет его из истории"""
-    if chat_id in user_navigation and user_navigation[chat_id]:
-        return user_navigation[chat_id].pop()
-    return None
+    navigation = sessions.get(chat_id).navigation
+    return navigation.pop() if navigation else None
 
 # -----------------------------
 # Главное меню
@@ -103,8 +129,7 @@ def reference_menu():
 def start(message):
     chat_id = message.chat.id
     # Очищаем историю навигации
-    if chat_id in user_navigation:
-        user_navigation[chat_id] = []
+    sessions.get(chat_id).navigation.clear()
     
     bot.send_message(
         chat_id,
@@ -142,8 +167,8 @@ def handle_main_menu(message):
         bot.send_message(chat_id, "👇 Выберите вашу категорию:", reply_markup=markup)
         
     elif message.text == "💬 ИИ-помощник":
-        user_states[chat_id] = "ai_assistant"
-        role = user_roles.get(chat_id, "пользователь")
+        sessions.get(chat_id).state = "ai_assistant"
+        role = sessions.get(chat_id).role or "пользователь"
         bot.send_message(
             chat_id, 
             f"🤖 Режим ИИ-помощника\n\n"
@@ -165,21 +190,31 @@ def handle_main_menu(message):
 # -----------------------------
 # Обработка сообщений в режиме ИИ
 # -----------------------------
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == "ai_assistant")
+@bot.message_handler(func=lambda message: sessions.peek(message.chat.id).state == "ai_assistant")
 def handle_ai_message(message):
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "пользователь")
-    
-    bot.send_message(chat_id, "🤔 Думаю над ответом...")
+    role = sessions.get(chat_id).role or "пользователь"
     
-    response = ask_ai(message.text, f"Категория пользователя: {role}")
+    bot.send_chat_action(chat_id, 'typing')
+    placeholder = bot.send_message(chat_id, "🤔 Думаю над ответом...")
     
-    bot.send_message(chat_id, f"💡 {response}")
+    # Заглушка может быть ещё в очереди отправки — передаём её, а не message_id
+    if not ai_workers.submit(answer_ai_question, chat_id, placeholder, message.text, role):
+        when_sent(placeholder, lambda sent: bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=sent.message_id,
+            text="⚠️ Сейчас слишком много вопросов к ИИ. Пожалуйста, повторите через минуту."
+        ))
+
+def answer_ai_question(chat_id, placeholder, prompt, role):
+    """Фоновая задача: получить ответ ИИ и подставить его вместо заглушки"""
+    response = ask_ai(prompt, f"Категория пользователя: {role}")
+    edit_or_send(bot, chat_id, placeholder, f"💡 {response}")
 
 # -----------------------------
 # Выбор роли
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("role_"))
+@router.route("role_")
 def role_selected(call):
     role_map = {
         "school": "Школьник",
@@ -190,11 +225,10 @@ def role_selected(call):
     role_key = call.data.split("_")[1]
     role_name = role_map.get(role_key, role_key)
     chat_id = call.message.chat.id
-    user_roles[chat_id] = role_name
+    sessions.get(chat_id).role = role_name
     
     # Сбрасываем состояние ИИ
-    if chat_id in user_states:
-        del user_states[chat_id]
+    sessions.get(chat_id).state = None
     
     # Добавляем в навигацию
     add_navigation(chat_id, "role_selection")
@@ -223,12 +257,12 @@ def role_selected(call):
 # -----------------------------
 # Выбор направления
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("direction_"))
+@router.route("direction_")
 def direction_selected(call):
     chat_id = call.message.chat.id
     direction_key = call.data.replace("direction_", "")
     direction_name = DIRECTIONS.get(direction_key, direction_key)
-    user_directions[chat_id] = direction_name
+    sessions.get(chat_id).direction = direction_name
     
     # Добавляем в навигацию
     add_navigation(chat_id, "direction_selection")
@@ -249,7 +283,7 @@ def direction_selected(call):
 # -----------------------------
 # Показать университеты по направлению
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("show_unis_by_direction_"))
+@router.route("show_unis_by_direction_")
 def show_universities_by_direction(call):
     chat_id = call.message.chat.id
     direction_key = call.data.replace("show_unis_by_direction_", "")
@@ -258,18 +292,8 @@ def show_universities_by_direction(call):
     # Добавляем в навигацию
     add_navigation(chat_id, "universities_by_direction")
     
-    # Поиск университетов по направлению
-    found_universities = []
-    
-    for country, universities in university_data.items():
-        for uni_name, uni_info in universities.items():
-            # Проверяем программы университета на соответствие направлению
-            programs = uni_info.get("programs", "").lower()
-            card = uni_info.get("card", "").lower()
-            
-            # Ищем ключевые слова в программах и карточке университета
-            if any(keyword in programs or keyword in card for keyword in get_direction_keywords(direction_key)):
-                found_universities.append((country, uni_name, uni_info))
+    # Университеты по направлению — готовый список из индекса каталога
+    found_universities = catalog.by_direction(direction_key)
     
     if not found_universities:
         markup = InlineKeyboardMarkup()
@@ -285,18 +309,18 @@ def show_universities_by_direction(call):
     # Отправляем список университетов
     text = f"🏛️ Университеты по направлению '{direction_name}':\n\n"
     
-    for i, (country, uni_name, uni_info) in enumerate(found_universities[:10], 1):  # Ограничиваем 10 университетами
-        text += f"{i}. {uni_name} ({country})\n"
+    for i, uni in enumerate(found_universities[:10], 1):  # Ограничиваем 10 университетами
+        text += f"{i}. {uni.name} ({uni.country})\n"
     
     if len(found_universities) > 10:
         text += f"\n... и еще {len(found_universities) - 10} университетов"
     
     # Кнопки для выбора конкретного университета
     markup = InlineKeyboardMarkup()
-    for country, uni_name, uni_info in found_universities[:5]:  # Ограничиваем 5 кнопками
+    for uni in found_universities[:5]:  # Ограничиваем 5 кнопками
         markup.add(InlineKeyboardButton(
-            f"{uni_name} ({country})", 
-            callback_data=f"uni_{country}_{uni_name}"
+            f"{uni.name} ({uni.country})", 
+            callback_data=callbacks.pack(callbacks.UNIVERSITY, uni.id)
         ))
     
     markup.add(InlineKeyboardButton("Выбрать страну", callback_data="choose_country"))
@@ -309,106 +333,88 @@ def show_universities_by_direction(call):
         reply_markup=markup
     )
 
-def get_direction_keywords(direction_key):
-    """Возвращает ключевые слова для поиска по направлениям"""
-    keywords_map = {
-        "business": ["бизнес", "финанс", "менеджмент", "экономик", "маркетинг", "предпринимательство", "business", "finance", "management", "economics"],
-        "it": ["информацион", "компьютер", "программир", "it", "инженер", "техническ", "наука", "технолог", "computer", "engineering", "technology", "science"],
-        "medicine": ["медицин", "биолог", "здоровь", "фармацевт", "хирург", "врач", "анатом", "medicine", "biology", "health", "medical"],
-        "art": ["искусств", "дизайн", "медиа", "арт", "творчеств", "худож", "музык", "кино", "art", "design", "media", "creative"]
-    }
-    return keywords_map.get(direction_key, [])
-
 # -----------------------------
 # Выбор страны
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data == "choose_country")
+@router.route("choose_country", exact=True)
 def choose_country(call):
     chat_id = call.message.chat.id
     add_navigation(chat_id, "country_selection")
     
-    markup = InlineKeyboardMarkup()
-    countries = list(university_data.keys())
-    for c in countries:
-        markup.add(InlineKeyboardButton(c, callback_data=f"country_{c}"))
-    markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_direction"))
-    
     bot.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
         text="Выберите страну:",
-        reply_markup=markup
+        reply_markup=countries_markup()
     )
 
+def countries_markup():
+    """Клавиатура выбора страны (JSON)"""
+    current = catalog.current
+
+    def build():
+        markup = InlineKeyboardMarkup()
+        for c in current.countries():
+            markup.add(InlineKeyboardButton(c, callback_data=callbacks.pack(callbacks.COUNTRY, current.country_id(c))))
+        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_direction"))
+        return markup.to_json()
+    return keyboards.get(('countries', current.version), build)
+
 # -----------------------------
 # Выбор университета по стране
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("country_"))
+@router.route(callbacks.prefix(callbacks.COUNTRY))
 def country_selected(call):
     chat_id = call.message.chat.id
-    country = call.data.replace("country_", "")
-    user_countries[chat_id] = country
+    country_id, = callbacks.unpack(call.data)
 
-    universities = university_data.get(country, {})
-    if not universities:
+    current = catalog.current
+    country = current.country_by_id(country_id)
+    if country is None or not current.universities(country):
         markup = InlineKeyboardMarkup()
         markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
         bot.send_message(chat_id, "Университеты для этой страны пока не добавлены.", reply_markup=markup)
         return
 
+    sessions.get(chat_id).country = country
     add_navigation(chat_id, "universities_list")
 
-    markup = InlineKeyboardMarkup()
-    for uni_name in universities.keys():
-        markup.add(InlineKeyboardButton(uni_name, callback_data=f"uni_{country}_{uni_name}"))
-    markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
-    
     bot.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
         text=f"Выберите университет в {country}:", 
-        reply_markup=markup
+        reply_markup=country_universities_markup(country, current)
     )
 
+def country_universities_markup(country, current=None):
+    """Клавиатура списка университетов страны (JSON) по версии каталога current"""
+    current = current or catalog.current
+
+    def build():
+        markup = InlineKeyboardMarkup()
+        for uni in current.by_country(country):
+            markup.add(InlineKeyboardButton(uni.name, callback_data=callbacks.pack(callbacks.UNIVERSITY, uni.id)))
+        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
+        return markup.to_json()
+    return keyboards.get(('country', current.version, country), build)
+
 # -----------------------------
 # Показ card университета + кнопки
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("uni_"))
+@router.route(callbacks.prefix(callbacks.UNIVERSITY))
 def uni_selected(call):
     chat_id = call.message.chat.id
-    parts = call.data.split("_")
-    if len(parts) >= 3:
-        country = parts[1]
-        uni_name = "_".join(parts[2:])
-    else:
-        bot.send_message(chat_id, "Ошибка при выборе университета")
-        return
-        
-    if country not in university_data or uni_name not in university_data[country]:
+    uni_id, = callbacks.unpack(call.data)
+
+    current = catalog.current
+    if current.by_id(uni_id) is None:
         bot.send_message(chat_id, "Информация об университете не найдена")
         return
-        
-    uni_info = university_data[country][uni_name]
 
-    expanded_sections_uni[chat_id] = {"uni_name": uni_name, "expanded": set()}
+    sessions.get(chat_id).open_card(uni_id)
     add_navigation(chat_id, "university_view")
 
-    text = uni_info.get("card", "Информация о университете недоступна")
-    markup = InlineKeyboardMarkup()
-
-    # кнопки раскрытия разделов
-    for section in ["documents", "scholarships", "deadlines", "process", "programs"]:
-        if section in uni_info:
-            markup.add(InlineKeyboardButton(section.capitalize(), callback_data=f"uni_section_{section}"))
-
-    # кнопки ссылок
-    links = uni_info.get("links", {})
-    for name, url in links.items():
-        markup.add(InlineKeyboardButton(name.capitalize(), url=url))
-
-    # кнопка возврата
-    markup.add(InlineKeyboardButton("← Назад к университету", callback_data=f"back_to_university_{country}"))
-
+    text, markup = university_view(uni_id, current=current)
     bot.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
@@ -416,58 +422,63 @@ def uni_selected(call):
         reply_markup=markup
     )
 
+def university_view(uni_id, expanded=(), current=None):
+    """(текст, клавиатура JSON) карточки университета с раскрытыми разделами expanded по версии каталога current"""
+    expanded = tuple(sec for sec in UNI_SECTIONS if sec in expanded)
+    current = current or catalog.current
+
+    def build():
+        uni = current.by_id(uni_id)
+        uni_info = uni.info
+
+        # Текст: карточка и раскрытые разделы
+        text = uni_info.get("card", "Информация о университете недоступна")
+        for sec in expanded:
+            if sec in uni_info:
+                text += f"\n\n*{sec.capitalize()}:*\n{uni_info[sec]}"
+
+        # кнопки раскрытия разделов (открытые отмечены)
+        markup = InlineKeyboardMarkup()
+        for sec in UNI_SECTIONS:
+            if sec in uni_info:
+                btn_text = f"✅ {sec.capitalize()}" if sec in expanded else sec.capitalize()
+                markup.add(InlineKeyboardButton(btn_text, callback_data=callbacks.pack_section(uni_id, sec)))
+
+        # кнопки ссылок
+        links = uni_info.get("links", {})
+        for name, url in links.items():
+            markup.add(InlineKeyboardButton(name.capitalize(), url=url))
+
+        # кнопка возврата
+        markup.add(InlineKeyboardButton("← Назад к университету",
+                                        callback_data=callbacks.pack(callbacks.BACK_TO_COUNTRY, current.country_id(uni.country))))
+        return text, markup.to_json()
+
+    return keyboards.get(('card', current.version, uni_id, expanded), build)
+
 # -----------------------------
 # Раскрытие секций университета
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("uni_section_"))
+@router.route(callbacks.prefix(callbacks.SECTION))
 def uni_section_toggle(call):
     chat_id = call.message.chat.id
-    section = call.data.replace("uni_section_", "")
-
-    if chat_id not in expanded_sections_uni:
-        return
-
-    uni_name = expanded_sections_uni[chat_id]["uni_name"]
+    uni_id, section = callbacks.unpack_section(call.data)
 
-    # находим страну
-    country = None
-    for c, unis in university_data.items():
-        if uni_name in unis:
-            country = c
-            break
-    if not country:
+    current = catalog.current
+    if current.by_id(uni_id) is None:
         return
 
-    uni_info = university_data[country][uni_name]
+    session = sessions.get(chat_id)
+    if session.card != uni_id:
+        session.open_card(uni_id)
 
     # Тоггл секции: если открыта — закрыть, если закрыта — открыть
-    if section in expanded_sections_uni[chat_id]["expanded"]:
-        expanded_sections_uni[chat_id]["expanded"].remove(section)
+    if section in session.expanded:
+        session.expanded.remove(section)
     else:
-        expanded_sections_uni[chat_id]["expanded"].add(section)
+        session.expanded.add(section)
 
-    # Формируем текст
-    text = uni_info.get("card", "")
-    for sec in ["documents", "scholarships", "deadlines", "process", "programs"]:
-        if sec in expanded_sections_uni[chat_id]["expanded"] and sec in uni_info:
-            text += f"\n\n*{sec.capitalize()}:*\n{uni_info[sec]}"
-
-    # Формируем кнопки
-    markup = InlineKeyboardMarkup()
-    for sec in ["documents", "scholarships", "deadlines", "process", "programs"]:
-        if sec in uni_info:
-            if sec in expanded_sections_uni[chat_id]["expanded"]:
-                btn_text = f"✅ {sec.capitalize()}"  # отмечаем, что секция открыта
-            else:
-                btn_text = sec.capitalize()
-            markup.add(InlineKeyboardButton(btn_text, callback_data=f"uni_section_{sec}"))
-
-    links = uni_info.get("links", {})
-    for name, url in links.items():
-        markup.add(InlineKeyboardButton(name.capitalize(), url=url))
-
-    # кнопка возврата
-    markup.add(InlineKeyboardButton("← Назад к университету", callback_data=f"back_to_university_{country}"))
+    text, markup = university_view(uni_id, session.expanded, current)
 
     bot.edit_message_text(
         chat_id=chat_id,
@@ -480,7 +491,7 @@ def uni_section_toggle(call):
 # -----------------------------
 # Обработка кнопки "Назад"
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("back_"))
+@router.route("back_")
 def handle_back(call):
     chat_id = call.message.chat.id
     back_action = call.data
@@ -511,7 +522,7 @@ def handle_back(call):
         
     elif back_action == "back_to_direction":
         # Возврат к выбору направления
-        role_name = user_roles.get(chat_id, "пользователь")
+        role_name = sessions.get(chat_id).role or "пользователь"
         markup = InlineKeyboardMarkup()
         for key, direction in DIRECTIONS.items():
             markup.add(InlineKeyboardButton(direction, callback_data=f"direction_{key}"))
@@ -526,43 +537,39 @@ def handle_back(call):
         
     elif back_action == "back_to_countries":
         # Возврат к выбору страны
-        markup = InlineKeyboardMarkup()
-        countries = list(university_data.keys())
-        for c in countries:
-            markup.add(InlineKeyboardButton(c, callback_data=f"country_{c}"))
-        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_direction"))
-        
         bot.edit_message_text(
             chat_id=chat_id,
             message_id=call.message.message_id,
             text="Выберите страну:",
-            reply_markup=markup
-        )
-        
-    elif back_action.startswith("back_to_university_"):
-        # Возврат к просмотру университета
-        country = back_action.replace("back_to_university_", "")
-        if chat_id in user_countries:
-            user_countries[chat_id] = country
-            
-        # Повторно показываем список университетов страны
-        universities = university_data.get(country, {})
-        markup = InlineKeyboardMarkup()
-        for uni_name in universities.keys():
-            markup.add(InlineKeyboardButton(uni_name, callback_data=f"uni_{country}_{uni_name}"))
-        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
-        
-        bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=call.message.message_id,
-            text=f"Выберите университет в {country}:", 
-            reply_markup=markup
+            reply_markup=countries_markup()
         )
 
+# -----------------------------
+# Возврат к списку университетов страны (с карточки)
+# -----------------------------
+@router.route(callbacks.prefix(callbacks.BACK_TO_COUNTRY))
+def back_to_country_universities(call):
+    chat_id = call.message.chat.id
+    country_id, = callbacks.unpack(call.data)
+
+    current = catalog.current
+    country = current.country_by_id(country_id)
+    if country is None:
+        return
+    sessions.get(chat_id).country = country
+
+    # Повторно показываем список университетов страны
+    bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        text=f"Выберите университет в {country}:", 
+        reply_markup=country_universities_markup(country, current)
+    )
+
 # -----------------------------
 # Обработка справочника
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("ref_"))
+@router.route("ref_")
 def handle_reference(call):
     chat_id = call.message.chat.id
     ref_type = call.data.replace("ref_", "")
@@ -582,4 +589,4 @@ def handle_reference(call):
 # -----------------------------      
 if __name__ == "__main__":
     print("Бот запущен...")
-    bot.infinity_polling()
\ No newline at end of file
+    run_bot(bot)  # BOT_MODE=webhook — через webhook, иначе polling
\ No newline at end of file
@@ -4,6 +4,9 @@ from telebot.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeybo
 from telebot import types
 import openai
 from functools import partial
+from webhook import run_bot
+from catalog import LiveCatalog
+from send_scheduler import install_send_scheduler
 
 
 # -----------------------------
@@ -19,6 +22,10 @@ openai.api_key = openrouter_key
 
 bot = telebot.TeleBot(TOKEN)
 
+# Исходящие сообщения — через очередь с ограничениями Telegram (30/с на бота, ~1/с на чат);
+# SEND_SCHEDULER=0 — отправлять напрямую
+send_scheduler = install_send_scheduler(bot)
+
 # -----------------------------
 # Глобальные словари
 # -----------------------------
@@ -27,10 +34,10 @@ user_countries = {}     # chat_id → страна
 expanded_sections_uni = {}  # chat_id -> {"uni_name": str, "expanded": set()}
 
 # -----------------------------
-# Чтение данных из JSON
+# Чтение данных из JSON: каталог с индексами по стране и названию.
+# Правки universities.json подхватываются без перезапуска бота
 # -----------------------------
-with open("universities.json", "r", encoding="utf-8") as f:
-    university_data = json.load(f)
+catalog = LiveCatalog("universities.json")
 
 
 # Функция для общения с ИИ
@@ -87,7 +94,7 @@ def role_selected(call):
 @bot.callback_query_handler(func=lambda call: call.data == "choose_country")
 def choose_country(call):
     markup = types.InlineKeyboardMarkup()
-    countries = list(university_data.keys())
+    countries = catalog.countries()
     for c in countries:
         markup.add(types.InlineKeyboardButton(c, callback_data=f"country_{c}"))
     bot.edit_message_text(chat_id=call.message.chat.id,
@@ -104,7 +111,7 @@ def country_selected(call):
     country = call.data.replace("country_", "")
     user_countries[chat_id] = country
 
-    universities = university_data.get(country, {})
+    universities = catalog.universities(country)
     if not universities:
         bot.send_message(chat_id, "Университеты для этой страны пока не добавлены.")
         return
@@ -122,7 +129,7 @@ def country_selected(call):
 def uni_selected(call):
     chat_id = call.message.chat.id
     _, country, uni_name = call.data.split("_", 2)
-    uni_info = university_data[country][uni_name]
+    uni_info = catalog.get(country, uni_name)
 
     expanded_sections_uni[chat_id] = {"uni_name": uni_name, "expanded": set()}
 
@@ -155,15 +162,12 @@ def uni_section_toggle(call):
     uni_name = expanded_sections_uni[chat_id]["uni_name"]
 
     # находим страну
-    country = None
-    for c, unis in university_data.items():
-        if uni_name in unis:
-            country = c
-            break
+    current = catalog.current
+    country = current.country_of(uni_name)
     if not country:
         return
 
-    uni_info = university_data[country][uni_name]
+    uni_info = current.get(country, uni_name)
 
     # Тоггл секции: если открыта — закрыть, если закрыта — открыть
     if section in expanded_sections_uni[chat_id]["expanded"]:
@@ -196,4 +200,4 @@ def uni_section_toggle(call):
 # -----------------------------
 # Запуск бота
 # -----------------------------
-bot.infinity_polling()
+run_bot(bot)  # BOT_MODE=webhook — через webhook, иначе polling
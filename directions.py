@@ -0,0 +1,23 @@
+# -----------------------------
+# Направления для выбора
+# -----------------------------
+DIRECTIONS = {
+    "business": "Бизнес / Финансы",
+    "it": "IT / Инженерия / Наука",
+    "medicine": "Медицина / Биология / Здоровье",
+    "art": "Искусство / Дизайн / Медиа"
+}
+
+# Ключевые слова направлений: ищутся как подстроки (без учета регистра)
+# в карточке университета и в названиях его программ
+DIRECTION_KEYWORDS = {
+    "business": ["бизнес", "финанс", "менеджмент", "экономик", "маркетинг", "предпринимательство", "business", "finance", "management", "economics", "бизнес", "финансы", "экономика"],
+    "it": ["информацион", "компьютер", "программир", "it", "инженер", "техническ", "наука", "технолог", "computer", "engineering", "technology", "science", "программирование", "инженерия"],
+    "medicine": ["медицин", "биолог", "здоровь", "фармацевт", "хирург", "врач", "анатом", "medicine", "biology", "health", "medical", "биология", "медицина", "здоровье"],
+    "art": ["искусств", "дизайн", "медиа", "арт", "творчеств", "худож", "музык", "кино", "art", "design", "media", "creative", "творчество", "дизайн", "искусство"]
+}
+
+
+def get_direction_keywords(direction_key):
+    """Возвращает ключевые слова для поиска по направлениям"""
+    return DIRECTION_KEYWORDS.get(direction_key, [])
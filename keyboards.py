@@ -0,0 +1,57 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from cache import MISSING, TTLCache
+
+load_dotenv()
+
+
+class KeyboardCache:
+    """
+    Готовые тексты и клавиатуры, построенные по данным каталога.
+
+    Значение строится один раз (build()) и дальше отдаётся как есть; клавиатуры
+    хранятся уже сериализованными в JSON — telebot передаёт строку reply_markup
+    в Telegram без повторной сборки кнопок.
+
+    version() — версия каталога: когда она меняется, все записи сбрасываются.
+    invalidate() сбрасывает кэш вручную (например, после перезагрузки данных).
+    """
+
+    def __init__(self, version=None, max_entries=None, ttl=None):
+        self.version = version or (lambda: 0)
+        self._cache = TTLCache(
+            int(max_entries or os.getenv('KEYBOARD_CACHE_MAX_ENTRIES', '4096')),
+            int(ttl or os.getenv('KEYBOARD_CACHE_TTL', '900'))
+        )
+        self._built_for = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, key, build):
+        """Готовое значение для key; build() вызывается только при промахе (None не кэшируется)"""
+        version = self.version()
+        if version != self._built_for:
+            with self._lock:
+                if version != self._built_for:
+                    self._cache.clear()
+                    self._built_for = version
+
+        value = self._cache.get(key)
+        if value is MISSING:
+            value = build()
+            self.builds += 1
+            if value is not None:
+                self._cache.set(key, value)
+        return value
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['builds'] = self.builds
+        stats['version'] = self._built_for
+        return stats
@@ -1,5 +1,7 @@
 import telebot
 from telebot import types
+from webhook import run_bot
+from send_scheduler import install_send_scheduler
 
 # -----------------------------
 # Чтение токена из файла
@@ -9,6 +11,10 @@ with open("app/tgbot_token.txt", "r", encoding="utf-8") as f:
 
 bot = telebot.TeleBot(TOKEN)
 
+# Исходящие сообщения — через очередь с ограничениями Telegram (30/с на бота, ~1/с на чат);
+# SEND_SCHEDULER=0 — отправлять напрямую
+send_scheduler = install_send_scheduler(bot)
+
 # -----------------------------
 # Глобальные словари для ролей, стран и раскрытых секций
 # -----------------------------
@@ -412,4 +418,4 @@ def doc_toggle(call):
 # -----------------------------
 # Запуск бота
 # -----------------------------
-bot.infinity_polling()
+run_bot(bot)  # BOT_MODE=webhook — через webhook, иначе polling
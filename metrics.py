@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class LatencyStats:
+    """
+    Задержки одной операции: перцентили считаются по последним max_samples
+    замерам, счётчики вызовов, ошибок и строк — за всё время.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds, rows=0, error=False):
+        self.samples.append(seconds)
+        self.count += 1
+        self.rows += rows
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def percentile(self, percent):
+        """Перцентиль в секундах по последним замерам"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class MetricsRegistry:
+    """Набор именованных замеров задержек и счётчиков (потокобезопасный)"""
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._latency = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, rows=0, error=False):
+        """Записать длительность операции name"""
+        with self._lock:
+            stats = self._latency.get(name)
+            if stats is None:
+                stats = self._latency[name] = LatencyStats(self.max_samples)
+            stats.record(seconds, rows, error)
+
+    @contextmanager
+    def timer(self, name):
+        """with metrics.timer('name'): ... — замер блока, исключение считается ошибкой"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.observe(name, time.perf_counter() - started, error=True)
+            raise
+        self.observe(name, time.perf_counter() - started)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._counters[name] = value
+
+    def snapshot(self):
+        """Все метрики в виде словаря"""
+        with self._lock:
+            return {
+                'latency': {name: stats.snapshot() for name, stats in sorted(self._latency.items())},
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def dump(self):
+        """Метрики в виде текстовой таблицы"""
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot['latency']:
+            lines.append(f"{'операция':<36}{'вызовы':>8}{'ошибки':>8}{'строки':>8}"
+                         f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+            for name, stats in snapshot['latency'].items():
+                lines.append(f"{name:<36}{stats['count']:>8}{stats['errors']:>8}{stats['rows']:>8}"
+                             f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                             f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+        for name, value in snapshot['counters'].items():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._counters.clear()
@@ -3,8 +3,22 @@ import telebot
 from telebot.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from telebot import types
 from openai import OpenAI
+import math
+import threading
 import time
 from database import db  # Импортируем нашу базу данных
+from directions import DIRECTIONS
+import callbacks
+from rate_limit import KeyedRateLimiter
+from ai_workers import AIWorkerPool
+from sessions import SessionStore
+from ai_streaming import StreamingMessage
+from metrics import MetricsRegistry
+from ai_cache import AIResponseCache
+from webhook import run_bot
+from callback_router import CallbackRouter
+from keyboards import KeyboardCache
+from send_scheduler import install_send_scheduler, edit_or_send, when_sent
 
 
 # -----------------------------
@@ -24,76 +38,117 @@ client = OpenAI(
 
 bot = telebot.TeleBot(TOKEN)
 
+# Все нажатия inline-кнопок проходят через один обработчик с поиском по префиксу
+router = CallbackRouter(bot)
+
+# Исходящие сообщения — через очередь с ограничениями Telegram (30/с на бота, ~1/с на чат);
+# SEND_SCHEDULER=0 — отправлять напрямую
+send_scheduler = install_send_scheduler(bot)
+
 # -----------------------------
-# Глобальные словари
+# Сессии пользователей: роль, страна, направление, режим ИИ,
+# открытая карточка и история для кнопки «Назад»
 # -----------------------------
-user_roles = {}         # chat_id → роль
-user_countries = {}     # chat_id → страна
-user_directions = {}    # chat_id → направление
-user_states = {}        # chat_id → текущее состояние (для ИИ и т.д.)
-expanded_sections_uni = {}  # chat_id -> {"uni_name": str, "expanded": set()}
-user_navigation = {}    # chat_id -> список предыдущих состояний для кнопки "Назад"
-last_ai_request = {}    # chat_id -> timestamp последнего запроса к ИИ
+sessions = SessionStore("pgbot")
+
+# Готовые тексты и клавиатуры каталога (JSON); сбрасываются вместе с кэшем базы
+keyboards = KeyboardCache(version=lambda: db.catalog_version)
 
 # -----------------------------
-# Направления для выбора
+# Ограничения для ИИ
 # -----------------------------
-DIRECTIONS = {
-    "business": "Бизнес / Финансы",
-    "it": "IT / Инженерия / Наука", 
-    "medicine": "Медицина / Биология / Здоровье",
-    "art": "Искусство / Дизайн / Медиа"
-}
+AI_REQUESTS_PER_MINUTE = 6      # на один чат, в среднем
+AI_BURST = 3                    # сколько вопросов подряд можно задать без ожидания
+AI_MAX_CONCURRENT = 4           # одновременных запросов к OpenRouter на весь бот
+
+ai_limiter = KeyedRateLimiter(rate=AI_REQUESTS_PER_MINUTE / 60, capacity=AI_BURST, max_keys=10000)
+ai_upstream_slots = threading.BoundedSemaphore(AI_MAX_CONCURRENT)
+
+# Вопросы к ИИ обрабатываются в фоне, чтобы не занимать потоки telebot
+AI_QUEUE_SIZE = 100
+ai_workers = AIWorkerPool(workers=AI_MAX_CONCURRENT, max_queue=AI_QUEUE_SIZE)
+
+# Ответ ИИ показывается по мере генерации (правками сообщения)
+AI_STREAMING = True
+
+# Время до первого токена, полное время ответа, ошибки
+ai_metrics = MetricsRegistry()
 
+# Одинаковые вопросы не отправляются в OpenRouter повторно
+AI_MODEL = "deepseek/deepseek-chat-v3-0324:free"
+ai_cache = AIResponseCache()
 
 
 # -----------------------------
 # Функция для общения с ИИ
 # -----------------------------
-def ask_ai(prompt, role_context=""):
+def ask_ai(prompt, role_context="", on_text=None):
+    """
+    Ответ ИИ на вопрос пользователя.
+    Если передан on_text, ответ запрашивается потоком и on_text(накопленный текст)
+    вызывается по мере прихода токенов.
+    """
+    cached = ai_cache.get(prompt, role_context, AI_MODEL)
+    if cached is not None:
+        return cached
+
+    # Не ждём свободного места: если к ИИ уже идёт AI_MAX_CONCURRENT запросов, сразу отвечаем
+    if not ai_upstream_slots.acquire(blocking=False):
+        return "⚠️ ИИ-помощник сейчас отвечает другим пользователям. Пожалуйста, повторите вопрос через несколько секунд."
+
     try:
-        # Проверяем rate limiting
-        current_time = time.time()
-        if role_context and current_time - last_ai_request.get(role_context, 0) < 2:
-            time.sleep(2)
-        
-        last_ai_request[role_context] = current_time
-        
         system_prompt = """Ты консультант по поступлению и профориентации. Помогай пользователям с вопросами о поступлении в университеты, выборе направлений, подготовке документов, поиске грантов и стипендий. Отвечай подробно и поддерживающе."""
         
         if role_context:
             system_prompt += f"\n\nПользователь: {role_context}"
         
+        started = time.monotonic()
         response = client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
+            model=AI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=1500,
-            timeout=30
+            timeout=30,
+            stream=on_text is not None
         )
-        return response.choices[0].message.content
+        if on_text is None:
+            text = response.choices[0].message.content
+        else:
+            text = ""
+            for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not text:
+                    ai_metrics.observe('time_to_first_token', time.monotonic() - started)
+                text += delta
+                on_text(text)
+        ai_metrics.observe('completion', time.monotonic() - started)
+
+        ai_cache.set(prompt, role_context, AI_MODEL, text)
+        return text
     except Exception as e:
+        ai_metrics.incr('errors')
         if "rate-limited" in str(e) or "429" in str(e):
             return "⚠️ Слишком много запросов к ИИ. Пожалуйста, подождите немного перед следующим вопросом."
         else:
             return f"❌ Временная проблема с ИИ-помощником. Пожалуйста, попробуйте позже или используйте другие функции бота."
+    finally:
+        ai_upstream_slots.release()
 
 # -----------------------------
 # Навигационные функции
 # -----------------------------
 def add_navigation(chat_id, state):
     """Добавляет состояние в историю навигации"""
-    if chat_id not in user_navigation:
-        user_navigation[chat_id] = []
-    user_navigation[chat_id].append(state)
+    sessions.get(chat_id).push_navigation(state)
 
 def get_previous_state(chat_id):
     """Возвращает предыдущее состояние и удаляет его из истории"""
-    if chat_id in user_navigation and user_navigation[chat_id]:
-        return user_navigation[chat_id].pop()
-    return None
+    navigation = sessions.get(chat_id).navigation
+    return navigation.pop() if navigation else None
 
 # -----------------------------
 # Главное меню (без справочника)
@@ -110,8 +165,7 @@ def main_menu():
 def start(message):
     chat_id = message.chat.id
     # Очищаем историю навигации
-    if chat_id in user_navigation:
-        user_navigation[chat_id] = []
+    sessions.get(chat_id).navigation.clear()
     
     bot.send_message(
         chat_id,
@@ -149,8 +203,8 @@ def handle_main_menu(message):
         bot.send_message(chat_id, "👇 Выберите вашу категорию:", reply_markup=markup)
         
     elif message.text == "💬 ИИ-помощник":
-        user_states[chat_id] = "ai_assistant"
-        role = user_roles.get(chat_id, "пользователь")
+        sessions.get(chat_id).state = "ai_assistant"
+        role = sessions.get(chat_id).role or "пользователь"
         bot.send_message(
             chat_id, 
             f"🤖 Режим ИИ-помощника\n\n"
@@ -165,24 +219,48 @@ def handle_main_menu(message):
 # -----------------------------
 # Обработка сообщений в режиме ИИ
 # -----------------------------
-@bot.message_handler(func=lambda message: user_states.get(message.chat.id) == "ai_assistant")
+@bot.message_handler(func=lambda message: sessions.peek(message.chat.id).state == "ai_assistant")
 def handle_ai_message(message):
     chat_id = message.chat.id
-    role = user_roles.get(chat_id, "пользователь")
+    role = sessions.get(chat_id).role or "пользователь"
+
+    # Ограничение частоты вопросов для каждого чата: не спим, а сразу просим подождать
+    allowed, retry_after = ai_limiter.try_acquire(chat_id)
+    if not allowed:
+        bot.send_message(chat_id, f"⏳ Слишком много вопросов подряд. Пожалуйста, подождите {math.ceil(retry_after)} с.")
+        return
     
-    # Показываем, что бот "печатает"
+    # Показываем, что бот "печатает", и сразу отвечаем заглушкой — ответ ИИ придёт правкой
     bot.send_chat_action(chat_id, 'typing')
-    
+    placeholder = bot.send_message(chat_id, "🤔 Думаю над ответом...")
+
+    # Заглушка может быть ещё в очереди отправки — передаём её, а не message_id
+    if not ai_workers.submit(answer_ai_question, chat_id, placeholder, message.text, role):
+        when_sent(placeholder, lambda sent: bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=sent.message_id,
+            text="⚠️ Сейчас слишком много вопросов к ИИ. Пожалуйста, повторите через минуту."
+        ))
+
+def answer_ai_question(chat_id, placeholder, prompt, role):
+    """Фоновая задача: получить ответ ИИ и подставить его вместо заглушки"""
+    if AI_STREAMING:
+        reply = StreamingMessage(bot, chat_id, placeholder)
+        reply.finish(ask_ai(prompt, f"Категория пользователя: {role}", on_text=reply.update))
+        return
+
     try:
-        response = ask_ai(message.text, f"Категория пользователя: {role}")
-        bot.send_message(chat_id, f"💡 {response}")
+        response = ask_ai(prompt, f"Категория пользователя: {role}")
+        text = f"💡 {response}"
     except Exception as e:
-        bot.send_message(chat_id, "❌ Произошла ошибка при обращении к ИИ. Попробуйте позже.")
+        text = "❌ Произошла ошибка при обращении к ИИ. Попробуйте позже."
+
+    edit_or_send(bot, chat_id, placeholder, text)
 
 # -----------------------------
 # Выбор роли
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("role_"))
+@router.route("role_")
 def role_selected(call):
     role_map = {
         "school": "Школьник",
@@ -193,11 +271,10 @@ def role_selected(call):
     role_key = call.data.split("_")[1]
     role_name = role_map.get(role_key, role_key)
     chat_id = call.message.chat.id
-    user_roles[chat_id] = role_name
+    sessions.get(chat_id).role = role_name
     
     # Сбрасываем состояние ИИ
-    if chat_id in user_states:
-        del user_states[chat_id]
+    sessions.get(chat_id).state = None
     
     # Добавляем в навигацию
     add_navigation(chat_id, "role_selection")
@@ -226,12 +303,12 @@ def role_selected(call):
 # -----------------------------
 # Выбор направления
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("direction_"))
+@router.route("direction_")
 def direction_selected(call):
     chat_id = call.message.chat.id
     direction_key = call.data.replace("direction_", "")
     direction_name = DIRECTIONS.get(direction_key, direction_key)
-    user_directions[chat_id] = direction_name
+    sessions.get(chat_id).direction = direction_name
     
     # Добавляем в навигацию
     add_navigation(chat_id, "direction_selection")
@@ -252,7 +329,7 @@ def direction_selected(call):
 # -----------------------------
 # Показать университеты по направлению
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("show_unis_by_direction_"))
+@router.route("show_unis_by_direction_")
 def show_universities_by_direction(call):
     chat_id = call.message.chat.id
     direction_key = call.data.replace("show_unis_by_direction_", "")
@@ -261,11 +338,8 @@ def show_universities_by_direction(call):
     # Добавляем в навигацию
     add_navigation(chat_id, "universities_by_direction")
     
-    # Получаем ключевые слова для поиска
-    keywords = get_direction_keywords(direction_key)
-    
-    # Ищем университеты в базе данных
-    found_universities = db.search_universities_by_direction(keywords)
+    # Ищем университеты в базе данных (разметка по направлениям, см. directions.py)
+    found_universities = db.search_universities_by_direction(direction_key)
     
     if not found_universities:
         markup = InlineKeyboardMarkup()
@@ -292,7 +366,7 @@ def show_universities_by_direction(call):
     for university in found_universities[:5]:  # Ограничиваем 5 кнопками
         markup.add(InlineKeyboardButton(
             f"{university['name']} ({university['country_name']})", 
-            callback_data=f"uni_{university['country_name']}_{university['name']}"
+            callback_data=callbacks.pack(callbacks.UNIVERSITY, university['id'])
         ))
     
     markup.add(InlineKeyboardButton("Выбрать страну", callback_data="choose_country"))
@@ -305,36 +379,21 @@ def show_universities_by_direction(call):
         reply_markup=markup
     )
 
-def get_direction_keywords(direction_key):
-    """Возвращает ключевые слова для поиска по направлениям"""
-    keywords_map = {
-        "business": ["бизнес", "финанс", "менеджмент", "экономик", "маркетинг", "предпринимательство", "business", "finance", "management", "economics", "бизнес", "финансы", "экономика"],
-        "it": ["информацион", "компьютер", "программир", "it", "инженер", "техническ", "наука", "технолог", "computer", "engineering", "technology", "science", "программирование", "инженерия"],
-        "medicine": ["медицин", "биолог", "здоровь", "фармацевт", "хирург", "врач", "анатом", "medicine", "biology", "health", "medical", "биология", "медицина", "здоровье"],
-        "art": ["искусств", "дизайн", "медиа", "арт", "творчеств", "худож", "музык", "кино", "art", "design", "media", "creative", "творчество", "дизайн", "искусство"]
-    }
-    return keywords_map.get(direction_key, [])
-
 # -----------------------------
 # Выбор страны
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data == "choose_country")
+@router.route("choose_country", exact=True)
 def choose_country(call):
     chat_id = call.message.chat.id
     add_navigation(chat_id, "country_selection")
     
-    # Получаем страны из базы данных
-    countries = db.get_countries()
+    # Клавиатура стран (из базы данных, строится один раз)
+    markup = countries_markup()
     
-    if not countries:
+    if not markup:
         bot.send_message(chat_id, "Страны не найдены в базе данных.")
         return
     
-    markup = InlineKeyboardMarkup()
-    for country in countries:
-        markup.add(InlineKeyboardButton(country['name'], callback_data=f"country_{country['name']}"))
-    markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_direction"))
-    
     bot.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
@@ -342,76 +401,84 @@ def choose_country(call):
         reply_markup=markup
     )
 
+def countries_markup():
+    """Клавиатура выбора страны (JSON) или None, если стран нет"""
+    def build():
+        countries = db.get_countries()
+        if not countries:
+            return None
+        markup = InlineKeyboardMarkup()
+        for country in countries:
+            markup.add(InlineKeyboardButton(country['name'], callback_data=callbacks.pack(callbacks.COUNTRY, country['id'])))
+        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_direction"))
+        return markup.to_json()
+    return keyboards.get(('countries',), build)
+
 # -----------------------------
 # Выбор университета по стране
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("country_"))
+def country_universities_view(country_id):
+    """(страна, текст, клавиатура JSON) списка университетов или None, если их нет"""
+    def build():
+        universities = db.get_universities_by_country_id(country_id)
+        if not universities:
+            return None
+        country_name = universities[0]['country_name']
+        markup = InlineKeyboardMarkup()
+        for university in universities:
+            markup.add(InlineKeyboardButton(university['name'], callback_data=callbacks.pack(callbacks.UNIVERSITY, university['id'])))
+        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
+        return country_name, f"Выберите университет в {country_name}:", markup.to_json()
+    return keyboards.get(('country', country_id), build)
+
+def show_country_universities(call, view):
+    """Список университетов страны (кнопки с id университета)"""
+    country_name, text, markup = view
+    sessions.get(call.message.chat.id).country = country_name
+    
+    bot.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=text, 
+        reply_markup=markup
+    )
+
+@router.route(callbacks.prefix(callbacks.COUNTRY))
 def country_selected(call):
     chat_id = call.message.chat.id
-    country_name = call.data.replace("country_", "")
-    user_countries[chat_id] = country_name
+    country_id, = callbacks.unpack(call.data)
 
-    # Получаем университеты из базы данных
-    universities = db.get_universities_by_country(country_name)
+    # Университеты из базы данных (готовый список, если он уже строился)
+    view = country_universities_view(country_id)
     
-    if not universities:
+    if not view:
         markup = InlineKeyboardMarkup()
         markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
         bot.send_message(chat_id, "Университеты для этой страны пока не добавлены.", reply_markup=markup)
         return
 
     add_navigation(chat_id, "universities_list")
-
-    markup = InlineKeyboardMarkup()
-    for university in universities:
-        markup.add(InlineKeyboardButton(university['name'], callback_data=f"uni_{country_name}_{university['name']}"))
-    markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
-    
-    bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=call.message.message_id,
-        text=f"Выберите университет в {country_name}:", 
-        reply_markup=markup
-    )
+    show_country_universities(call, view)
 
 # -----------------------------
 # Показ card университета + кнопки
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("uni_"))
-def uni_selected(call):
-    chat_id = call.message.chat.id
-    parts = call.data.split("_")
-    if len(parts) >= 3:
-        country = parts[1]
-        uni_name = "_".join(parts[2:])
-    else:
-        bot.send_message(chat_id, "Ошибка при выборе университета")
-        return
-        
-    # Получаем полную информацию об университете из базы данных
-    uni_info = db.get_university_by_name(country, uni_name)
-    
-    if not uni_info:
-        bot.send_message(chat_id, "Информация об университете не найдена")
-        return
-    
-    expanded_sections_uni[chat_id] = {"uni_name": uni_name, "expanded": set()}
-    add_navigation(chat_id, "university_view")
-
-    text = uni_info.get("card", "Информация о университете недоступна")
+def university_card_markup(uni_info):
+    """Кнопки карточки университета: разделы, ссылки и возврат к списку"""
+    uni_id = uni_info["id"]
     markup = InlineKeyboardMarkup()
 
     # кнопки раскрытия разделов (только если есть данные)
     if uni_info.get("documents"):
-        markup.add(InlineKeyboardButton("📄 Документы", callback_data=f"uni_section_documents"))
+        markup.add(InlineKeyboardButton("📄 Документы", callback_data=callbacks.pack_section(uni_id, "documents")))
     if uni_info.get("scholarships"):
-        markup.add(InlineKeyboardButton("💰 Стипендии", callback_data=f"uni_section_scholarships"))
+        markup.add(InlineKeyboardButton("💰 Стипендии", callback_data=callbacks.pack_section(uni_id, "scholarships")))
     if uni_info.get("deadlines"):
-        markup.add(InlineKeyboardButton("🕒 Дедлайны", callback_data=f"uni_section_deadlines"))
+        markup.add(InlineKeyboardButton("🕒 Дедлайны", callback_data=callbacks.pack_section(uni_id, "deadlines")))
     if uni_info.get("process"):
-        markup.add(InlineKeyboardButton("🧭 Процесс", callback_data=f"uni_section_process"))
+        markup.add(InlineKeyboardButton("🧭 Процесс", callback_data=callbacks.pack_section(uni_id, "process")))
     if uni_info.get("programs"):
-        markup.add(InlineKeyboardButton("📚 Программы", callback_data=f"uni_section_programs"))
+        markup.add(InlineKeyboardButton("📚 Программы", callback_data=callbacks.pack_section(uni_id, "programs")))
 
     # кнопки ссылок
     links = uni_info.get("links", {})
@@ -423,93 +490,96 @@ def uni_selected(call):
         markup.add(InlineKeyboardButton("💳 Стипендии", url=links["scholarships"]))
 
     # кнопка возврата
-    markup.add(InlineKeyboardButton("← Назад к списку университетов", callback_data=f"back_to_university_{country}"))
+    markup.add(InlineKeyboardButton("← Назад к списку университетов", callback_data=callbacks.pack(callbacks.BACK_TO_COUNTRY, uni_info['country_id'])))
+    return markup
 
+def university_card_view(uni_id):
+    """(текст, клавиатура JSON) карточки университета или None, если он не найден"""
+    def build():
+        uni_info = db.get_university_by_id(uni_id)
+        if not uni_info:
+            return None
+        return uni_info.get("card") or "Информация о университете недоступна", university_card_markup(uni_info).to_json()
+    return keyboards.get(('card', uni_id), build)
+
+def show_university_card(call, uni_id):
+    """Показать карточку университета и сбросить раскрытые секции; False — университет не найден"""
+    chat_id = call.message.chat.id
+    view = university_card_view(uni_id)
+    if not view:
+        bot.send_message(chat_id, "Информация об университете не найдена")
+        return False
+
+    sessions.get(chat_id).open_card(uni_id)
+    text, markup = view
     bot.edit_message_text(
         chat_id=chat_id,
         message_id=call.message.message_id,
-        text=text, 
+        text=text,
         reply_markup=markup
     )
+    return True
+
+@router.route(callbacks.prefix(callbacks.UNIVERSITY))
+def uni_selected(call):
+    uni_id, = callbacks.unpack(call.data)
+    
+    # Карточка из базы данных (готовая, если уже строилась)
+    if show_university_card(call, uni_id):
+        add_navigation(call.message.chat.id, "university_view")
+
+# -----------------------------
+# Возврат к карточке университета (по id)
+# -----------------------------
+@router.route(callbacks.prefix(callbacks.CARD))
+def uni_card_by_id(call):
+    uni_id, = callbacks.unpack(call.data)
+    show_university_card(call, uni_id)
 
 # -----------------------------
 # Раскрытие секций университета
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("uni_section_"))
-def uni_section_toggle(call):
-    chat_id = call.message.chat.id
-    section = call.data.replace("uni_section_", "")
+SECTION_PLACEHOLDERS = {
+    "documents": "Информация о документах недоступна",
+    "scholarships": "Информация о стипендиях недоступна",
+    "deadlines": "Информация о дедлайнах недоступна",
+    "process": "Информация о процессе поступления недоступна",
+    "programs": "Информация о программах недоступна"
+}
 
-    if chat_id not in expanded_sections_uni:
-        return
+def university_section_view(uni_id, section):
+    """(текст, клавиатура JSON) раскрытого раздела карточки"""
+    def back_markup():
+        # Кнопка для сворачивания (возврата к карточке)
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("← Назад к карточке университета", callback_data=callbacks.pack(callbacks.CARD, uni_id)))
+        return markup.to_json()
 
-    uni_name = expanded_sections_uni[chat_id]["uni_name"]
-    
-    # Получаем информацию об университете для текущей страны
-    country = None
-    for c in db.get_countries():
-        uni_info = db.get_university_by_name(c['name'], uni_name)
-        if uni_info:
-            country = c['name']
-            break
-    
-    if not country:
-        return
+    def build():
+        text = db.get_university_section(uni_id, section)
+        return (text, back_markup()) if text else None
 
-    uni_info = db.get_university_by_name(country, uni_name)
-    
-    if not uni_info:
-        return
+    # Заглушка не кэшируется: раздел мог не загрузиться из-за ошибки базы
+    view = keyboards.get(('section', uni_id, section), build)
+    return view or (SECTION_PLACEHOLDERS.get(section, "Информация недоступна"), back_markup())
+
+@router.route(callbacks.prefix(callbacks.SECTION))
+def uni_section_toggle(call):
+    chat_id = call.message.chat.id
+    uni_id, section = callbacks.unpack_section(call.data)
+
+    session = sessions.get(chat_id)
+    if session.card != uni_id:
+        session.open_card(uni_id)
 
     # Если секция уже раскрыта - сворачиваем (возвращаем к основной карточке)
-    if section in expanded_sections_uni[chat_id]["expanded"]:
-        expanded_sections_uni[chat_id]["expanded"].remove(section)
-        # Возвращаем к основной карточке
-        text = uni_info.get("card", "Информация о университете недоступна")
-        markup = InlineKeyboardMarkup()
+    if section in session.expanded:
+        show_university_card(call, uni_id)
+        return
 
-        # кнопки раскрытия разделов
-        if uni_info.get("documents"):
-            markup.add(InlineKeyboardButton("📄 Документы", callback_data=f"uni_section_documents"))
-        if uni_info.get("scholarships"):
-            markup.add(InlineKeyboardButton("💰 Стипендии", callback_data=f"uni_section_scholarships"))
-        if uni_info.get("deadlines"):
-            markup.add(InlineKeyboardButton("🕒 Дедлайны", callback_data=f"uni_section_deadlines"))
-        if uni_info.get("process"):
-            markup.add(InlineKeyboardButton("🧭 Процесс", callback_data=f"uni_section_process"))
-        if uni_info.get("programs"):
-            markup.add(InlineKeyboardButton("📚 Программы", callback_data=f"uni_section_programs"))
-
-        # кнопки ссылок
-        links = uni_info.get("links", {})
-        if links.get("website"):
-            markup.add(InlineKeyboardButton("🌐 Сайт", url=links["website"]))
-        if links.get("admissions"):
-            markup.add(InlineKeyboardButton("📝 Поступление", url=links["admissions"]))
-        if links.get("scholarships"):
-            markup.add(InlineKeyboardButton("💳 Стипендии", url=links["scholarships"]))
-
-        # кнопка возврата
-        markup.add(InlineKeyboardButton("← Назад к списку университетов", callback_data=f"back_to_university_{country}"))
-
-    else:
-        # Раскрываем секцию - показываем только её содержимое
-        expanded_sections_uni[chat_id]["expanded"].add(section)
-        
-        # Получаем текст для выбранной секции
-        section_texts = {
-            "documents": uni_info.get("documents", "Информация о документах недоступна"),
-            "scholarships": uni_info.get("scholarships", "Информация о стипендиях недоступна"),
-            "deadlines": uni_info.get("deadlines", "Информация о дедлайнах недоступна"),
-            "process": uni_info.get("process", "Информация о процессе поступления недоступна"),
-            "programs": uni_info.get("programs", "Информация о программах недоступна")
-        }
-        
-        text = section_texts.get(section, "Информация недоступна")
-        
-        markup = InlineKeyboardMarkup()
-        # Кнопка для сворачивания (возврата к карточке)
-        markup.add(InlineKeyboardButton("← Назад к карточке университета", callback_data=f"uni_{country}_{uni_name}"))
+    # Раскрываем секцию - загружаем и показываем только её содержимое
+    session.expanded.add(section)
+    text, markup = university_section_view(uni_id, section)
 
     bot.edit_message_text(
         chat_id=chat_id,
@@ -522,7 +592,7 @@ def uni_section_toggle(call):
 # -----------------------------
 # Обработка кнопки "Назад"
 # -----------------------------
-@bot.callback_query_handler(func=lambda call: call.data.startswith("back_"))
+@router.route("back_")
 def handle_back(call):
     chat_id = call.message.chat.id
     back_action = call.data
@@ -553,7 +623,7 @@ def handle_back(call):
         
     elif back_action == "back_to_direction":
         # Возврат к выбору направления
-        role_name = user_roles.get(chat_id, "пользователь")
+        role_name = sessions.get(chat_id).role or "пользователь"
         markup = InlineKeyboardMarkup()
         for key, direction in DIRECTIONS.items():
             markup.add(InlineKeyboardButton(direction, callback_data=f"direction_{key}"))
@@ -568,38 +638,22 @@ def handle_back(call):
         
     elif back_action == "back_to_countries":
         # Возврат к выбору страны
-        markup = InlineKeyboardMarkup()
-        countries = db.get_countries()
-        for country in countries:
-            markup.add(InlineKeyboardButton(country['name'], callback_data=f"country_{country['name']}"))
-        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_direction"))
-        
         bot.edit_message_text(
             chat_id=chat_id,
             message_id=call.message.message_id,
             text="Выберите страну:",
-            reply_markup=markup
-        )
-        
-    elif back_action.startswith("back_to_university_"):
-        # Возврат к просмотру университета
-        country = back_action.replace("back_to_university_", "")
-        if chat_id in user_countries:
-            user_countries[chat_id] = country
-            
-        # Повторно показываем список университетов страны
-        universities = db.get_universities_by_country(country)
-        markup = InlineKeyboardMarkup()
-        for university in universities:
-            markup.add(InlineKeyboardButton(university['name'], callback_data=f"uni_{country}_{university['name']}"))
-        markup.add(InlineKeyboardButton("← Назад", callback_data="back_to_countries"))
-        
-        bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=call.message.message_id,
-            text=f"Выберите университет в {country}:", 
-            reply_markup=markup
+            reply_markup=countries_markup()
         )
+
+# -----------------------------
+# Возврат к списку университетов страны (с карточки)
+# -----------------------------
+@router.route(callbacks.prefix(callbacks.BACK_TO_COUNTRY))
+def back_to_country_universities(call):
+    country_id, = callbacks.unpack(call.data)
+    view = country_universities_view(country_id)
+    if view:
+        show_country_universities(call, view)
         
 @bot.message_handler(commands=['run_db_tasks'])
 def run_db_tasks(message):
@@ -621,5 +675,7 @@ def run_db_tasks(message):
 # Запуск бота
 # -----------------------------
 if __name__ == "__main__":
+    db.warmup()
+    db.sync_direction_tags()
     print("Бот запущен...")
-    bot.infinity_polling()
\ No newline at end of file
+    run_bot(bot)  # BOT_MODE=webhook — через webhook, иначе polling
\ No newline at end of file
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    Token bucket: rate токенов в секунду, не больше capacity про запас.
+    try_acquire не ждёт — возвращает, через сколько секунд токен появится.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """0.0 — токены списаны; иначе — сколько секунд подождать"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def peek(self, tokens=1):
+        """Как try_acquire, но без списания: 0.0 — токены есть, иначе сколько секунд ждать"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= tokens:
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def penalize(self, seconds):
+        """Запретить выдачу токенов на seconds секунд (например, после 429 от сервера)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class KeyedRateLimiter:
+    """
+    Отдельный token bucket на каждый ключ (например, chat_id).
+    Хранится не больше max_keys корзин: давно не использованные вытесняются —
+    за время простоя они всё равно успели бы наполниться.
+    """
+
+    def __init__(self, rate, capacity, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # ключ -> [токены, время обновления]
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, tokens=1):
+        """(True, 0.0), если запрос разрешён, иначе (False, секунд до следующей попытки)"""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= tokens:
+                bucket[0] -= tokens
+                return True, 0.0
+            return False, (tokens - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
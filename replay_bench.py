@@ -0,0 +1,541 @@
+"""
+Замер обработчиков бота на воспроизводимой последовательности обновлений.
+
+Модуль бота (pgbot, deepseek, gemini, main, ...) импортируется с BOT_MODE=off,
+Telegram API и OpenRouter подменяются заглушками в том же процессе, база
+данных — каталогом из universities.json (или настоящей базой, --real-db).
+Для каждого обработчика считаются p50/p99, запросы к базе и к Telegram API
+на вызов и выделенная память; итог — JSON, который удобно сравнивать между
+коммитами.
+
+Запуск:
+    python replay_bench.py pgbot [--users 50] [--repeat 3] [--output pgbot.json]
+    python replay_bench.py deepseek --compare pgbot-before.json
+    python replay_bench.py gemini --updates recorded.jsonl   # записанные Update, по одному JSON в строке
+
+Сценарий по умолчанию (SCENARIOS) — путь пользователя по меню:
+/start → категория → направление → университеты → разделы → «Назад» → страна
+→ университет → вопрос ИИ. Кнопки нажимаются по префиксу callback_data
+из последней клавиатуры, которую бот прислал в этот чат.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# До импорта модуля бота: без приёма обновлений, фоновых потоков и файлов
+os.environ['BOT_MODE'] = 'off'
+os.environ.setdefault('SESSION_BACKEND', 'memory')
+os.environ.setdefault('CATALOG_RELOAD_INTERVAL', '0')
+os.environ.setdefault('AI_CACHE_DB', '0')
+# Замеряются обработчики, а не паузы очереди отправки (send_scheduler.py)
+os.environ.setdefault('SEND_SCHEDULER', '0')
+
+from telebot import apihelper, types
+
+from metrics import MetricsRegistry
+
+FAKE_AI_ANSWER = "Чтобы получить стипендию, начните с требований университета и подготовьте документы заранее."
+
+# Шаг сценария: {"text": ...} — сообщение пользователя,
+# {"click": [префиксы]} — нажатие кнопки (index — какая по счёту из подходящих),
+# optional — шаг пропускается, если такой кнопки нет (у ботов разные меню)
+SCENARIOS = {
+    'catalog': [
+        {'text': '/start'},
+        {'click': ['role_']},
+        {'click': ['direction_']},
+        {'click': ['show_unis_by_direction_']},
+        {'click': ['#u', 'uni_']},
+        {'click': ['#s', 'uni_section_']},
+        {'click': ['#k'], 'optional': True},
+        {'click': ['#s', 'uni_section_'], 'index': 1},
+        {'click': ['#k'], 'optional': True},
+        {'click': ['#b', 'back_to_university_']},
+        {'text': '📚 Категория'},
+        {'click': ['role_'], 'index': 1},
+        {'click': ['direction_'], 'index': 1},
+        {'click': ['choose_country']},
+        {'click': ['#c', 'country_']},
+        {'click': ['#u', 'uni_']},
+        {'click': ['#b', 'back_to_university_']},
+        {'click': ['back_to_countries']},
+        {'text': '💬 ИИ-помощник'},
+        {'text': 'Как получить стипендию?'},
+    ],
+    # main.py: документы по стране и категории
+    'documents': [
+        {'text': '/start'},
+        {'click': ['role_']},
+        {'click': ['choose_country']},
+        {'click': ['country_']},
+        {'click': ['docs']},
+        {'click': ['doc_toggle_']},
+        {'click': ['doc_toggle_'], 'index': 1},
+        {'click': ['doc_toggle_']},
+    ],
+}
+DEFAULT_SCENARIO = {'main': 'documents'}
+
+
+# -----------------------------
+# Заглушка Telegram API
+# -----------------------------
+class FakeResponse:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, result):
+        self.text = json.dumps({'ok': True, 'result': result}, ensure_ascii=False)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTelegram:
+    """
+    Ответы Telegram Bot API без сети (apihelper.CUSTOM_REQUEST_SENDER).
+    Запоминает последнюю inline-клавиатуру каждого чата — по ней сценарий
+    нажимает кнопки.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.total = 0
+        self.keyboards = {}       # chat_id -> (message_id, [callback_data, ...])
+        self._message_ids = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = params or {}
+        with self._lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+            self.total += 1
+
+            if api_method == 'getMe':
+                return FakeResponse({'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'})
+            if api_method not in ('sendMessage', 'editMessageText'):
+                return FakeResponse(True)
+
+            chat_id = int(params['chat_id'])
+            if api_method == 'sendMessage':
+                message_id = self._message_ids.get(chat_id, 0) + 1
+                self._message_ids[chat_id] = message_id
+            else:
+                message_id = int(params['message_id'])
+
+            markup = params.get('reply_markup')
+            if markup:
+                buttons = json.loads(markup).get('inline_keyboard')
+                if buttons is not None:
+                    data = [button['callback_data'] for row in buttons for button in row if 'callback_data' in button]
+                    self.keyboards[chat_id] = (message_id, data)
+
+            return FakeResponse({
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            })
+
+
+# -----------------------------
+# Заглушка OpenRouter
+# -----------------------------
+class _Message(dict):
+    """message ответа: и message.content (openai>=1), и message['content'] (старый API)"""
+
+    @property
+    def content(self):
+        return self['content']
+
+
+class FakeOpenRouter:
+    """Мгновенные ответы вместо OpenRouter: openai.chat.completions.create, ChatCompletion.create и потоковый режим"""
+
+    def __init__(self, answer=FAKE_AI_ANSWER):
+        self.answer = answer
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.ChatCompletion = SimpleNamespace(create=self.create)
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        with self._lock:
+            self.requests += 1
+        if stream:
+            return (SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+                    for word in self.answer.split())
+        return SimpleNamespace(choices=[SimpleNamespace(message=_Message(content=self.answer))])
+
+
+# -----------------------------
+# Заглушка базы данных (для pgbot)
+# -----------------------------
+class FakeDatabase:
+    """
+    Те же методы, что у database.Database, но данные — из universities.json.
+    queries — число обращений к каждому методу (каждый метод Database — один запрос).
+    """
+
+    def __init__(self, path="universities.json"):
+        from catalog import Catalog
+
+        self.catalog = Catalog.from_json(path)
+        self.catalog_version = 0
+        self.queries = {}
+        self._lock = threading.Lock()
+        self._countries = [{'id': number, 'name': name}
+                           for number, name in enumerate(sorted(self.catalog.countries()), 1)]
+        self._country_ids = {country['name']: country['id'] for country in self._countries}
+        self._universities = [self.catalog.by_id(i) for i in range(len(self.catalog))]
+
+    def _count(self, name):
+        with self._lock:
+            self.queries[name] = self.queries.get(name, 0) + 1
+
+    def _row(self, university):
+        return {
+            'id': university.id + 1,
+            'name': university.name,
+            'card': university.info.get('card', ''),
+            'website': university.info.get('links', {}).get('website', ''),
+            'country_name': university.country,
+            'country_id': self._country_ids[university.country],
+        }
+
+    def get_countries(self):
+        self._count('get_countries')
+        return self._countries
+
+    def get_universities_by_country_id(self, country_id):
+        self._count('get_universities_by_country_id')
+        country = next((c['name'] for c in self._countries if c['id'] == country_id), None)
+        rows = [self._row(university) for university in self._universities if university.country == country]
+        return sorted(rows, key=lambda row: row['name'])
+
+    def get_university_by_id(self, university_id):
+        self._count('get_university_by_id')
+        university = self.catalog.by_id(university_id - 1)
+        if university is None:
+            return None
+        info = university.info
+        row = self._row(university)
+        row.update({
+            'country': university.country,
+            'programs': info.get('programs', ''),
+            'documents': info.get('documents'),
+            'scholarships': info.get('scholarships'),
+            'deadlines': info.get('deadlines'),
+            'process': info.get('process'),
+            'links': dict(info.get('links', {})),
+        })
+        return row
+
+    def get_university_section(self, university_id, section):
+        self._count('get_university_section')
+        university = self.catalog.by_id(university_id - 1)
+        return university.info.get(section) if university else None
+
+    def search_universities_by_direction(self, direction_key):
+        self._count('search_universities_by_direction')
+        rows = [self._row(university) for university in self.catalog.by_direction(direction_key)]
+        return sorted(rows, key=lambda row: (row['country_name'], row['name']))
+
+    def warmup(self):
+        pass
+
+    def sync_direction_tags(self):
+        pass
+
+    def invalidate_cache(self):
+        self.catalog_version += 1
+
+
+def _count_real_queries(db):
+    """Считать запросы настоящей базы по имени подготовленного запроса"""
+    db.queries = {}
+    execute = db._execute
+
+    def counted(cursor, statement, params=()):
+        db.queries[statement] = db.queries.get(statement, 0) + 1
+        return execute(cursor, statement, params)
+
+    db._execute = counted
+    return db
+
+
+# -----------------------------
+# Замер обработчиков
+# -----------------------------
+class HandlerProbe:
+    """Оборачивает обработчики telebot: время, запросы к базе и API, память на каждый вызов"""
+
+    def __init__(self, bot, telegram, db=None, router=None):
+        self.telegram = telegram
+        self.db = db
+        self.router = router
+        self.metrics = MetricsRegistry(max_samples=1_000_000)
+        self.counts = {}          # обработчик -> {'db_queries': .., 'api_calls': .., 'alloc_bytes': [..]}
+        self.errors = []
+        for handlers in (bot.message_handlers, bot.callback_query_handlers):
+            for handler in handlers:
+                handler['function'] = self._wrap(handler['function'])
+
+    def _db_total(self):
+        return sum(self.db.queries.values()) if self.db is not None else 0
+
+    def _label(self, function, args):
+        # Все кнопки идут через CallbackRouter.dispatch — подписываем настоящим обработчиком
+        if self.router is not None and getattr(function, '__self__', None) is self.router:
+            handler = self.router.resolve(args[0].data or "")
+            return handler.__name__ if handler else 'unmatched'
+        return function.__name__
+
+    def _wrap(self, function):
+        def probe(*args, **kwargs):
+            name = self._label(function, args)
+            db_before, api_before = self._db_total(), self.telegram.total
+            tracing = tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.reset_peak()
+                memory_before = tracemalloc.get_traced_memory()[0]
+
+            started = time.perf_counter()
+            error = False
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                error = True
+                self.errors.append(f"{name}: {e!r}")
+            elapsed = time.perf_counter() - started
+
+            counts = self.counts.setdefault(name, {'db_queries': 0, 'api_calls': 0, 'alloc_bytes': []})
+            if tracing:
+                counts['alloc_bytes'].append(tracemalloc.get_traced_memory()[1] - memory_before)
+            else:
+                self.metrics.observe(name, elapsed, error=error)
+                counts['db_queries'] += self._db_total() - db_before
+                counts['api_calls'] += self.telegram.total - api_before
+        return probe
+
+
+# -----------------------------
+# Обновления
+# -----------------------------
+class Replayer:
+    def __init__(self, bot, telegram):
+        self.bot = bot
+        self.telegram = telegram
+        self.update_id = 0
+        self.updates = 0
+        self.missed = 0
+
+    def _user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'}
+
+    def _process(self, update):
+        self.updates += 1
+        self.bot.process_new_updates([types.Update.de_json(update)])
+
+    def text(self, chat_id, text):
+        self.update_id += 1
+        self._process({'update_id': self.update_id, 'message': {
+            'message_id': self.update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': self._user(chat_id),
+            # Команды telebot распознаёт по entities
+            **({'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]}
+               if text.startswith('/') else {}),
+        }})
+
+    def click(self, chat_id, prefixes, index=0):
+        """Нажать index-ю кнопку последней клавиатуры чата с callback_data на один из prefixes"""
+        message_id, buttons = self.telegram.keyboards.get(chat_id, (None, []))
+        matching = [data for data in buttons if any(data.startswith(prefix) for prefix in prefixes)]
+        if not matching:
+            return False
+        self.update_id += 1
+        self._process({'update_id': self.update_id, 'callback_query': {
+            'id': str(self.update_id), 'from': self._user(chat_id), 'chat_instance': str(chat_id),
+            'data': matching[min(index, len(matching) - 1)],
+            'message': {'message_id': message_id, 'date': int(time.time()),
+                        'chat': {'id': chat_id, 'type': 'private'}},
+        }})
+        return True
+
+    def run_scenario(self, steps, chat_id):
+        for step in steps:
+            if 'text' in step:
+                self.text(chat_id, step['text'])
+            elif not self.click(chat_id, step['click'], step.get('index', 0)) and not step.get('optional'):
+                self.missed += 1
+
+    def run_updates(self, updates):
+        for update in updates:
+            self.update_id = max(self.update_id, update.get('update_id', 0))
+            self._process(update)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _wait_for_ai(module, timeout=30):
+    """Дождаться фоновых ответов ИИ, чтобы они не попали в следующий прогон"""
+    workers = getattr(module, 'ai_workers', None)
+    deadline = time.monotonic() + timeout
+    while workers is not None and time.monotonic() < deadline:
+        stats = workers.stats()
+        if not stats['queue_depth'] and not stats['in_flight']:
+            return
+        time.sleep(0.01)
+
+
+def run(module_name, users=50, repeat=3, scenario=None, updates=None, real_db=False):
+    telegram = FakeTelegram()
+    apihelper.CUSTOM_REQUEST_SENDER = telegram
+    ai = FakeOpenRouter()
+
+    module = importlib.import_module(module_name)
+    module.bot.threaded = False
+    for name in ('client', 'openai'):
+        if hasattr(module, name):
+            setattr(module, name, ai)
+
+    db = None
+    if hasattr(module, 'db'):
+        db = _count_real_queries(module.db) if real_db else FakeDatabase()
+        module.db = db
+
+    probe = HandlerProbe(module.bot, telegram, db, getattr(module, 'router', None))
+    replayer = Replayer(module.bot, telegram)
+    scenario = scenario or DEFAULT_SCENARIO.get(module_name, 'catalog')
+
+    def replay(chat_ids):
+        if updates is not None:
+            replayer.run_updates(updates)
+            return
+        for chat_id in chat_ids:
+            replayer.run_scenario(SCENARIOS[scenario], chat_id)
+            _wait_for_ai(module)
+
+    # Прогрев (кэши клавиатур, ленивые импорты) — в замер не входит
+    replay(range(1, 2))
+    probe.metrics.reset()
+    probe.counts.clear()
+    telegram.calls.clear()
+    if db is not None:
+        db.queries.clear()
+    updates_before, ai_before = replayer.updates, ai.requests
+
+    started = time.perf_counter()
+    for round_number in range(repeat):
+        replay(range(1000 * (round_number + 1), 1000 * (round_number + 1) + users))
+    elapsed = time.perf_counter() - started
+    replayed = replayer.updates - updates_before
+
+    # Память — отдельным прогоном: tracemalloc сильно замедляет обработчики
+    tracemalloc.start()
+    replay(range(900, 900 + min(users, 10)))
+    tracemalloc.stop()
+
+    handlers = {}
+    for name, stats in probe.metrics.snapshot()['latency'].items():
+        counts = probe.counts[name]
+        allocations = sorted(counts['alloc_bytes']) or [0]
+        handlers[name] = {
+            'calls': stats['count'],
+            'errors': stats['errors'],
+            'p50_ms': round(stats['p50_ms'], 4),
+            'p99_ms': round(stats['p99_ms'], 4),
+            'avg_ms': round(stats['avg_ms'], 4),
+            'max_ms': round(stats['max_ms'], 4),
+            'db_queries_per_call': round(counts['db_queries'] / stats['count'], 3),
+            'api_calls_per_call': round(counts['api_calls'] / stats['count'], 3),
+            'alloc_kb_p50': round(allocations[len(allocations) // 2] / 1024, 2),
+            'alloc_kb_max': round(allocations[-1] / 1024, 2),
+        }
+
+    return {
+        'module': module_name,
+        'scenario': 'updates' if updates is not None else scenario,
+        'users': users,
+        'repeat': repeat,
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'database': 'real' if real_db else ('fake' if db is not None else None),
+        'updates': replayed,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_per_s': round(replayed / elapsed, 1) if elapsed else None,
+        'missed_steps': replayer.missed,
+        'errors': len(probe.errors),
+        'error_samples': probe.errors[:5],
+        'ai_requests': ai.requests - ai_before,
+        'db_queries': dict(sorted(db.queries.items())) if db is not None else {},
+        'api_calls': dict(sorted(telegram.calls.items())),
+        'handlers': dict(sorted(handlers.items())),
+    }
+
+
+def print_report(result, baseline=None):
+    print(f"{result['module']} ({result['scenario']}): {result['updates']} обновлений за {result['elapsed_s']} с, "
+          f"{result['throughput_per_s']} в секунду, коммит {result['commit']}")
+    if result['missed_steps'] or result['errors']:
+        print(f"⚠️ Пропущено шагов: {result['missed_steps']}, ошибок: {result['errors']} {result['error_samples']}")
+    print(f"{'обработчик':<34}{'вызовы':>8}{'p50 ms':>10}{'p99 ms':>10}{'БД/выз':>8}{'API/выз':>9}{'КБ p50':>9}"
+          + (f"{'p50 было':>10}{'Δ':>8}" if baseline else ""))
+    for name, stats in result['handlers'].items():
+        line = (f"{name:<34}{stats['calls']:>8}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+                f"{stats['db_queries_per_call']:>8.2f}{stats['api_calls_per_call']:>9.2f}{stats['alloc_kb_p50']:>9.1f}")
+        before = (baseline or {}).get('handlers', {}).get(name)
+        if before:
+            change = (stats['p50_ms'] / before['p50_ms'] - 1) * 100 if before['p50_ms'] else 0.0
+            line += f"{before['p50_ms']:>10.3f}{change:>+7.0f}%"
+        print(line)
+    if result['db_queries']:
+        print(f"Запросы к базе: {result['db_queries']}")
+    print(f"Вызовы Telegram API: {result['api_calls']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер обработчиков бота на повторяемом сценарии")
+    parser.add_argument("module", help="модуль бота: pgbot, deepseek, gemini, main, ...")
+    parser.add_argument("--users", type=int, default=50, help="пользователей за прогон")
+    parser.add_argument("--repeat", type=int, default=3, help="число прогонов")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--updates", help="JSONL с записанными Update вместо сценария")
+    parser.add_argument("--real-db", action="store_true", help="настоящая база вместо каталога из JSON (pgbot)")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения p50")
+    args = parser.parse_args()
+
+    recorded = None
+    if args.updates:
+        with open(args.updates, "r", encoding="utf-8") as f:
+            recorded = [json.loads(line) for line in f if line.strip()]
+
+    result = run(args.module, args.users, args.repeat, args.scenario, recorded, args.real_db)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"✅ Результаты сохранены в {args.output}")
+    sys.exit(1 if result['errors'] else 0)
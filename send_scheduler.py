@@ -0,0 +1,308 @@
+"""
+Очередь исходящих сообщений с ограничением частоты.
+
+Telegram принимает от бота не больше ~30 сообщений в секунду в сумме
+и около одного в секунду в один чат; сверх этого приходит 429 с retry_after,
+и telebot выбрасывает исключение прямо в обработчике. Планировщик ставит
+send_message и edit_message_text в очередь своего чата (порядок внутри чата
+сохраняется) и отправляет их с темпом двух token bucket — общего и чата.
+На 429 чат ставится на паузу на retry_after секунд, сообщение уходит повторно.
+Несколько правок одного сообщения подряд сливаются: уходит только последняя.
+
+    send_scheduler = install_send_scheduler(bot)   # SEND_SCHEDULER=0 — отправлять напрямую
+
+После install() bot.send_message и bot.edit_message_text сразу возвращают
+Future и ошибку отправки не выбрасывают: обработчик не ждёт темпа своего чата
+и не занимает поток polling, а порядок сообщений в чате остаётся прежним.
+Отправленный Message из результата bot.send_message (Future или Message,
+если планировщик выключен) получают через when_sent() в обработчиках
+и sent_message() в фоновых задачах. Окончательный ответ вместо заглушки
+ставьте через edit_or_send(): он дожидается правки и, если она не удалась,
+отправляет текст новым сообщением.
+
+Переменные окружения: SEND_GLOBAL_RATE (30 в секунду), SEND_CHAT_RATE (1),
+SEND_CHAT_BURST (3 сообщения подряд без паузы), SEND_WORKERS (8 потоков).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from telebot.apihelper import ApiTelegramException
+
+from metrics import MetricsRegistry
+from rate_limit import TokenBucket
+
+load_dotenv()
+
+
+class _Job:
+    """Один вызов метода бота; futures — всех слитых в него вызовов"""
+
+    __slots__ = ('method', 'args', 'kwargs', 'key', 'futures', 'attempts', 'enqueued_at')
+
+    def __init__(self, method, args, kwargs, key, future):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key              # (chat_id, message_id) для правок, иначе None
+        self.futures = [future]
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class _Chat:
+    __slots__ = ('jobs', 'bucket', 'busy')
+
+    def __init__(self, rate, burst):
+        self.jobs = deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.busy = False           # сообщение чата уже отправляется
+
+
+class SendScheduler:
+    """
+    Очереди по чатам, один поток-диспетчер и пул потоков отправки.
+    В каждом чате одновременно отправляется не больше одного сообщения,
+    поэтому порядок сохраняется, а медленный ответ Telegram в одном чате
+    не задерживает остальные.
+    """
+
+    METHODS = ('send_message', 'edit_message_text')
+
+    def __init__(self, bot, global_rate=None, chat_rate=None, chat_burst=None, workers=None,
+                 max_retries=5, max_chats=10000):
+        self.bot = bot
+        self.global_rate = float(global_rate or os.getenv('SEND_GLOBAL_RATE', '30'))
+        self.chat_rate = float(chat_rate or os.getenv('SEND_CHAT_RATE', '1'))
+        self.chat_burst = float(chat_burst or os.getenv('SEND_CHAT_BURST', '3'))
+        self.workers = int(workers or os.getenv('SEND_WORKERS', '8'))
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.metrics = MetricsRegistry()
+
+        # Настоящие методы бота — install() подменяет их на постановку в очередь
+        self._methods = {name: getattr(bot, name) for name in self.METHODS}
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats = OrderedDict()     # chat_id -> _Chat, давно пустые вытесняются
+        self._ready = deque()           # чаты с сообщениями в очереди и без отправки в процессе
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="send")
+        self._dispatcher = None
+
+    # -----------------------------
+    # Постановка в очередь
+    # -----------------------------
+    def submit(self, method, chat_id, args=(), kwargs=None):
+        """Поставить вызов bot.<method>(*args, **kwargs) в очередь чата chat_id; возвращает Future"""
+        kwargs = kwargs or {}
+        future = Future()
+        key = (chat_id, kwargs.get('message_id')) if method == 'edit_message_text' else None
+
+        with self._condition:
+            chat = self._chat(chat_id)
+            last = chat.jobs[-1] if chat.jobs else None
+            if key is not None and last is not None and last.key == key:
+                # Правка того же сообщения ещё не ушла — отправится только новый текст
+                last.args, last.kwargs = args, kwargs
+                last.futures.append(future)
+                self.metrics.incr('coalesced')
+            else:
+                chat.jobs.append(_Job(method, args, kwargs, key, future))
+                if not chat.busy and len(chat.jobs) == 1:
+                    self._ready.append(chat_id)
+            self.metrics.incr('submitted')
+            self._ensure_dispatcher()
+            self._condition.notify()
+        return future
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        return self.submit('send_message', chat_id, (chat_id, text) + args, kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        kwargs.update(chat_id=chat_id, message_id=message_id)
+        return self.submit('edit_message_text', chat_id, (text,) + args, kwargs)
+
+    def install(self):
+        """Направить bot.send_message и bot.edit_message_text через очередь"""
+        scheduler = self
+
+        def send_message(chat_id, text, *args, **kwargs):
+            # Не ждём отправки: обработчик, ждущий темпа своего чата, держал бы поток polling
+            return scheduler.send_message(chat_id, text, *args, **kwargs)
+
+        def edit_message_text(text, chat_id=None, message_id=None, *args, **kwargs):
+            return scheduler.edit_message_text(text, chat_id, message_id, *args, **kwargs)
+
+        self.bot.send_message = send_message
+        self.bot.edit_message_text = edit_message_text
+        return self
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+            if len(self._chats) > self.max_chats:
+                self._evict_idle()
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    def _evict_idle(self):
+        """Забыть давно неактивные чаты без сообщений в очереди"""
+        for chat_id in list(self._chats):
+            if len(self._chats) <= self.max_chats:
+                break
+            chat = self._chats[chat_id]
+            if not chat.jobs and not chat.busy:
+                del self._chats[chat_id]
+
+    # -----------------------------
+    # Отправка
+    # -----------------------------
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="send-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def _next_job(self):
+        """(chat_id, задача) следующего сообщения, которое можно отправить сейчас, или (None, сколько ждать)"""
+        if not self._ready:
+            return None, None
+        delay = self._global.peek()
+        if delay:
+            self.metrics.incr('throttled_global')
+            return None, delay
+
+        delay = None
+        for _ in range(len(self._ready)):
+            chat_id = self._ready.popleft()
+            chat = self._chats[chat_id]
+            chat_delay = chat.bucket.peek()
+            if not chat_delay:
+                self._global.try_acquire()
+                chat.bucket.try_acquire()
+                chat.busy = True
+                self._in_flight += 1
+                return chat_id, chat.jobs.popleft()
+            self._ready.append(chat_id)
+            delay = chat_delay if delay is None else min(delay, chat_delay)
+        return None, delay
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                chat_id, job = self._next_job()
+                while chat_id is None:
+                    # job — сколько ждать до следующего токена (None — очередь пуста)
+                    self._condition.wait(timeout=job)
+                    chat_id, job = self._next_job()
+            self._executor.submit(self._send, chat_id, job)
+
+    def _send(self, chat_id, job):
+        self.metrics.observe('queue_wait', time.monotonic() - job.enqueued_at)
+        try:
+            with self.metrics.timer(job.method):
+                result = self._methods[job.method](*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and job.attempts < self.max_retries:
+                self._retry_later(chat_id, job, (e.result_json.get('parameters') or {}).get('retry_after', 1))
+                return
+            self._fail(chat_id, job, e)
+        except Exception as e:
+            self._fail(chat_id, job, e)
+        else:
+            self.metrics.incr('sent')
+            for future in job.futures:
+                future.set_result(result)
+        self._finish(chat_id)
+
+    def _retry_later(self, chat_id, job, retry_after):
+        """429: чат на паузе retry_after секунд, сообщение возвращается в начало его очереди"""
+        self.metrics.incr('retries_429')
+        print(f"⚠️ Telegram просит подождать {retry_after} с (чат {chat_id})")
+        job.attempts += 1
+        with self._condition:
+            chat = self._chats[chat_id]
+            chat.bucket.penalize(retry_after)
+            following = chat.jobs[0] if chat.jobs else None
+            if job.key is not None and following is not None and following.key == job.key:
+                # Пока ждали, пришла новая правка того же сообщения — старый текст не нужен
+                following.futures[:0] = job.futures
+                self.metrics.incr('coalesced')
+            else:
+                chat.jobs.appendleft(job)
+        self._finish(chat_id)
+
+    def _fail(self, chat_id, job, error):
+        self.metrics.incr('failed')
+        print(f"❌ Не удалось выполнить {job.method} (чат {chat_id}): {error}")
+        for future in job.futures:
+            future.set_exception(error)
+
+    def _finish(self, chat_id):
+        with self._condition:
+            self._in_flight -= 1
+            chat = self._chats[chat_id]
+            chat.busy = False
+            if chat.jobs:
+                self._ready.append(chat_id)
+            self._condition.notify()
+
+    def stats(self):
+        """Глубина очередей, отправки в процессе, время ожидания и отправки"""
+        stats = self.metrics.snapshot()
+        with self._condition:
+            stats['queue_depth'] = sum(len(chat.jobs) for chat in self._chats.values())
+            stats['chats_waiting'] = len(self._ready)
+            stats['chats'] = len(self._chats)
+            stats['in_flight'] = self._in_flight
+        return stats
+
+
+def sent_message(result):
+    """
+    Message из результата bot.send_message: Future из очереди ждёт,
+    поэтому вызывается из фоновых задач, а не из обработчиков.
+    """
+    return result.result() if isinstance(result, Future) else result
+
+
+def when_sent(result, callback):
+    """Вызвать callback(message), когда результат bot.send_message отправлен (не отправлен — не вызывать)"""
+    if not isinstance(result, Future):
+        callback(result)
+        return
+
+    def done(future):
+        # Выполняется в потоке отправки: callback не должен ждать очередь
+        if future.exception() is None:
+            callback(future.result())
+
+    result.add_done_callback(done)
+
+
+def edit_or_send(bot, chat_id, message, text, **kwargs):
+    """
+    Заменить текст сообщения message (результат bot.send_message), а если правка
+    не удалась — отправить текст новым сообщением. Отправку и правку из очереди
+    ждёт, поэтому вызывается из фоновых задач, а не из обработчиков.
+    """
+    try:
+        message_id = sent_message(message).message_id
+        result = bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+        if isinstance(result, Future):
+            result = result.result()
+        return result
+    except Exception:
+        return bot.send_message(chat_id, text, **kwargs)
+
+
+def install_send_scheduler(bot):
+    """Планировщик для bot по переменной SEND_SCHEDULER (включён по умолчанию); None — отправка напрямую"""
+    if os.getenv('SEND_SCHEDULER', '1') == '0':
+        return None
+    return SendScheduler(bot).install()
@@ -0,0 +1,384 @@
+"""
+Состояние пользователей бота: одна компактная сессия на чат.
+
+    from sessions import SessionStore
+    sessions = SessionStore("pgbot")
+    session = sessions.get(chat_id)
+    session.role = "Школьник"
+    session.push_navigation("country_menu")
+    sessions.peek(chat_id).state      # только прочитать (фильтры обработчиков)
+
+Сессии живут в памяти не дольше SESSION_IDLE_TTL секунд без активности
+и не больше SESSION_MAX чатов одновременно; изменения раз в
+SESSION_FLUSH_INTERVAL секунд сохраняются в хранилище (SESSION_BACKEND:
+sqlite — файл SESSION_DB_PATH, memory — без сохранения между перезапусками).
+Сессия сама отмечает себя изменённой при записи любого поля, поэтому
+изменение, сделанное во время сохранения, уйдёт следующим. Чтение и запись
+хранилища идут без общей блокировки: обработчики других чатов их не ждут.
+
+У каждого бота свой файл сессий: к SESSION_DB_PATH (sessions.sqlite3)
+добавляется имя бота — sessions.pgbot.sqlite3, sessions.gemini.sqlite3, ...
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько шагов помнит кнопка «Назад»
+NAVIGATION_LIMIT = 20
+
+
+class _TrackedList(list):
+    """navigation: список, который сообщает сессии о каждом изменении"""
+
+    __slots__ = ('_session',)
+
+    def __init__(self, items, session):
+        super().__init__(items)
+        self._session = session
+
+
+class _TrackedSet(set):
+    """expanded: множество, которое сообщает сессии о каждом изменении"""
+
+    __slots__ = ('_session',)
+
+    def __init__(self, items, session):
+        super().__init__(items)
+        self._session = session
+
+
+def _tracking(method):
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._session.changed()
+        return result
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in ('append', 'extend', 'insert', 'pop', 'remove', 'clear', 'reverse', 'sort',
+              '__setitem__', '__delitem__', '__iadd__'):
+    setattr(_TrackedList, _name, _tracking(getattr(list, _name)))
+for _name in ('add', 'discard', 'remove', 'pop', 'clear', 'update', 'difference_update',
+              'intersection_update', 'symmetric_difference_update', '__ior__', '__iand__', '__isub__', '__ixor__'):
+    setattr(_TrackedSet, _name, _tracking(getattr(set, _name)))
+
+
+class Session:
+    """Состояние одного чата"""
+
+    __slots__ = ('chat_id', 'role', 'country', 'direction', 'state',
+                 'card', 'expanded', 'navigation', 'last_seen', '_store')
+
+    # Поля, которые сохраняются в хранилище: их изменение делает сессию «грязной»
+    PERSISTED = frozenset(('role', 'country', 'direction', 'state', 'card', 'expanded', 'navigation'))
+
+    def __init__(self, chat_id):
+        self._store = None      # SessionStore, которому сообщать об изменениях
+        self.chat_id = chat_id
+        self.role = None        # категория пользователя
+        self.country = None     # выбранная страна
+        self.direction = None   # выбранное направление
+        self.state = None       # режим (например, "ai_assistant")
+        self.card = None        # открытая карточка университета (id или название)
+        self.expanded = set()   # раскрытые разделы карточки
+        self.navigation = []    # предыдущие состояния для «Назад», не больше NAVIGATION_LIMIT
+        self.last_seen = time.monotonic()
+
+    def __setattr__(self, name, value):
+        if name == 'navigation':
+            value = _TrackedList(value, self)
+        elif name == 'expanded':
+            value = _TrackedSet(value, self)
+        object.__setattr__(self, name, value)
+        if name in self.PERSISTED:
+            self.changed()
+
+    def changed(self):
+        """Отметить сессию изменённой (вызывается после каждого изменения)"""
+        if self._store is not None:
+            self._store._mark_dirty(self.chat_id)
+
+    def push_navigation(self, state):
+        """Запомнить состояние для «Назад»; самые старые шаги забываются"""
+        self.navigation.append(state)
+        if len(self.navigation) > NAVIGATION_LIMIT:
+            del self.navigation[:-NAVIGATION_LIMIT]
+
+    def open_card(self, card):
+        """Открыта новая карточка университета — все разделы свёрнуты"""
+        self.card = card
+        self.expanded = set()
+
+    def to_dict(self):
+        return {
+            'role': self.role,
+            'country': self.country,
+            'direction': self.direction,
+            'state': self.state,
+            'card': self.card,
+            'expanded': sorted(self.expanded),
+            'navigation': list(self.navigation),
+        }
+
+    @classmethod
+    def from_dict(cls, chat_id, data):
+        session = cls(chat_id)
+        session.role = data.get('role')
+        session.country = data.get('country')
+        session.direction = data.get('direction')
+        session.state = data.get('state')
+        session.card = data.get('card')
+        session.expanded = set(data.get('expanded', ()))
+        session.navigation = list(data.get('navigation', ()))[-NAVIGATION_LIMIT:]
+        return session
+
+
+# -----------------------------
+# Хранилища
+# -----------------------------
+class MemoryBackend:
+    """Без сохранения: сессии теряются при перезапуске и после простоя"""
+
+    def load(self, chat_id):
+        return None
+
+    def save_many(self, items):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Сессии в файле SQLite — переживают перезапуск бота"""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    chat_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._connection.commit()
+
+    def load(self, chat_id):
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, items):
+        """items: список (chat_id, dict)"""
+        now = time.time()
+        rows = [(chat_id, json.dumps(data, ensure_ascii=False), now) for chat_id, data in items]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?)", rows
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def backend_from_env(name=None):
+    """
+    Хранилище по переменной SESSION_BACKEND (sqlite по умолчанию).
+    name — имя бота: у каждого бота свой файл, значения state и card у них разные.
+    """
+    if os.getenv('SESSION_BACKEND', 'sqlite') == 'memory':
+        return MemoryBackend()
+    path = os.getenv('SESSION_DB_PATH', 'sessions.sqlite3')
+    if name:
+        root, extension = os.path.splitext(path)
+        path = f"{root}.{name}{extension}"
+    return SQLiteBackend(path)
+
+
+# -----------------------------
+# Хранилище сессий
+# -----------------------------
+class SessionStore:
+    """
+    Сессии в памяти (LRU, не больше max_sessions) с вытеснением простаивающих
+    дольше idle_ttl. Изменённые сессии периодически сохраняются в backend;
+    при следующем обращении вытесненная сессия загружается оттуда.
+    name — имя бота для отдельного файла сессий (см. backend_from_env).
+    """
+
+    def __init__(self, name=None, backend=None, idle_ttl=None, max_sessions=None, flush_interval=None):
+        self.name = name
+        self.backend = backend if backend is not None else backend_from_env(name)
+        self.idle_ttl = float(idle_ttl or os.getenv('SESSION_IDLE_TTL', '86400'))
+        self.max_sessions = int(max_sessions or os.getenv('SESSION_MAX', '10000'))
+        self.flush_interval = float(flush_interval or os.getenv('SESSION_FLUSH_INTERVAL', '30'))
+
+        self._sessions = OrderedDict()   # chat_id -> Session
+        self._dirty = set()             # chat_id сессий, изменённых после последнего сохранения
+        self._unsaved = {}              # chat_id -> dict выгруженных из памяти, но ещё не сохранённых
+        self._saving = {}               # chat_id -> dict, которые flush сейчас записывает
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()   # flush по одному: старый снимок не перезапишет новый
+        self._stats = {'loads': 0, 'created': 0, 'evicted_idle': 0, 'evicted_lru': 0, 'flushes': 0, 'saved': 0}
+        self._flusher = None
+        atexit.register(self.close)
+
+    def get(self, chat_id):
+        """Сессия чата (из памяти, из хранилища или новая)"""
+        session = self._lookup(chat_id, touch=True)
+        session.last_seen = time.monotonic()
+        self._ensure_flusher()
+        return session
+
+    def peek(self, chat_id):
+        """
+        Сессия чата для чтения (фильтры обработчиков): не продлевает жизнь сессии.
+        Сессия, которой нет в памяти, загружается туда (или создаётся пустой),
+        поэтому следующее обновление чата и get() в обработчике не читают диск.
+        """
+        return self._lookup(chat_id, touch=False)
+
+    def _lookup(self, chat_id, touch):
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None:
+                if touch:
+                    self._sessions.move_to_end(chat_id)
+                return session
+            flushes = self._stats['flushes']
+
+        # Чтение с диска — без блокировки, чтобы не задерживать остальные чаты
+        data = self.backend.load(chat_id)
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None:
+                # Пока читали, сессию загрузил другой поток
+                if touch:
+                    self._sessions.move_to_end(chat_id)
+                return session
+            if self._stats['flushes'] != flushes:
+                # Пока читали, flush мог записать более новую версию
+                data = self.backend.load(chat_id)
+            session = self._load(chat_id, data)
+            self._sessions[chat_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._evict(next(iter(self._sessions)), 'evicted_lru')
+            return session
+
+    def _load(self, chat_id, data):
+        # Выгруженная, но ещё не записанная сессия новее той, что в хранилище
+        if chat_id in self._unsaved:
+            data = self._unsaved.pop(chat_id)
+            self._dirty.add(chat_id)
+        elif chat_id in self._saving:
+            data = self._saving[chat_id]
+        if data is not None:
+            self._stats['loads'] += 1
+            session = Session.from_dict(chat_id, data)
+        else:
+            self._stats['created'] += 1
+            session = Session(chat_id)
+        session._store = self
+        return session
+
+    def _mark_dirty(self, chat_id):
+        # Уже отмечена: flush ещё не брал снимок — изменение в него попадёт
+        if chat_id in self._dirty:
+            return
+        with self._lock:
+            self._dirty.add(chat_id)
+
+    def _evict(self, chat_id, reason):
+        session = self._sessions.pop(chat_id)
+        if chat_id in self._dirty:
+            # Запишется при следующем flush — не под блокировкой
+            self._dirty.discard(chat_id)
+            self._unsaved[chat_id] = session.to_dict()
+        self._stats[reason] += 1
+
+    def evict_idle(self):
+        """Выгрузить из памяти сессии, простаивающие дольше idle_ttl"""
+        deadline = time.monotonic() - self.idle_ttl
+        with self._lock:
+            # OrderedDict упорядочен по последнему обращению — простаивающие в начале
+            while self._sessions:
+                chat_id, session = next(iter(self._sessions.items()))
+                if session.last_seen > deadline:
+                    break
+                self._evict(chat_id, 'evicted_idle')
+
+    def flush(self):
+        """
+        Сохранить изменённые и выгруженные сессии в хранилище. Снимок делается
+        под блокировкой, запись — без неё; сессия, изменённая после снимка,
+        снова отмечается и сохранится при следующем flush
+        """
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                items, self._unsaved = self._unsaved, {}
+                for chat_id in dirty:
+                    if chat_id in self._sessions:
+                        items[chat_id] = self._sessions[chat_id].to_dict()
+                self._saving = items
+            try:
+                if items:
+                    self.backend.save_many(list(items.items()))
+            except Exception:
+                with self._lock:
+                    # Не записалось — вернуть в очередь на следующий flush
+                    for chat_id, data in items.items():
+                        if chat_id in self._sessions:
+                            self._dirty.add(chat_id)
+                        else:
+                            self._unsaved.setdefault(chat_id, data)
+                    self._saving = {}
+                raise
+            with self._lock:
+                self._saving = {}
+                self._stats['saved'] += len(items)
+                self._stats['flushes'] += 1
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.evict_idle()
+                self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка при сохранении сессий: {e}")
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_memory'] = len(self._sessions)
+            stats['dirty'] = len(self._dirty) + len(self._unsaved)
+            stats['max_sessions'] = self.max_sessions
+            return stats
+
+    def close(self):
+        """Сохранить всё и закрыть хранилище"""
+        self.flush()
+        self.backend.close()
@@ -0,0 +1,220 @@
+"""
+Сверка AsyncDatabase с синхронной Database.
+
+Без PostgreSQL обе версии работают на заглушке соединения: они должны
+отправить одинаковые запросы с одинаковыми параметрами и собрать одинаковый
+результат. Если база доступна (DB_HOST, DB_PORT, ... как у ботов), результаты
+сверяются ещё и на настоящих данных; иначе этот тест пропускается.
+
+    python -m pytest test_async_database.py
+"""
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+
+import pytest
+
+from async_database import AsyncDatabase
+from database import UNIVERSITY_SECTION_QUERIES, Database, numbered_placeholders as to_asyncpg
+
+
+def _normalize(value):
+    """Привести записи psycopg2/asyncpg к обычным dict/list для сравнения"""
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if hasattr(value, 'keys'):
+        return {key: value[key] for key in value.keys()}
+    return value
+
+
+# -----------------------------
+# Заглушка соединения
+# -----------------------------
+class _FakeRow(dict):
+    """Строка результата: row['name'] и row[0], как у DictRow и asyncpg.Record"""
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+FAKE_ROW = _FakeRow(
+    id=1, name="TUM", card="Технический университет Мюнхена", website="https://www.tum.de",
+    country_name="Германия", country_id=1,
+    programs=[{'name': "Informatics", 'degree': "Bachelor", 'language': "English", 'price': "0 €"}],
+    documents="Аттестат", scholarships="DAAD", deadlines="15 июля", process="Подача через TUMonline",
+    links={'website': "https://www.tum.de", 'admissions': None, 'scholarships': None},
+    degree="Bachelor", language="English", price="0 €",
+)
+
+
+class _FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.connection.queries.append((to_asyncpg(query), tuple(params or ())))
+
+    def fetchall(self):
+        return [FAKE_ROW]
+
+    def fetchone(self):
+        return FAKE_ROW
+
+
+class _FakeConnection:
+    """Записывает запросы и отвечает одной и той же строкой — и для psycopg2, и для asyncpg"""
+
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self, cursor_factory=None):
+        return _FakeCursor(self)
+
+    async def fetch(self, query, *params):
+        self.queries.append((query, params))
+        return [FAKE_ROW]
+
+    async def fetchval(self, query, *params):
+        return (await self.fetch(query, *params))[0][0]
+
+
+OFFLINE_CHECKS = [
+    ("get_countries", ()),
+    ("get_universities_by_country", ("Германия",)),
+    ("get_universities_by_country_id", (1,)),
+    ("get_university_by_name", ("Германия", "TUM")),
+    ("get_university_by_id", (1,)),
+    ("get_universities_full", ([3, 1, 2],)),
+    ("search_universities_by_direction", ("it",)),
+] + [("get_university_section", (1, section)) for section in UNIVERSITY_SECTION_QUERIES]
+
+
+def _offline_databases(cache):
+    """Database и AsyncDatabase, у которых get_connection выдаёт заглушку"""
+    sync_db = Database(cache=cache, prepared=False)
+    async_db = AsyncDatabase(cache=cache)
+    sync_connection, async_connection = _FakeConnection(), _FakeConnection()
+
+    @contextmanager
+    def sync_connection_context():
+        yield sync_connection
+
+    @asynccontextmanager
+    async def async_connection_context():
+        yield async_connection
+
+    sync_db.get_connection = sync_connection_context
+    async_db.get_connection = async_connection_context
+    return sync_db, async_db, sync_connection, async_connection
+
+
+@pytest.fixture
+def offline():
+    return _offline_databases(cache=False)
+
+
+@pytest.fixture
+def offline_cached():
+    return _offline_databases(cache=True)
+
+
+# -----------------------------
+# Без базы
+# -----------------------------
+@pytest.mark.parametrize("name, args", OFFLINE_CHECKS, ids=[name for name, _ in OFFLINE_CHECKS])
+def test_same_queries_and_results(offline, name, args):
+    sync_db, async_db, sync_connection, async_connection = offline
+    expected = _normalize(getattr(sync_db, name)(*args))
+    actual = _normalize(asyncio.run(getattr(async_db, name)(*args)))
+    assert actual == expected
+    assert async_connection.queries == sync_connection.queries
+
+
+def test_same_stats(offline):
+    sync_db, async_db, _, _ = offline
+
+    async def run_async():
+        for name, args in OFFLINE_CHECKS:
+            await getattr(async_db, name)(*args)
+
+    for name, args in OFFLINE_CHECKS:
+        getattr(sync_db, name)(*args)
+    asyncio.run(run_async())
+
+    def counts(database):
+        return {name: (stats['count'], stats['errors'], stats['rows'])
+                for name, stats in database.stats.snapshot()['latency'].items()}
+
+    assert counts(async_db) == counts(sync_db)
+
+
+def test_universities_full_uses_card_cache(offline_cached):
+    """Карточки из кэша get_university_by_id в базу повторно не запрашиваются — в обеих версиях"""
+    sync_db, async_db, sync_connection, async_connection = offline_cached
+
+    async def run_async():
+        await async_db.get_university_by_id(1)
+        async_connection.queries.clear()
+        return await async_db.get_universities_full([1])
+
+    sync_db.get_university_by_id(1)
+    sync_connection.queries.clear()
+    expected = _normalize(sync_db.get_universities_full([1]))
+    actual = _normalize(asyncio.run(run_async()))
+
+    assert actual == expected
+    assert sync_connection.queries == []
+    assert async_connection.queries == []
+
+
+# -----------------------------
+# На настоящей базе
+# -----------------------------
+@pytest.fixture
+def live_db():
+    db = Database(cache=False)
+    try:
+        db.warmup()
+    except Exception as e:
+        pytest.skip(f"PostgreSQL недоступен: {e}")
+    yield db
+    db.close()
+
+
+def test_live_parity(live_db):
+    checks = [("get_countries", ())]
+    university_ids = []
+    for country in live_db.get_countries():
+        checks.append(("get_universities_by_country", (country['name'],)))
+        checks.append(("get_universities_by_country_id", (country['id'],)))
+        for university in live_db.get_universities_by_country(country['name']):
+            university_ids.append(university['id'])
+            checks.append(("get_university_by_name", (country['name'], university['name'])))
+            checks.append(("get_university_by_id", (university['id'],)))
+            for section in UNIVERSITY_SECTION_QUERIES:
+                checks.append(("get_university_section", (university['id'], section)))
+    for direction in ("business", "it", "medicine", "art"):
+        checks.append(("search_universities_by_direction", (direction,)))
+    checks.append(("get_university_by_name", ("—", "—")))
+    checks.append(("get_universities_full", (university_ids[::-1] + [-1],)))
+
+    async def run_async():
+        # Пул asyncpg привязан к event loop — все вызовы в одном asyncio.run
+        async_db = AsyncDatabase(cache=False)
+        try:
+            return [_normalize(await getattr(async_db, name)(*args)) for name, args in checks]
+        finally:
+            await async_db.close()
+
+    expected = [_normalize(getattr(live_db, name)(*args)) for name, args in checks]
+    actual = asyncio.run(run_async())
+    mismatches = [f"{name}{args}" for (name, args), a, e in zip(checks, actual, expected) if a != e]
+    assert not mismatches, f"результаты различаются: {mismatches}"
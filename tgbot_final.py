@@ -3,6 +3,8 @@ from telebot.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeybo
 import openai
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from webhook import run_bot
+from send_scheduler import install_send_scheduler
 
 # -----------------------------
 # Настройки бота и ИИ
@@ -16,6 +18,10 @@ with open("app/data/openrouter.txt", "r", encoding="utf-8") as f:
 openai.api_key = openrouter_key
 bot = telebot.TeleBot(TOKEN)
 
+# Исходящие сообщения — через очередь с ограничениями Telegram (30/с на бота, ~1/с на чат);
+# SEND_SCHEDULER=0 — отправлять напрямую
+send_scheduler = install_send_scheduler(bot)
+
 # -----------------------------
 # Подключение к PostgreSQL
 # -----------------------------
@@ -254,4 +260,4 @@ def uni_selected(call):
 # -----------------------------
 if __name__ == "__main__":
     print("Бот запущен...")
-    bot.infinity_polling()
+    run_bot(bot)  # BOT_MODE=webhook — через webhook, иначе polling
@@ -0,0 +1,304 @@
+"""
+Запуск ботов через webhook вместо long polling.
+
+Telegram присылает обновления POST-запросами; сервер проверяет секретный
+токен, отбрасывает повторы (по update_id) и передаёт обновление в пул
+потоков, где его обрабатывают те же хендлеры telebot, что и при polling.
+Без секрета сервер не работает: если WEBHOOK_SECRET не задан, секрет
+генерируется при запуске и передаётся Telegram в set_webhook. Очередь
+ограничена (WEBHOOK_QUEUE_SIZE): при переполнении сервер отвечает 503,
+и Telegram присылает обновление позже. Статистика отдаётся GET-запросом
+только на WEBHOOK_STATS_PATH (по умолчанию выключена), GET /healthz — проверка,
+что сервер жив.
+
+Режим выбирается переменными окружения (см. run_bot):
+    BOT_MODE=polling                  — как раньше, bot.infinity_polling()
+    BOT_MODE=webhook WEBHOOK_URL=https://example.com
+                                      — сервер на WEBHOOK_HOST:WEBHOOK_PORT
+                                        (без WEBHOOK_URL webhook регистрируется
+                                        вручную, и WEBHOOK_SECRET обязателен)
+    BOT_MODE=off                      — не принимать обновления (модуль бота
+                                        импортирует, например, replay_bench.py)
+
+Отправить боту тестовое обновление (бот запущен с BOT_MODE=webhook
+и тем же WEBHOOK_SECRET):
+    python webhook.py --text "/start"
+    python webhook.py --callback "role_school"
+"""
+import argparse
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+from telebot import types
+
+from metrics import MetricsRegistry
+
+load_dotenv()
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+HEALTH_PATH = "/healthz"
+MAX_BODY_SIZE = 1024 * 1024   # обновления Telegram намного меньше
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для webhook Telegram.
+    Ответ 200 отправляется сразу после постановки обновления в очередь —
+    Telegram не ждёт, пока хендлер закончит работу.
+    """
+
+    def __init__(self, bot, host=None, port=None, path=None, secret_token=None, workers=None, dedupe_size=10000,
+                 queue_size=None, stats_path=None):
+        self.bot = bot
+        self.host = host or os.getenv('WEBHOOK_HOST', '0.0.0.0')
+        self.port = int(port or os.getenv('WEBHOOK_PORT', '8443'))
+        self.path = path or os.getenv('WEBHOOK_PATH', '/telegram')
+        self.secret_token = secret_token if secret_token is not None else os.getenv('WEBHOOK_SECRET', '')
+        self.secret_generated = not self.secret_token
+        if self.secret_generated:
+            # Без секрета поддельные обновления мог бы прислать кто угодно
+            self.secret_token = secrets.token_urlsafe(32)
+            print("⚠️ WEBHOOK_SECRET не задан — сгенерирован секрет на время этого запуска")
+        self._secret = self.secret_token.encode('utf-8')
+        self.workers = int(workers or os.getenv('WEBHOOK_WORKERS', '8'))
+        # Обновления в очереди и в обработке; сверх этого — 503
+        self.queue_size = int(queue_size or os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+        self.stats_path = stats_path if stats_path is not None else os.getenv('WEBHOOK_STATS_PATH', '')
+        self.dedupe_size = dedupe_size
+        self.metrics = MetricsRegistry()
+
+        # Хендлеры выполняются прямо в потоках пула, без второго пула telebot
+        bot.threaded = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="webhook")
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._pending = 0
+        self._seen = OrderedDict()   # последние dedupe_size update_id
+        self._seen_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length', ''))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    server.metrics.incr('bad_requests')
+                    status = 400
+                elif length > MAX_BODY_SIZE:
+                    server.metrics.incr('bad_requests')
+                    status = 413
+                else:
+                    status = server.handle_post(self.path, self.headers, self.rfile.read(length))
+                self.send_response(status)
+                if status in (400, 413):
+                    # Тело запроса не прочитано — соединение дальше не используем
+                    self.send_header('Connection', 'close')
+                    self.close_connection = True
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path == HEALTH_PATH:
+                    self._reply(200, {'ok': True})
+                elif server.stats_path and self.path == server.stats_path:
+                    self._reply(200, server.stats())
+                else:
+                    self._reply(404, {'ok': False})
+
+            def _reply(self, status, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle_post(self, path, headers, body):
+        """Разобрать запрос от Telegram; возвращает HTTP-статус"""
+        if path != self.path:
+            return 404
+        # Сравниваются байты: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('utf-8', 'replace'), self._secret):
+            self.metrics.incr('forbidden')
+            return 403
+
+        try:
+            data = json.loads(body)
+            update_id = data['update_id']
+            if not isinstance(update_id, int):
+                raise TypeError(update_id)
+        except (ValueError, KeyError, TypeError):
+            self.metrics.incr('bad_requests')
+            return 400
+
+        # Место в очереди занимается до проверки на повтор: обновление, на которое
+        # ответили 503, Telegram пришлёт снова, и оно не должно считаться повтором
+        if not self._slots.acquire(blocking=False):
+            self.metrics.incr('rejected_full')
+            return 503
+        if self._is_duplicate(update_id):
+            self._slots.release()
+            self.metrics.incr('duplicates')
+            return 200
+
+        self.metrics.incr('received')
+        with self._seen_lock:
+            self._pending += 1
+        self._executor.submit(self._dispatch, time.monotonic(), data)
+        return 200
+
+    def _is_duplicate(self, update_id):
+        with self._seen_lock:
+            if update_id in self._seen:
+                return True
+            self._seen[update_id] = None
+            if len(self._seen) > self.dedupe_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def _dispatch(self, received_at, data):
+        self.metrics.observe('queue_wait', time.monotonic() - received_at)
+        try:
+            with self.metrics.timer('update'):
+                self.bot.process_new_updates([types.Update.de_json(data)])
+        except Exception as e:
+            print(f"❌ Ошибка при обработке обновления {data.get('update_id')}: {e}")
+        finally:
+            with self._seen_lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def set_webhook(self, url):
+        """Зарегистрировать webhook в Telegram (url — публичный адрес без пути)"""
+        self.bot.remove_webhook()
+        self.bot.set_webhook(url=url.rstrip('/') + self.path, secret_token=self.secret_token,
+                             max_connections=self.workers)
+
+    def serve_forever(self):
+        print(f"✅ Webhook-сервер слушает {self.host}:{self.port}{self.path} (потоков: {self.workers})")
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        stats['workers'] = self.workers
+        stats['queue_size'] = self.queue_size
+        with self._seen_lock:
+            stats['pending'] = self._pending
+        return stats
+
+
+def run_bot(bot):
+    """Запустить бота в режиме BOT_MODE: polling (по умолчанию), webhook или off"""
+    mode = os.getenv('BOT_MODE', 'polling')
+    if mode == 'off':
+        return
+    if mode != 'webhook':
+        bot.remove_webhook()
+        bot.infinity_polling()
+        return
+
+    url = os.getenv('WEBHOOK_URL')
+    if not url and not os.getenv('WEBHOOK_SECRET'):
+        # Webhook регистрируют вручную — сгенерированный секрет Telegram не узнает
+        raise SystemExit("❌ Без WEBHOOK_URL нужен WEBHOOK_SECRET: тот же секрет укажите при регистрации webhook")
+
+    server = WebhookServer(bot)
+    if url:
+        server.set_webhook(url)
+    else:
+        print("⚠️ WEBHOOK_URL не задан — webhook в Telegram не регистрируется")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+# -----------------------------
+# Тестовые обновления
+# -----------------------------
+def make_message_update(update_id, chat_id, text):
+    """Обновление с текстовым сообщением пользователя"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Test'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+def make_callback_update(update_id, chat_id, data, message_id=1):
+    """Обновление с нажатием inline-кнопки"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Test'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+            },
+        },
+    }
+
+
+def post_update(url, update, secret_token=None):
+    """POST обновления на webhook-сервер, возвращает HTTP-статус"""
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode('utf-8'), method='POST',
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret_token or ''}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправить тестовое обновление на webhook-сервер")
+    parser.add_argument("--url", default=f"http://localhost:{os.getenv('WEBHOOK_PORT', '8443')}{os.getenv('WEBHOOK_PATH', '/telegram')}")
+    parser.add_argument("--secret", default=os.getenv('WEBHOOK_SECRET', ''))
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--update-id", type=int, default=int(time.time() * 1000))
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--text")
+    group.add_argument("--callback")
+    args = parser.parse_args()
+
+    if args.text is not None:
+        update = make_message_update(args.update_id, args.chat_id, args.text)
+    else:
+        update = make_callback_update(args.update_id, args.chat_id, args.callback)
+    print(post_update(args.url, update, args.secret))